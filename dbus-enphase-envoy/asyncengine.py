@@ -0,0 +1,254 @@
+#!/usr/bin/env python
+
+import asyncio
+import logging
+import ssl
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+from urllib.parse import urlsplit
+
+from envoysession import check_fingerprint
+from scheduler import is_delay, next_delay
+
+
+class StreamResponse:
+    """Response of stream_get() with the body still on the connection."""
+
+    def __init__(self, reader, writer, status_code, headers, elapsed, timeout):
+        self.reader = reader
+        self.writer = writer
+        self.status_code = status_code
+        self.headers = headers
+        # seconds until the header was received, like requests.Response.elapsed
+        self.elapsed = elapsed
+        self.timeout = timeout
+        self.chunked = headers.get("transfer-encoding", "").lower() == "chunked"
+
+    async def _read(self, coroutine):
+        # every read has its own timeout, like the read timeout of requests
+        return await asyncio.wait_for(coroutine, self.timeout)
+
+    async def iter_content(self, chunk_size):
+        """Yield the body in chunks of at most chunk_size bytes until the connection is closed."""
+        if not self.chunked:
+            while True:
+                data = await self._read(self.reader.read(chunk_size))
+                if not data:
+                    return
+                yield data
+
+        while True:
+            line = await self._read(self.reader.readline())
+            if not line:
+                return
+            size = int(line.split(b";", 1)[0], 16)
+            if size == 0:
+                return
+
+            while size > 0:
+                data = await self._read(self.reader.read(min(size, chunk_size)))
+                if not data:
+                    raise ConnectionError("Connection closed in the middle of a chunk")
+                size -= len(data)
+                yield data
+
+            # CRLF after the chunk data
+            await self._read(self.reader.readexactly(2))
+
+    async def read(self):
+        """Return the complete body, for responses with Content-Length."""
+        length = int(self.headers.get("content-length", 0))
+        return await self._read(self.reader.readexactly(length)) if length > 0 else b""
+
+    def close(self):
+        self.writer.close()
+
+
+async def _request(url, headers, timeout, fingerprint=None):
+    parts = urlsplit(url)
+    if parts.scheme == "https":
+        # the Envoy uses a self-signed certificate, it is either pinned or not verified (like verify=False of requests)
+        context = ssl.create_default_context()
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+        port = parts.port or 443
+    else:
+        context = None
+        port = parts.port or 80
+
+    time_start = monotonic()
+    reader, writer = await asyncio.wait_for(asyncio.open_connection(parts.hostname, port, ssl=context), timeout)
+
+    # a pinned certificate is checked after the handshake, before the credentials are sent
+    ssl_object = writer.get_extra_info("ssl_object")
+    if fingerprint and ssl_object is not None:
+        try:
+            check_fingerprint(ssl_object.getpeercert(binary_form=True), fingerprint)
+        except ssl.SSLError:
+            writer.close()
+            raise
+
+    path = parts.path + ("?" + parts.query if parts.query else "")
+    request = "GET %s HTTP/1.1\r\nHost: %s\r\nAccept: */*\r\nConnection: close\r\n" % (path or "/", parts.netloc)
+    for name, value in headers.items():
+        request += "%s: %s\r\n" % (name, value)
+    writer.write(request.encode("latin-1") + b"\r\n")
+
+    try:
+        head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), timeout)
+    except BaseException:
+        writer.close()
+        raise
+
+    lines = head.decode("latin-1").split("\r\n")
+    status_code = int(lines[0].split(" ", 2)[1])
+    response_headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            response_headers[name.strip().lower()] = value.strip()
+
+    return StreamResponse(reader, writer, status_code, response_headers, monotonic() - time_start, timeout)
+
+
+async def stream_get(url, headers=None, auth=None, timeout=60, fingerprint=None):
+    """Send a GET request and return the StreamResponse as soon as the header is received.
+
+    auth: a DigestAuth, answers its last challenge right away and a new challenge of a 401 response with a second request
+    fingerprint: SHA-256 of the certificate, connections to another certificate are closed with an ssl.SSLError
+    """
+    headers = dict(headers or {})
+    authorization = auth.header("GET", url) if auth is not None else None
+    if authorization is not None:
+        headers["Authorization"] = authorization
+    response = await _request(url, headers, timeout, fingerprint)
+
+    if response.status_code == 401 and auth is not None and auth.challenge(response.headers.get("www-authenticate", "")):
+        authorization = auth.header("GET", url)
+        if authorization is not None:
+            await response.read()
+            response.close()
+            headers["Authorization"] = authorization
+            response = await _request(url, headers, timeout, fingerprint)
+
+    return response
+
+
+class AsyncEngine:
+    """Runs the fetch tasks of all gateways as coroutines of one asyncio event loop in its own thread.
+
+    The stream readers are native coroutines. Blocking calls, like the polled requests and the token
+    renewal, run in a thread pool. Its workers are only started when they are needed, max_workers
+    should cover the tasks which can block at the same time. stop() cancels all tasks at once, also
+    the ones which wait for a timeout.
+    """
+
+    def __init__(self, max_workers=4):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="Thread-AsyncEngine")
+        self._coroutines = []
+        self._tasks = []
+        self._thread = None
+        # interval and wakeup event of every periodic task, set_interval() changes them
+        self._intervals = {}
+        self._wakeups = {}
+
+    def spawn(self, coroutine):
+        """Run the coroutine as task, when the engine is started."""
+        if self._thread is None:
+            self._coroutines.append(coroutine)
+        else:
+            self.loop.call_soon_threadsafe(self._start_task, coroutine)
+
+    def periodic(self, name, interval, function, *args, blocking=True):
+        """Call function(*args) every interval seconds or after the seconds it returned, blocking functions in the thread pool."""
+        self.spawn(self._periodic(name, interval, function, args, blocking))
+
+    def set_interval(self, name, interval):
+        """Change the interval of a periodic task, can be called from any thread."""
+        self.loop.call_soon_threadsafe(self._set_interval, name, interval)
+
+    async def run_blocking(self, function, *args):
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="Thread-AsyncEngine")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Cancel all tasks and stop the event loop, can be called from any thread."""
+        if self._thread is None or self.loop.is_closed():
+            return
+        self.loop.call_soon_threadsafe(self._cancel)
+
+    def _start_task(self, coroutine):
+        self._tasks.append(self.loop.create_task(coroutine))
+
+    def _set_interval(self, name, interval):
+        self._intervals[name] = interval
+        if name in self._wakeups:
+            self._wakeups[name].set()
+
+    def _cancel(self):
+        for task in self._tasks:
+            task.cancel()
+        self.loop.stop()
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        for coroutine in self._coroutines:
+            self._start_task(coroutine)
+        self._coroutines = []
+        try:
+            self.loop.run_forever()
+        finally:
+            # let the cancelled tasks run their cleanup
+            self.loop.run_until_complete(asyncio.gather(*self._tasks, return_exceptions=True))
+            self.executor.shutdown(wait=False)
+            self.loop.close()
+
+    async def _periodic(self, name, interval, function, args, blocking):
+        self._intervals[name] = interval
+        self._wakeups[name] = asyncio.Event()
+        failures = 0
+        while True:
+            interval = self._intervals[name]
+            time_start = self.loop.time()
+            result = None
+            try:
+                if blocking:
+                    result = await self.run_blocking(function, *args)
+                else:
+                    result = function(*args)
+            except SystemExit:
+                # the function requested to stop the driver
+                logging.info("--> AsyncEngine: %s stopped the driver" % name)
+                self._cancel()
+                return
+            except Exception as e:
+                logging.error("--> AsyncEngine: %s: Exception occurred: %s" % (name, repr(e)))
+                result = False
+
+            # like the Scheduler: a failed run is repeated with a backoff, measured from its end
+            failures = failures + 1 if result is False else 0
+            if failures > 0:
+                await asyncio.sleep(next_delay(interval, failures, jitter=0))
+            elif is_delay(result):
+                await asyncio.sleep(max(0, time_start + result - self.loop.time()))
+            else:
+                await self._wait_interval(name, time_start)
+
+    async def _wait_interval(self, name, time_start):
+        """Wait until the interval passed since time_start, a new interval of set_interval() applies right away."""
+        wakeup = self._wakeups[name]
+        while True:
+            wakeup.clear()
+            timeout = time_start + self._intervals[name] - self.loop.time()
+            if timeout <= 0:
+                return
+            try:
+                await asyncio.wait_for(wakeup.wait(), timeout)
+            except asyncio.TimeoutError:
+                return
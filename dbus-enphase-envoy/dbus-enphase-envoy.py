@@ -1,25 +1,42 @@
 #!/usr/bin/env python
 
 from gi.repository import GLib  # pyright: ignore[reportMissingImports]
+import dbus  # pyright: ignore[reportMissingImports]
 import platform
 import logging
 import sys
 import os
-from time import sleep, time
+from time import monotonic, sleep, time
+from datetime import datetime
 import json
 import paho.mqtt.client as mqtt
-import configparser  # for config/ini file
 import _thread
 import re
+import signal
+import asyncio
 
 import threading
 import requests
-from requests.auth import HTTPDigestAuth
-from functools import reduce
 
 # import to request new token
 from enphasetoken import getToken
 
+# import to decode the meter stream
+from streamdecoder import MeterStreamDecoder, STREAM_CHUNK_SIZE
+from meterschema import MeterSchema, ReplacementTable
+from energyintegrator import EnergyIntegrator
+from energystore import EnergyStore
+from snapshotstore import SnapshotStore
+from asyncengine import AsyncEngine, stream_get
+from scheduler import Scheduler
+from reportschedule import ReportSchedule
+from envoysession import EnvoySession, set_read_timeout
+from streamsupervisor import StreamSupervisor
+from statecache import StateCache
+from phaselayout import PhaseLayout, PHASES
+from digestauth import DigestAuth
+from envoyconfig import ConfigError, DriverConfig
+
 # import Victron Energy packages
 sys.path.insert(1, os.path.join(os.path.dirname(__file__), "ext", "velib_python"))
 from vedbus import VeDbusService  # noqa: E402
@@ -33,17 +50,12 @@ urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 # get values from config.ini file
 try:
     config_file = (os.path.dirname(os.path.realpath(__file__))) + "/config.ini"
-    if os.path.exists(config_file):
-        config = configparser.RawConfigParser()
-        config.read(config_file)
-        if config["ENVOY"]["address"] == "IP_ADDR_OR_FQDN":
-            print('ERROR:The "config.ini" is using invalid default values like IP_ADDR_OR_FQDN. The driver restarts in 60 seconds.')
-            sleep(60)
-            sys.exit()
-    else:
-        print('ERROR:The "' + config_file + '" is not found. Did you copy or rename the "config.sample.ini" to "config.ini"? The driver restarts in 60 seconds.')
-        sleep(60)
-        sys.exit()
+    settings = DriverConfig(config_file)
+
+except ConfigError as e:
+    print("ERROR:%s The driver restarts in 60 seconds." % e)
+    sleep(60)
+    sys.exit()
 
 except Exception:
     exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -56,151 +68,23 @@ except Exception:
 
 
 # Get logging level from config.ini
-# ERROR = shows errors only
-# WARNING = shows ERROR and warnings
-# INFO = shows WARNING and running functions
-# DEBUG = shows INFO and data/values
-if "DEFAULT" in config and "logging" in config["DEFAULT"]:
-    if config["DEFAULT"]["logging"] == "DEBUG":
-        logging.basicConfig(level=logging.DEBUG)
-    elif config["DEFAULT"]["logging"] == "INFO":
-        logging.basicConfig(level=logging.INFO)
-    elif config["DEFAULT"]["logging"] == "ERROR":
-        logging.basicConfig(level=logging.ERROR)
-    else:
-        logging.basicConfig(level=logging.WARNING)
-else:
-    logging.basicConfig(level=logging.WARNING)
-
-
-# check if MQTT is enabled in config
-if "MQTT" in config and "enabled" in config["MQTT"] and config["MQTT"]["enabled"] == "1":
-    MQTT_enabled = 1
-else:
-    MQTT_enabled = 0
-
-
-# checks for D7.x.x firmware
-if "ENVOY" in config and "firmware" in config["ENVOY"] and config["ENVOY"]["firmware"] == "D7":
-    request_auth = "token"
-    request_schema = "https"
-    error = []
-
-    if "ENVOY" in config and "enlighten_user" in config["ENVOY"] and config["ENVOY"]["enlighten_user"] != "":
-        envoy_enlighten_user = config["ENVOY"]["enlighten_user"]
-    else:
-        error.append("enlighten_user")
-
-    if "ENVOY" in config and "enlighten_password" in config["ENVOY"] and config["ENVOY"]["enlighten_password"] != "":
-        envoy_enlighten_password = config["ENVOY"]["enlighten_password"]
-    else:
-        error.append("enlighten_password")
-
-    if "ENVOY" in config and "serial" in config["ENVOY"] and config["ENVOY"]["serial"] != "":
-        envoy_serial = config["ENVOY"]["serial"]
-    else:
-        error.append("serial")
-
-    if len(error) > 0:
-        logging.error('This Envoy values are missing in the "config.ini": ' + ", ".join(error))
-        logging.error("The driver restarts in 60 seconds.")
-        sleep(60)
-        sys.exit()
-
-    logging.error("D7 firmware selected")
-
-# checks for D5.x.x firmware
-else:
-    request_auth = "digest"
-    request_schema = "http"
-
-    if "ENVOY" in config and "password" in config["ENVOY"] and config["ENVOY"]["password"] != "":
-        envoy_password = config["ENVOY"]["password"]
-    else:
-        logging.error('This Envoy values are missing in the "config.ini": password')
-        logging.error("The driver restarts in 60 seconds.")
-        sleep(60)
-        sys.exit()
-
-    logging.error("D5 firmware selected")
-
-
-# check if fetch_production_historic_interval is enabled in config and not under minimum value
-if "ENVOY" in config and "fetch_production_historic_interval" in config["ENVOY"] and int(config["ENVOY"]["fetch_production_historic_interval"]) > 900:
-    fetch_production_historic_interval = int(config["ENVOY"]["fetch_production_historic_interval"])
-else:
-    fetch_production_historic_interval = 900
-
-# check if fetch_production_historic_interval is enabled in config and not under minimum value
-if "PV" in config and "inverter_count" in config["PV"] and "inverter_type" in config["PV"]:
-    hardware = config["PV"]["inverter_count"] + "x " + config["PV"]["inverter_type"]
-    inverters = {
-        "config": int(config["PV"]["inverter_count"]),
-        "reporting": 0,
-        "producing": 0,
-    }
-else:
-    hardware = "Microinverters"
-    inverters = {"config": None, "reporting": 0, "producing": 0}
-
-# check if fetch_devices is enabled in config
-if "DATA" in config and "fetch_devices" in config["DATA"] and config["DATA"]["fetch_devices"] == "1":
-    fetch_devices_enabled = 1
-    # check if fetch_devices_interval is enabled in config and not under minimum value
-    if "DATA" in config and "fetch_devices_interval" in config["DATA"] and int(config["DATA"]["fetch_devices_interval"]) > 60:
-        fetch_devices_interval = int(config["DATA"]["fetch_devices_interval"])
-    else:
-        fetch_devices_interval = 60
-    # check fetch_devices_publishing_type
-    if "DATA" in config and "fetch_devices_publishing_type" in config["DATA"] and config["DATA"]["fetch_devices_publishing_type"] == "0":
-        fetch_devices_publishing_type = 0
-    else:
-        fetch_devices_publishing_type = 1
-else:
-    fetch_devices_enabled = 0
-    fetch_devices_interval = 3600
-    fetch_devices_publishing_type = 0
-
-# check if fetch_inverters is enabled in config
-if "DATA" in config and "fetch_inverters" in config["DATA"] and config["DATA"]["fetch_inverters"] == "1":
-    fetch_inverters_enabled = 1
-    # check if fetch_inverters_interval is enabled in config and not under minimum value
-    if "DATA" in config and "fetch_inverters_interval" in config["DATA"] and int(config["DATA"]["fetch_inverters_interval"]) > 5:
-        fetch_inverters_interval = int(config["DATA"]["fetch_inverters_interval"])
-    else:
-        fetch_inverters_interval = 5
-    # check fetch_inverters_publishing_type
-    if "DATA" in config and "fetch_inverters_publishing_type" in config["DATA"] and config["DATA"]["fetch_inverters_publishing_type"] == "0":
-        fetch_inverters_publishing_type = 0
-    else:
-        fetch_inverters_publishing_type = 1
-else:
-    fetch_inverters_enabled = 0
-    fetch_inverters_interval = 300
-    fetch_inverters_publishing_type = 0
-
-# check if fetch_events is enabled in config
-if "DATA" in config and "fetch_events" in config["DATA"] and config["DATA"]["fetch_events"] == "1":
-    fetch_events_enabled = 1
-    # check if fetch_events_interval is enabled in config and not under minimum value
-    if "DATA" in config and "fetch_events_interval" in config["DATA"] and int(config["DATA"]["fetch_events_interval"]) > 900:
-        fetch_events_interval = int(config["DATA"]["fetch_events_interval"])
-    else:
-        fetch_events_interval = 900
-    # check fetch_events_publishing_type
-    if "DATA" in config and "fetch_events_publishing_type" in config["DATA"] and config["DATA"]["fetch_events_publishing_type"] == "0":
-        fetch_events_publishing_type = 0
-    else:
-        fetch_events_publishing_type = 1
-else:
-    fetch_events_enabled = 0
-    fetch_events_interval = 3600
-    fetch_events_publishing_type = 0
+logging.basicConfig(level=settings.logging_level)
+for gateway_config in settings.gateways:
+    logging.error("[%s] %s firmware selected" % (gateway_config.section, gateway_config.firmware))
 
 
 # set variables
 connected = 0
 keep_running = True
+# the time to the first value on D-Bus is measured from here
+driver_started = monotonic()
+# seconds without a new row of the stream until the D-Bus services show /Connected = 0
+connected_timeout = 15
+# the token of a D7 gateway is checked at least once in this seconds, a failed renewal is repeated up to this seconds
+TOKEN_CHECK_MAX = 3600
+TOKEN_BACKOFF_MAX = 300
+# seconds between the checks if the config.ini changed, SIGHUP reloads it right away
+CONFIG_CHECK_INTERVAL = 10
 
 replace_meters = (
     ("production", "pv"),
@@ -210,19 +94,245 @@ replace_meters = (
 replace_phases = ("ph-a", "L1"), ("ph-b", "L2"), ("ph-c", "L3")
 replace_devices = ("PCU", "inverters"), ("ACB", "batteries"), ("NSRB", "relais")
 
-data_meter_stream = {}
-data_production_historic = {}
-data_devices = {}
-data_inverters = {}
-data_events = {}
+# lookup tables built once from the replacements above
+meter_names = ReplacementTable(replace_meters)
+phase_names = ReplacementTable(replace_phases)
+device_names = ReplacementTable(replace_devices)
+
+# gateways of the driver, created in main()
+gateways = []
+
+
+class EnphaseEnvoy:
+    """One Envoy gateway: its connection, auth token and the data of its fetch threads.
+
+    The gateway of the [ENVOY] section keeps the D-Bus service name, MQTT topics and files of a
+    single gateway installation, the ones of the named [ENVOY:<name>] sections get the name appended.
+    """
+
+    def __init__(self, config):
+        # the settings of the section, the reloadable ones are read from it at runtime
+        self.config = config
+        self.name = config.name
+        # appended to the log messages to distinguish the gateways
+        self.label = "" if self.name == "" else " [%s]" % self.name
+        self.address = config.address
+        self.request_auth = config.request_auth
+        self.request_schema = config.request_schema
+        self.password = config.password
+        self.enlighten_user = config.enlighten_user
+        self.enlighten_password = config.enlighten_password
+        self.serial = config.serial
+        self.session_cookie = config.session_cookie
+
+        suffix = "" if self.name == "" else "_" + self.name
+        self.servicename = "com.victronenergy.pvinverter.enphase_envoy" + suffix
+        self.deviceinstance = config.deviceinstance
+        self.hardware = config.hardware
+        self.max_power = config.max
+        self.inverters = {"config": config.inverter_count, "reporting": 0, "producing": 0}
+
+        self.token_file = "/data/etc/dbus-enphase-envoy/auth_token%s.json" % suffix
+        self.energy_working_file = "/var/volatile/tmp/dbus-enphase-envoy_data_watt_hours%s.json" % suffix
+        self.energy_storage_file = "/data/etc/dbus-enphase-envoy/data_watt_hours%s.json" % suffix
+        self.state_file = "/data/etc/dbus-enphase-envoy/state%s.json" % suffix
+
+        # last known state of the previous run, the D-Bus services start with it before the Envoy answers
+        self.state_cache = StateCache(self.state_file)
+        self.cached_state = self.state_cache.load()
+
+        # data of the fetch threads, every publication gets a new version
+        self.data_meter_stream = SnapshotStore()
+        # the cached lifetime counters are merged into the stream rows until production.json is fetched, the version stays 0
+        self.data_production_historic = SnapshotStore(self.cached_state.get("production_historic"))
+        self.data_devices = SnapshotStore()
+        self.data_inverters = SnapshotStore()
+        self.data_events = SnapshotStore()
+
+        # phases with D-Bus paths, from the cached state, production.json and the stream
+        self.phase_layout = PhaseLayout(self.cached_state.get("layout"))
+
+        # the cached inverter counts until the first response of fetch_inverters()
+        if settings.fetch_inverters_enabled == 1 and "inverters" in self.cached_state:
+            self.inverters.update(self.cached_state["inverters"])
+            if config.inverter_count is not None:
+                self.inverters["config"] = config.inverter_count
+
+        # persists the grid energy, set by fetch_meter_stream()
+        self.energy_store = None
+
+        # time when the first counted inverter report gets too old, fetch_inverters() parses the response again
+        self.inverters_expiry = 0
+        # next poll of the inverters after their expected reports, None for the fixed interval
+        self.report_schedule = ReportSchedule(settings.fetch_inverters_interval) if settings.fetch_inverters_align == 1 else None
+
+        self.auth_token = {"auth_token": "", "created": 0, "expires": 0}
+        # the bearer token or the session cookie, replaced as a whole so a rejected one can be compared
+        self.request_headers = {}
+        self._reauthenticate_lock = threading.Lock()
+        # D7 firmware: the token stays in memory and is renewed before its expiry
+        self.token = getToken(self.enlighten_user, self.enlighten_password, self.serial, token_file=self.token_file) if self.request_auth == "token" else None
+        # set as soon as the requests can be authenticated, the D7 token is loaded in parallel to the start of the fetch threads
+        self.authenticated = threading.Event()
+        if self.request_auth != "token":
+            self.authenticated.set()
+
+        # kept-alive connections for the stream and the polled requests
+        self.session = EnvoySession(fingerprint=config.certificate_fingerprint or None)
+        # D5 firmware: the digest challenge is shared by all requests to this gateway
+        self.digest_auth = DigestAuth("installer", self.password) if self.request_auth == "digest" else None
+
+    def url(self, path):
+        # the URLs of the endpoints are built once
+        return self.config.urls.get(path) or self.config.url(path)
+
+    def get(self, path, **kwargs):
+        """Request a path of the Envoy with the authentication of its firmware."""
+        if self.request_auth == "token":
+            return self._get_with_token(self.session.get, path, **kwargs)
+        else:
+            return self.session.get(self.url(path), auth=self.digest_auth, **kwargs)
 
-fetch_production_historic_last = 0
-fetch_devices_last = 0
-fetch_inverters_last = 0
-fetch_events_last = 0
+    def get_changed(self, path, **kwargs):
+        """Like get(), but return None if the response did not change since the last request of the path."""
+        if self.request_auth == "token":
+            return self._get_with_token(self.session.get_changed, path, **kwargs)
+        else:
+            return self.session.get_changed(self.url(path), auth=self.digest_auth, **kwargs)
+
+    def _get_with_token(self, request, path, **kwargs):
+        headers = self.request_headers
+        response = request(self.url(path), headers=headers, **kwargs)
+
+        # the Envoy rejected the session or the token before its expiry, e.g. after a reboot of the Envoy: renew it and repeat the request once
+        if response is not None and response.status_code == 401:
+            logging.warning(f"--> get(){self.label}: {path}: " + ("session expired, validating the token again" if "Cookie" in headers else "token rejected, renewing it"))
+            response.close()
+            if self.reauthenticate(headers) and self.request_headers != headers:
+                response = request(self.url(path), headers=self.request_headers, **kwargs)
+
+        return response
+
+    def reauthenticate(self, rejected):
+        """Renew the request headers the Envoy answered with 401, return False if it failed.
+
+        A rejected session cookie is replaced by validating the token again, the token is only renewed if the
+        Envoy rejects it too. Requests rejected at the same time reuse the renewed headers.
+        """
+        with self._reauthenticate_lock:
+            if self.request_headers != rejected:
+                return True
+
+            token = self.auth_token["auth_token"]
+            if "Cookie" in rejected:
+                headers = self._authorize(token)
+                if "Cookie" in headers:
+                    self.request_headers = headers
+                    return True
+
+            return self.refresh_token(rejected=token) is not False
+
+    def refresh_token(self, rejected=None):
+        """Load or renew the D7 token, return the seconds until it is due for renewal or False if it failed.
+
+        rejected: the token the Envoy answered with 401, it is renewed right away
+        """
+        result = self.token.refresh(rejected)
+        if not result:
+            logging.error(f"Token{self.label} was not loaded/renewed!")
+            # a token renewed ahead of its expiry stays usable until it expires
+            current = self.token.json_data
+            if current and current["auth_token"] and current["auth_token"] != rejected and self.token.expires(current) > time():
+                self._use_token(current)
+            return False
 
-auth_token = {"auth_token": "", "created": 0, "check_last": 0, "check_result": False}
-request_headers = {}
+        self._use_token(result, authorize=rejected is not None)
+        return self.token.refresh_at(result) - time()
+
+    def _use_token(self, json_data, authorize=False):
+        # a new token gets new request headers, a session is only started once per token
+        if authorize or json_data["auth_token"] != self.auth_token["auth_token"]:
+            self.request_headers = self._authorize(json_data["auth_token"])
+        self.auth_token = {"auth_token": json_data["auth_token"], "created": json_data["created"], "expires": self.token.expires(json_data)}
+        self.authenticated.set()
+
+    def _authorize(self, token):
+        """Return the request headers for the token, with session_cookie the cookie of a session started with the token.
+
+        The Envoy verifies the signature of a bearer token on every request, a session cookie is only looked up.
+        Without a session the token is sent with every request, e.g. if the Envoy rejects it or the firmware has no sessions.
+        """
+        headers = {"Authorization": "Bearer " + token}
+        if not self.session_cookie:
+            return headers
+
+        response = self.session.get(self.url("/auth/check_jwt"), headers=headers, timeout=10)
+        response.close()
+        session_id = response.cookies.get("sessionId")
+        if response.status_code != 200 or session_id is None:
+            logging.warning(f"--> check_jwt(){self.label}: No session started (HTTP status code {response.status_code}), sending the token with every request")
+            return headers
+
+        logging.info(f"--> check_jwt(){self.label}: Token validated, sending the session cookie with every request")
+        return {"Cookie": "sessionId=" + session_id}
+
+    def topic(self, topic):
+        """Return the MQTT topic for the data of this gateway."""
+        return topic if self.name == "" else topic + "/" + self.name
+
+    def phases(self, meter_name):
+        """Return the phases of a meter which get D-Bus paths."""
+        return self.phase_layout.phases(meter_name)
+
+    def state(self):
+        """Return the current state for the state cache, the parts without new data are kept from the cached state."""
+        state = dict(self.cached_state)
+        state["layout"] = self.phase_layout.to_dict()
+
+        if self.data_production_historic:
+            state["production_historic"] = self.data_production_historic.data
+
+        if self.data_meter_stream:
+            sample = self.data_meter_stream.data.to_dict()
+            state["energy"] = {}
+            for meter_name, meter in sample.items():
+                energy = {key: meter[key] for key in ("energy_forward", "energy_reverse") if key in meter}
+                for phase_name in PHASES:
+                    if phase_name in meter:
+                        energy[phase_name] = {key: meter[phase_name][key] for key in ("energy_forward", "energy_reverse") if key in meter[phase_name]}
+                state["energy"][meter_name] = energy
+
+        if settings.fetch_inverters_enabled == 1 and self.data_inverters:
+            state["inverters"] = dict(self.inverters)
+
+        return state
+
+    def save_state(self):
+        """Write the current state to the state cache if it changed."""
+        try:
+            self.state_cache.save(self.state())
+        except Exception as e:
+            logging.error(f"--> save_state(){self.label}: Could not write {self.state_file}: {repr(e)}")
+
+
+def get_gateway(name):
+    """Return the gateway with the name, the first one if the name is empty."""
+    for gateway in gateways:
+        if name == "" or gateway.name == name:
+            return gateway
+
+
+def sum_inverters(gateways):
+    """Return the inverter counts of the gateways summed up, the configured count is None until all gateways know it."""
+    inverters = {"config": 0, "reporting": 0, "producing": 0}
+    for gateway in gateways:
+        inverters["reporting"] += gateway.inverters["reporting"]
+        inverters["producing"] += gateway.inverters["producing"]
+        if inverters["config"] is not None and gateway.inverters["config"] is not None:
+            inverters["config"] += gateway.inverters["config"]
+        else:
+            inverters["config"] = None
+    return inverters
 
 
 # MQTT
@@ -236,8 +346,8 @@ def on_disconnect(client, userdata, rc):
 
     while connected == 0:
         try:
-            logging.warning(f"MQTT client: Trying to reconnect to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
-            client.connect(host=config["MQTT"]["broker_address"], port=int(config["MQTT"]["broker_port"]))
+            logging.warning(f"MQTT client: Trying to reconnect to broker {settings.mqtt_broker_address} on port {settings.mqtt_broker_port}")
+            client.connect(host=settings.mqtt_broker_address, port=settings.mqtt_broker_port)
             connected = 1
         except Exception:
             exception_type, exception_object, exception_traceback = sys.exc_info()
@@ -245,7 +355,7 @@ def on_disconnect(client, userdata, rc):
             line = exception_traceback.tb_lineno
             logging.error(f"MQTT client: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
 
-            logging.error(f"MQTT client: Error in retrying to connect with broker ({config['MQTT']['broker_address']}:{config['MQTT']['broker_port']})")
+            logging.error(f"MQTT client: Error in retrying to connect with broker ({settings.mqtt_broker_address}:{settings.mqtt_broker_port})")
             logging.error("MQTT client: Retrying in 15 seconds")
             connected = 0
             sleep(15)
@@ -264,669 +374,290 @@ def on_publish(client, userdata, rc):
     pass
 
 
-def tokenManager():
-    global envoy_enlighten_user, envoy_enlighten_password, envoy_serial, request_headers, auth_token
+def check_token(gateway):
+    """Load or renew the token of a D7 gateway, return the seconds until the next check or False if it failed.
 
-    logging.info("step: tokenManager")
+    The token is checked again when it is due for renewal, but at least once every TOKEN_CHECK_MAX seconds,
+    because the clock of the GX device can be set after the start. A failed renewal is repeated with a backoff.
+    """
+    logging.info("step: check_token" + gateway.label)
 
-    while 1:
-        # check expiry on first run and then once every minute
-        if auth_token["check_last"] < int(time()) - 59:
-
-            # request token from file system or generate a new one if missing or about to expire
-            token = getToken(envoy_enlighten_user, envoy_enlighten_password, envoy_serial)
-            result = token.refresh()
-
-            if result:
-                request_headers = {"Authorization": "Bearer " + result["auth_token"]}
-                auth_token = {
-                    "auth_token": result["auth_token"],
-                    "created": result["created"],
-                    "check_last": int(time()),
-                    "check_result": True,
-                }
-                # logging.error(f"Token created on: {datetime.fromtimestamp(result['created'])} UTC")
-            else:
-                # check again in 5 minutes
-                auth_token["check_last"] = int(time()) - 86400 + 900
-                logging.error("Token was not loaded/renewed! Check again in 5 minutes")
+    delay = gateway.refresh_token()
+    if delay is False:
+        return False
 
-        sleep(60)
+    logging.info(f"--> check_token(){gateway.label}: Token expires on {datetime.fromtimestamp(gateway.auth_token['expires'])} UTC, due for renewal in {round(delay)} seconds")
+    return min(max(delay, 1), TOKEN_CHECK_MAX)
 
 
 # ENPHASE - ENOVY-S
-def fetch_meter_stream():
-    logging.info("step: fetch_meter_stream")
-
-    global config, error_count, keep_running, request_auth, request_headers, request_schema, data_meter_stream, data_production_historic
-
-    error_count = 0
-    marker = b"data: "
-
-    # create dictionary for later to count watt hours
-    data_watt_hours = {"time_creation": int(time()), "count": 0}
-    # calculate and save watthours after every x seconds
-    data_watt_hours_timespan = 60
-    # save file to non volatile storage after x seconds
-    data_watt_hours_save = 900
-    # file to save watt hours on persistent storage
-    data_watt_hours_storage_file = "/data/etc/dbus-enphase-envoy/data_watt_hours.json"
-    # file to save many writing operations (best on ramdisk to not wear SD card)
-    data_watt_hours_working_file = "/var/volatile/tmp/dbus-enphase-envoy_data_watt_hours.json"
-    # get last modification timestamp
-    timestamp_storage_file = os.path.getmtime(data_watt_hours_storage_file) if os.path.isfile(data_watt_hours_storage_file) else 0
-
-    # load data to prevent sending 0 watthours for grid before the first loop
-    # check if file in volatile storage exists
-    if os.path.isfile(data_watt_hours_working_file):
-        with open(data_watt_hours_working_file, "r") as file:
-            file = open(data_watt_hours_working_file, "r")
-            json_data = json.load(file)
-            logging.info("Loaded JSON for energy forward/reverse once")
-            logging.debug(json.dumps(json_data))
-    # if not, check if file in persistent storage exists
-    elif os.path.isfile(data_watt_hours_storage_file):
-        with open(data_watt_hours_storage_file, "r") as file:
-            file = open(data_watt_hours_storage_file, "r")
-            json_data = json.load(file)
-            logging.info("Loaded JSON for energy forward/reverse once from persistent storage")
-            logging.debug(json.dumps(json_data))
-    else:
-        json_data = {}
+class MeterStream:
+    """Decodes the /stream/meter of a gateway and publishes its rows, independent of the engine which reads the stream.
+
+    Integrates the grid energy of every row and persists it with the energy store of the gateway.
+    """
+
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self.decoder = MeterStreamDecoder()
+        self.schema = None
+
+        # integrates the grid power to imported/exported energy, since enphase provides only watthours for production/import/consumption and no export
+        self.grid_energy = EnergyIntegrator()
+
+        # the counters stay in memory, the store writes them in the background
+        # working file to save many writing operations (best on ramdisk to not wear SD card), storage file on persistent storage
+        gateway.energy_store = EnergyStore(
+            lambda: {"grid": self.grid_energy.to_dict()},
+            working_file=gateway.energy_working_file,
+            storage_file=gateway.energy_storage_file,
+            working_interval=settings.energy_working_interval,
+            storage_interval=settings.energy_storage_interval,
+        )
 
-    while 1:
-        try:
-            # url = '%s://%s/ivp/meters/reports' % (request_schema, config['ENVOY']['address'])
-            url = "%s://%s/stream/meter" % (request_schema, config["ENVOY"]["address"])
-            if request_auth == "token":
-                response = requests.get(url, stream=True, timeout=60, headers=request_headers, verify=False)
-            else:
-                response = requests.get(
-                    url,
-                    stream=True,
-                    timeout=60,
-                    auth=HTTPDigestAuth("installer", config["ENVOY"]["password"]),
-                )
+        # load data to prevent sending 0 watthours for grid before the first loop
+        json_data = gateway.energy_store.load()
+        if "grid" in json_data:
+            self.grid_energy.load(json_data["grid"])
 
-            if response.status_code != 200:
-                logging.error(f"--> fetch_meter_stream(): Received HTTP status code {response.status_code}. Restarting the driver in 60 seconds.")
-                sleep(60)
-                keep_running = False
-                sys.exit()
+        gateway.energy_store.start()
 
-            if response.elapsed.total_seconds() > 5:
-                logging.warning("--> fetch_meter_stream(): HTTP request took longer than 5 seconds: %s seconds" % response.elapsed.total_seconds())
+    def reset(self):
+        # drop incomplete frames of a previous connection
+        self.decoder.reset()
 
-            for row in response.iter_lines():
+    def stop(self):
+        self.gateway.energy_store.stop()
 
-                if keep_running is False:
-                    logging.info("--> fetch_meter_stream(): got exit signal")
-                    sys.exit()
+    def feed(self, chunk):
+        """Decode and publish the rows of a chunk, return the number of rows."""
+        gateway = self.gateway
+        count = 0
 
-                if row.startswith(marker):
-                    data = json.loads(row.replace(marker, b""))
+        for data in self.decoder.frames(chunk):
+            count += 1
 
-                    # set timestamp when row is read
-                    timestamp = int(time())
-                    total_jsonpayload = {}
+            # the lifetime counters are merged into every row, without a cached state the rows before the first production.json are dropped
+            if not gateway.data_production_historic.data:
+                continue
 
-                    for meter in ["production", "net-consumption", "total-consumption"]:
+            # (re)build the decoding schema on the first row and if the phase layout changes
+            layout_changed = self.schema is None or not self.schema.matches(data)
+            if layout_changed:
+                self.schema = MeterSchema.detect(data, meter_names, phase_names)
+                logging.info(f"--> fetch_meter_stream(){gateway.label}: detected phases: {', '.join(self.schema.layout)}")
+                # the D-Bus services add the paths of new phases before they show the row
+                layout_changed = gateway.phase_layout.update({meter_name: self.schema.layout for meter_name in self.schema.meter_names})
 
-                        meter_name = reduce(lambda a, kv: a.replace(*kv), replace_meters, meter)
+            # every row gets its own sample, the published samples are not changed anymore
+            total_jsonpayload = self.schema.decode(data, gateway.data_production_historic.data)
 
-                        jsonpayload = {}
+            # # # calculate watthours
+            # integrate the grid power of every row on the monotonic clock and show the current energy
+            self.grid_energy.add(monotonic(), total_jsonpayload["grid"])
+            self.grid_energy.apply(total_jsonpayload["grid"])
 
-                        total_power = 0
-                        total_current = 0
-                        total_voltage = 0
-                        total_power_react = 0
-                        total_power_appearent = 0
+            # make fetched data globally available
+            gateway.data_meter_stream.publish(total_jsonpayload)
 
-                        for phase in ["ph-a", "ph-b", "ph-c"]:
+            # the D-Bus services of the next start are created with this layout
+            if layout_changed:
+                gateway.save_state()
 
-                            phase_name = reduce(lambda a, kv: a.replace(*kv), replace_phases, phase)
+        return count
 
-                            if data[meter][phase]["v"] > 0:
 
-                                total_power += float(data[meter][phase]["p"])
-                                total_current += float(data[meter][phase]["i"])
-                                total_voltage += float(data[meter][phase]["v"])
-                                total_power_react += float(data[meter][phase]["q"])
-                                total_power_appearent += float(data[meter][phase]["s"])
+def fetch_meter_stream(gateway):
+    logging.info("step: fetch_meter_stream" + gateway.label)
 
-                                # if PV power is below 5 W, than show 0 W. This prevents showing 1-2 W on PV when no sun is shining
-                                if meter_name == "pv" and data[meter][phase]["p"] < 5:
-                                    data[meter][phase]["p"] = 0
-                                    data[meter][phase]["i"] = 0
+    global keep_running
 
-                                phase_data = {
-                                    "power": float(data[meter][phase]["p"]),
-                                    "current": float(data[meter][phase]["i"]),
-                                    "voltage": float(data[meter][phase]["v"]),
-                                    "power_react": float(data[meter][phase]["q"]),
-                                    "power_appearent": float(data[meter][phase]["s"]),
-                                    "power_factor": float(data[meter][phase]["pf"]),
-                                    "frequency": float(data[meter][phase]["f"]),
-                                    "whToday": data_production_historic[meter_name][phase_name]["whToday"],
-                                    "vahToday": data_production_historic[meter_name][phase_name]["vahToday"],
-                                    "whLifetime": data_production_historic[meter_name][phase_name]["whLifetime"],
-                                    "vahLifetime": data_production_historic[meter_name][phase_name]["vahLifetime"],
-                                }
+    stream = MeterStream(gateway)
+    # reconnects a failed or stalled stream, the integrator, D-Bus services and MQTT connection stay alive
+    supervisor = StreamSupervisor(gateway.label)
 
-                                if meter_name == "pv":
-                                    phase_data.update(
-                                        {
-                                            "energy_forward": float(
-                                                round(
-                                                    data_production_historic[meter_name][phase_name]["whLifetime"] / 1000,
-                                                    3,
-                                                )
-                                            ),
-                                        }
-                                    )
-
-                                if meter_name == "grid":
-                                    phase_data.update(
-                                        {
-                                            "energy_forward": (json_data["grid"][phase_name]["energy_forward"] if "grid" in json_data and phase_name in json_data["grid"] else 0),
-                                            "energy_reverse": (json_data["grid"][phase_name]["energy_reverse"] if "grid" in json_data and phase_name in json_data["grid"] else 0),
-                                        }
-                                    )
-
-                                if meter_name == "consumption":
-                                    phase_data.update(
-                                        {
-                                            "energy_forward": float(
-                                                round(
-                                                    data_production_historic[meter_name][phase_name]["whLifetime"] / 1000,
-                                                    3,
-                                                )
-                                            ),
-                                        }
-                                    )
-
-                                jsonpayload.update({phase_name: phase_data})
-
-                        # if PV power is below 5 W, than show 0 W. This prevents showing 1-2 W on PV when no sun is shining
-                        if meter_name == "pv" and total_power < 5:
-                            total_power = 0
-                            total_current = 0
-
-                        jsonpayload.update(
-                            {
-                                "power": total_power,
-                                "current": total_current,
-                                "voltage": total_voltage,
-                                "power_react": total_power_react,
-                                "power_appearent": total_power_appearent,
-                                "whToday": data_production_historic[meter_name]["whToday"],
-                                "vahToday": data_production_historic[meter_name]["vahToday"],
-                                "whLifetime": data_production_historic[meter_name]["whLifetime"],
-                                "vahLifetime": data_production_historic[meter_name]["vahLifetime"],
-                            }
-                        )
-
-                        if meter_name == "pv":
-                            jsonpayload.update(
-                                {
-                                    "energy_forward": round(
-                                        data_production_historic[meter_name]["whLifetime"] / 1000,
-                                        3,
-                                    ),
-                                }
-                            )
+    # the D7 token is loaded in parallel
+    gateway.authenticated.wait()
 
-                        if meter_name == "grid":
-                            jsonpayload.update(
-                                {
-                                    "energy_forward": (json_data["grid"]["energy_forward"] if "grid" in json_data else 0),
-                                    "energy_reverse": (json_data["grid"]["energy_reverse"] if "grid" in json_data else 0),
-                                }
-                            )
+    while 1:
+        try:
+            # the read timeout is the heartbeat deadline, so a stalled stream is detected within seconds
+            heartbeat = supervisor.heartbeat()
+            # response = gateway.get("/ivp/meters/reports", stream=True, timeout=60)
+            response = gateway.get("/stream/meter", stream=True, timeout=(10, heartbeat))
 
-                        if meter_name == "consumption":
-                            jsonpayload.update(
-                                {
-                                    "energy_forward": round(
-                                        data_production_historic[meter_name]["whLifetime"] / 1000,
-                                        3,
-                                    ),
-                                }
-                            )
+            if response.status_code != 200:
+                logging.error(f"--> fetch_meter_stream(){gateway.label}: Received HTTP status code {response.status_code}")
+                response.close()
+                delay = supervisor.failed()
 
-                        total_jsonpayload.update({meter_name: jsonpayload})
-
-                    # # # calculate watthours
-                    # measure power and calculate watthours, since enphase provides only watthours for production/import/consumption and no export
-                    # divide import and export from grid
-                    grid_power_forward = total_jsonpayload["grid"]["power"] if total_jsonpayload["grid"]["power"] > 0 else 0
-                    grid_power_reverse = total_jsonpayload["grid"]["power"] * -1 if total_jsonpayload["grid"]["power"] < 0 else 0
-
-                    if "L1" in total_jsonpayload["grid"]:
-                        grid_L1_power_forward = total_jsonpayload["grid"]["L1"]["power"] if total_jsonpayload["grid"]["L1"]["power"] > 0 else 0
-                        grid_L1_power_reverse = total_jsonpayload["grid"]["L1"]["power"] * -1 if total_jsonpayload["grid"]["L1"]["power"] < 0 else 0
-
-                    if "L2" in total_jsonpayload["grid"]:
-                        grid_L2_power_forward = total_jsonpayload["grid"]["L2"]["power"] if total_jsonpayload["grid"]["L2"]["power"] > 0 else 0
-                        grid_L2_power_reverse = total_jsonpayload["grid"]["L2"]["power"] * -1 if total_jsonpayload["grid"]["L2"]["power"] < 0 else 0
-
-                    if "L3" in total_jsonpayload["grid"]:
-                        grid_L3_power_forward = total_jsonpayload["grid"]["L3"]["power"] if total_jsonpayload["grid"]["L3"]["power"] > 0 else 0
-                        grid_L3_power_reverse = total_jsonpayload["grid"]["L3"]["power"] * -1 if total_jsonpayload["grid"]["L3"]["power"] < 0 else 0
-
-                    # check if x seconds are passed, if not sum values for calculation
-                    if data_watt_hours["time_creation"] + data_watt_hours_timespan > timestamp:
-
-                        data_watt_hours_grid = {
-                            "energy_forward": round(
-                                (data_watt_hours["grid"]["energy_forward"] + grid_power_forward if "grid" in data_watt_hours else grid_power_forward),
-                                3,
-                            ),
-                            "energy_reverse": round(
-                                (data_watt_hours["grid"]["energy_reverse"] + grid_power_reverse if "grid" in data_watt_hours else grid_power_reverse),
-                                3,
-                            ),
-                        }
-                        if "L1" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L1": {
-                                        "energy_forward": round(
-                                            (data_watt_hours["grid"]["L1"]["energy_forward"] + grid_L1_power_forward if "grid" in data_watt_hours and "L1" in data_watt_hours["grid"] else grid_L1_power_forward),
-                                            3,
-                                        ),
-                                        "energy_reverse": round(
-                                            (data_watt_hours["grid"]["L1"]["energy_reverse"] + grid_L1_power_reverse if "grid" in data_watt_hours and "L1" in data_watt_hours["grid"] else grid_L1_power_reverse),
-                                            3,
-                                        ),
-                                    }
-                                }
-                            )
-                        if "L2" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L2": {
-                                        "energy_forward": round(
-                                            (data_watt_hours["grid"]["L2"]["energy_forward"] + grid_L2_power_forward if "grid" in data_watt_hours and "L2" in data_watt_hours["grid"] else grid_L2_power_forward),
-                                            3,
-                                        ),
-                                        "energy_reverse": round(
-                                            (data_watt_hours["grid"]["L2"]["energy_reverse"] + grid_L2_power_reverse if "grid" in data_watt_hours and "L2" in data_watt_hours["grid"] else grid_L2_power_reverse),
-                                            3,
-                                        ),
-                                    }
-                                }
-                            )
-                        if "L3" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L3": {
-                                        "energy_forward": round(
-                                            (data_watt_hours["grid"]["L3"]["energy_forward"] + grid_L3_power_forward if "grid" in data_watt_hours and "L3" in data_watt_hours["grid"] else grid_L3_power_forward),
-                                            3,
-                                        ),
-                                        "energy_reverse": round(
-                                            (data_watt_hours["grid"]["L3"]["energy_reverse"] + grid_L3_power_reverse if "grid" in data_watt_hours and "L3" in data_watt_hours["grid"] else grid_L3_power_reverse),
-                                            3,
-                                        ),
-                                    }
-                                }
-                            )
+            else:
+                if response.elapsed.total_seconds() > 5:
+                    logging.warning(f"--> fetch_meter_stream(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed.total_seconds()} seconds")
 
-                        data_watt_hours.update(
-                            {
-                                # if PV not needed it can be removed, yet to evaluate
-                                # 'pv': {
-                                #     'energy_forward': round(data_watt_hours['pv']['energy_forward'] + total_jsonpayload['pv']['power'], 3),
-                                # },
-                                "grid": data_watt_hours_grid,
-                                "count": data_watt_hours["count"] + 1,
-                            }
-                        )
-
-                        logging.debug("--> data_watt_hours(): %s" % json.dumps(data_watt_hours))
-
-                    # build mean, calculate time diff and Wh and write to file
-                    else:
-                        # check if file in volatile storage exists
-                        if os.path.isfile(data_watt_hours_working_file):
-                            with open(data_watt_hours_working_file, "r") as file:
-                                file = open(data_watt_hours_working_file, "r")
-                                data_watt_hours_old = json.load(file)
-                                logging.info("Loaded JSON")
-                                logging.debug(json.dumps(data_watt_hours_old))
-
-                        # if not, check if file in persistent storage exists
-                        elif os.path.isfile(data_watt_hours_storage_file):
-                            with open(data_watt_hours_storage_file, "r") as file:
-                                file = open(data_watt_hours_storage_file, "r")
-                                data_watt_hours_old = json.load(file)
-                                logging.info("Loaded JSON from persistent storage")
-                                logging.debug(json.dumps(data_watt_hours_old))
-
-                        # if not, generate data
-                        else:
-                            data_watt_hours_old_grid = {
-                                "energy_forward": 0,
-                                "energy_reverse": 0,
-                            }
-                            if "L1" in total_jsonpayload["grid"]:
-                                data_watt_hours_old_grid.update(
-                                    {
-                                        "L1": {
-                                            "energy_forward": 0,
-                                            "energy_reverse": 0,
-                                        }
-                                    }
-                                )
-                            if "L2" in total_jsonpayload["grid"]:
-                                data_watt_hours_old_grid.update(
-                                    {
-                                        "L2": {
-                                            "energy_forward": 0,
-                                            "energy_reverse": 0,
-                                        }
-                                    }
-                                )
-                            if "L3" in total_jsonpayload["grid"]:
-                                data_watt_hours_old_grid.update(
-                                    {
-                                        "L3": {
-                                            "energy_forward": 0,
-                                            "energy_reverse": 0,
-                                        }
-                                    }
-                                )
-                            data_watt_hours_old = {
-                                # if PV not needed it can be removed, yet to evaluate
-                                # 'pv': {
-                                #     'energy_forward': 0,
-                                # },
-                                "grid": data_watt_hours_old_grid
-                            }
-                            logging.info("Generated JSON")
-                            logging.debug(json.dumps(data_watt_hours_old))
-
-                        # factor to calculate Watthours: mean power * measuuring period / 3600 seconds (1 hour)
-                        factor = (timestamp - data_watt_hours["time_creation"]) / 3600
-
-                        # pv_energy_forward   = data_watt_hours_old['pv']['energy_forward'] + (data_watt_hours['pv']['energy_forward'] / data_watt_hours['count'] * factor)
-                        grid_energy_forward = round(
-                            data_watt_hours_old["grid"]["energy_forward"] + (data_watt_hours["grid"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                            3,
-                        )
-                        grid_energy_reverse = round(
-                            data_watt_hours_old["grid"]["energy_reverse"] + (data_watt_hours["grid"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                            3,
-                        )
-
-                        # update previously set data
-                        total_jsonpayload["grid"].update(
-                            {
-                                "energy_forward": grid_energy_forward,
-                                "energy_reverse": grid_energy_reverse,
-                            }
-                        )
-                        # prepare for save data
-                        json_data_grid = {
-                            "energy_forward": grid_energy_forward,
-                            "energy_reverse": grid_energy_reverse,
-                        }
+                stream.reset()
+                supervisor.connected()
 
-                        # # # L1
-                        if "L1" in data_watt_hours_old["grid"] and "L1" in data_watt_hours["grid"]:
-                            grid_L1_energy_forward = round(
-                                data_watt_hours_old["grid"]["L1"]["energy_forward"] + (data_watt_hours["grid"]["L1"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L1_energy_reverse = round(
-                                data_watt_hours_old["grid"]["L1"]["energy_reverse"] + (data_watt_hours["grid"]["L1"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                        # in case phase count changed
-                        elif "L1" in data_watt_hours["grid"]:
-                            grid_L1_energy_forward = round(
-                                (data_watt_hours["grid"]["L1"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L1_energy_reverse = round(
-                                (data_watt_hours["grid"]["L1"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
+                for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
 
-                        if "L1" in data_watt_hours["grid"]:
-                            # update previously set data
-                            total_jsonpayload["grid"]["L1"].update(
-                                {
-                                    "energy_forward": grid_L1_energy_forward,
-                                    "energy_reverse": grid_L1_energy_reverse,
-                                }
-                            )
+                    if keep_running is False:
+                        logging.info(f"--> fetch_meter_stream(){gateway.label}: got exit signal")
+                        response.close()
+                        stream.stop()
+                        sys.exit()
 
-                            json_data_grid.update(
-                                {
-                                    "L1": {
-                                        "energy_forward": grid_L1_energy_forward,
-                                        "energy_reverse": grid_L1_energy_reverse,
-                                    }
-                                }
-                            )
+                    supervisor.samples(stream.feed(chunk))
 
-                        # # # L2
-                        if "L2" in data_watt_hours_old["grid"] and "L2" in data_watt_hours["grid"]:
-                            grid_L2_energy_forward = round(
-                                data_watt_hours_old["grid"]["L2"]["energy_forward"] + (data_watt_hours["grid"]["L2"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L2_energy_reverse = round(
-                                data_watt_hours_old["grid"]["L2"]["energy_reverse"] + (data_watt_hours["grid"]["L2"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                        # in case phase count changed
-                        elif "L2" in data_watt_hours["grid"]:
-                            grid_L2_energy_forward = round(
-                                (data_watt_hours["grid"]["L2"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L2_energy_reverse = round(
-                                (data_watt_hours["grid"]["L2"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
+                    # a connection which sends data but no rows is stalled too
+                    if supervisor.stalled():
+                        break
 
-                        if "L2" in data_watt_hours["grid"]:
-                            # update previously set data
-                            total_jsonpayload["grid"]["L2"].update(
-                                {
-                                    "energy_forward": grid_L2_energy_forward,
-                                    "energy_reverse": grid_L2_energy_reverse,
-                                }
-                            )
+                    # follow the cadence of the stream
+                    if supervisor.heartbeat() != heartbeat:
+                        heartbeat = supervisor.heartbeat()
+                        set_read_timeout(response, heartbeat)
 
-                            json_data_grid.update(
-                                {
-                                    "L2": {
-                                        "energy_forward": grid_L2_energy_forward,
-                                        "energy_reverse": grid_L2_energy_reverse,
-                                    }
-                                }
-                            )
+                response.close()
+                stalled = supervisor.stalled()
+                logging.error(f"--> fetch_meter_stream(){gateway.label}: " + (f"No rows for {heartbeat:.1f} seconds" if stalled else "Stream closed by the Envoy"))
+                delay = supervisor.failed(stalled)
 
-                        # # # L3
-                        if "L3" in data_watt_hours_old["grid"] and "L3" in data_watt_hours["grid"]:
-                            grid_L3_energy_forward = round(
-                                data_watt_hours_old["grid"]["L3"]["energy_forward"] + (data_watt_hours["grid"]["L3"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L3_energy_reverse = round(
-                                data_watt_hours_old["grid"]["L3"]["energy_reverse"] + (data_watt_hours["grid"]["L3"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                        # in case phase count changed
-                        elif "L3" in data_watt_hours["grid"]:
-                            grid_L3_energy_forward = round(
-                                (data_watt_hours["grid"]["L3"]["energy_forward"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
-                            grid_L3_energy_reverse = round(
-                                (data_watt_hours["grid"]["L3"]["energy_reverse"] / data_watt_hours["count"] * factor) / 1000,
-                                3,
-                            )
+        except requests.exceptions.ConnectTimeout as e:
+            logging.error(f"--> fetch_meter_stream(){gateway.label}: ConnectTimeout occurred: {e}")
+            delay = supervisor.failed()
 
-                        if "L3" in data_watt_hours["grid"]:
-                            # update previously set data
-                            total_jsonpayload["grid"]["L3"].update(
-                                {
-                                    "energy_forward": grid_L3_energy_forward,
-                                    "energy_reverse": grid_L3_energy_reverse,
-                                }
-                            )
+        except (requests.exceptions.ReadTimeout, requests.exceptions.ConnectionError, requests.exceptions.ChunkedEncodingError) as e:
+            # a read timeout while streaming is raised as ConnectionError
+            stalled = supervisor.stalled()
+            logging.error(f"--> fetch_meter_stream(){gateway.label}: " + (f"No rows for {heartbeat:.1f} seconds" if stalled else f"{type(e).__name__} occurred: {e}"))
+            delay = supervisor.failed(stalled)
 
-                            json_data_grid.update(
-                                {
-                                    "L3": {
-                                        "energy_forward": grid_L3_energy_forward,
-                                        "energy_reverse": grid_L3_energy_reverse,
-                                    }
-                                }
-                            )
+        except Exception:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logging.error(f"--> fetch_meter_stream(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+            delay = supervisor.failed()
 
-                        json_data = {
-                            # # if PV not needed it can be removed, yet to evaluate
-                            # 'pv': {
-                            #     'energy_forward': pv_energy_forward,
-                            # },
-                            "grid": json_data_grid
-                        }
+        if keep_running is False:
+            logging.info(f"--> fetch_meter_stream(){gateway.label}: got exit signal")
+            stream.stop()
+            sys.exit()
 
-                        # save data to volatile storage
-                        with open(data_watt_hours_working_file, "w") as file:
-                            file.write(json.dumps(json_data))
-
-                        # save data to persistent storage if time is passed
-                        if timestamp_storage_file + data_watt_hours_save < timestamp:
-                            with open(data_watt_hours_storage_file, "w") as file:
-                                file.write(json.dumps(json_data))
-                            timestamp_storage_file = timestamp
-                            logging.info("Written JSON for energy forward/reverse to persistent storage.")
-
-                        # begin a new cycle
-                        data_watt_hours_grid = {
-                            "energy_forward": round(grid_power_forward, 3),
-                            "energy_reverse": round(grid_power_reverse, 3),
-                        }
-                        if "L1" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L1": {
-                                        "energy_forward": round(grid_L1_power_forward, 3),
-                                        "energy_reverse": round(grid_L1_power_reverse, 3),
-                                    }
-                                }
-                            )
-                        if "L2" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L2": {
-                                        "energy_forward": round(grid_L2_power_forward, 3),
-                                        "energy_reverse": round(grid_L2_power_reverse, 3),
-                                    }
-                                }
-                            )
-                        if "L3" in total_jsonpayload["grid"]:
-                            data_watt_hours_grid.update(
-                                {
-                                    "L3": {
-                                        "energy_forward": round(grid_L3_power_forward, 3),
-                                        "energy_reverse": round(grid_L3_power_reverse, 3),
-                                    }
-                                }
-                            )
+        logging.warning(f"--> fetch_meter_stream(){gateway.label}: Reconnecting in {delay:.1f} seconds ({supervisor.failures}. attempt)")
+        sleep(delay)
 
-                        data_watt_hours = {
-                            "time_creation": timestamp,
-                            # # if PV not needed it can be removed, yet to evaluate
-                            # 'pv': {
-                            #     'energy_forward': round(total_jsonpayload['pv']['power'], 3),
-                            # },
-                            "grid": data_watt_hours_grid,
-                            "count": 1,
-                        }
 
-                        logging.debug("--> data_watt_hours(): %s" % json.dumps(data_watt_hours))
+async def fetch_meter_stream_async(gateway, engine):
+    """Read the stream of a gateway in the event loop of the asyncio engine, same handling as fetch_meter_stream()."""
+    logging.info("step: fetch_meter_stream_async" + gateway.label)
 
-                    # make fetched data globally available
-                    data_meter_stream = total_jsonpayload
+    # loading the energy reads files, keep it out of the event loop
+    stream = await engine.run_blocking(MeterStream, gateway)
+    supervisor = StreamSupervisor(gateway.label)
+    auth = gateway.digest_auth
 
-                # reset error count
-                error_count = 0
+    try:
+        # the D7 token is loaded in parallel
+        while not gateway.authenticated.is_set():
+            await asyncio.sleep(0.5)
 
-        except requests.exceptions.ConnectTimeout as e:
-            logging.error("--> fetch_meter_stream(): ConnectTimeout occurred: %s" % e)
-            error_count += 1
-            sleep(15)
+        while 1:
+            try:
+                heartbeat = supervisor.heartbeat()
+                headers = gateway.request_headers
+                response = await stream_get(
+                    gateway.url("/stream/meter"),
+                    headers=headers if auth is None else None,
+                    auth=auth,
+                    timeout=heartbeat,
+                    fingerprint=gateway.config.certificate_fingerprint or None,
+                )
 
-        except requests.exceptions.ReadTimeout as e:
-            logging.error("--> fetch_meter_stream(): ReadTimeout occurred: %s" % e)
-            error_count += 1
-            sleep(1)
+                # the Envoy rejected the session or the token before its expiry: renew it and reconnect right away
+                if response.status_code == 401 and gateway.request_auth == "token":
+                    logging.warning(f"--> fetch_meter_stream_async(){gateway.label}: " + ("session expired, validating the token again" if "Cookie" in headers else "token rejected, renewing it"))
+                    response.close()
+                    if await engine.run_blocking(gateway.reauthenticate, headers) and gateway.request_headers != headers:
+                        continue
+                    delay = supervisor.failed()
 
-        except requests.exceptions.Timeout as e:
-            logging.error("--> fetch_meter_stream(): Timeout occurred: %s" % e)
-            error_count += 1
-            sleep(1)
+                elif response.status_code != 200:
+                    logging.error(f"--> fetch_meter_stream_async(){gateway.label}: Received HTTP status code {response.status_code}")
+                    response.close()
+                    delay = supervisor.failed()
 
-        except KeyError:
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            logging.error(f"--> fetch_meter_stream(): {repr(exception_object)} in {file} line #{line}")
-            error_count += 1
-            sleep(1)
+                else:
+                    if response.elapsed > 5:
+                        logging.warning(f"--> fetch_meter_stream_async(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed} seconds")
 
-        except Exception:
-            exception_type, exception_object, exception_traceback = sys.exc_info()
-            file = exception_traceback.tb_frame.f_code.co_filename
-            line = exception_traceback.tb_lineno
-            logging.error(f"--> fetch_meter_stream(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-            error_count += 1
-            sleep(1)
+                    stream.reset()
+                    supervisor.connected()
 
-        # stopping driver, if error count is exceeded
-        if error_count >= 5:
-            logging.error(f"--> fetch_meter_stream(): {error_count} errors accured. Stopping driver...")
-            keep_running = False
-            sys.exit()
+                    try:
+                        async for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+                            supervisor.samples(stream.feed(chunk))
+
+                            # a connection which sends data but no rows is stalled too
+                            if supervisor.stalled():
+                                break
+
+                            # the timeout of every read follows the cadence of the stream
+                            heartbeat = response.timeout = supervisor.heartbeat()
+                    finally:
+                        response.close()
+
+                    stalled = supervisor.stalled()
+                    logging.error(f"--> fetch_meter_stream_async(){gateway.label}: " + (f"No rows for {heartbeat:.1f} seconds" if stalled else "Stream closed by the Envoy"))
+                    delay = supervisor.failed(stalled)
+
+            except asyncio.TimeoutError:
+                stalled = supervisor.stalled()
+                logging.error(f"--> fetch_meter_stream_async(){gateway.label}: " + (f"No rows for {heartbeat:.1f} seconds" if stalled else "Timeout occurred"))
+                delay = supervisor.failed(stalled)
+
+            except OSError as e:
+                logging.error(f"--> fetch_meter_stream_async(){gateway.label}: Connection error occurred: {repr(e)}")
+                delay = supervisor.failed()
+
+            except Exception:
+                exception_type, exception_object, exception_traceback = sys.exc_info()
+                file = exception_traceback.tb_frame.f_code.co_filename
+                line = exception_traceback.tb_lineno
+                logging.error(f"--> fetch_meter_stream_async(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+                delay = supervisor.failed()
+
+            logging.warning(f"--> fetch_meter_stream_async(){gateway.label}: Reconnecting in {delay:.1f} seconds ({supervisor.failures}. attempt)")
+            await asyncio.sleep(delay)
 
+    except asyncio.CancelledError:
+        logging.info(f"--> fetch_meter_stream_async(){gateway.label}: got exit signal")
+        stream.stop()
+        raise
 
-def fetch_production_historic():
-    logging.info("step: fetch_production_historic")
 
-    global replace_meters, data_production_historic, keep_running, request_auth, request_headers, request_schema
+def fetch_production_historic(gateway):
+    logging.info("step: fetch_production_historic" + gateway.label)
+
+    global meter_names
+
+    # the D7 token is loaded in parallel, try again in a second
+    if not gateway.authenticated.is_set():
+        return 1
 
     try:
-        url = "%s://%s/production.json?details=1" % (
-            request_schema,
-            config["ENVOY"]["address"],
-        )
-        if request_auth == "token":
-            response = requests.get(url, timeout=60, headers=request_headers, verify=False)
-        else:
-            response = requests.get(
-                url,
-                timeout=60,
-                auth=HTTPDigestAuth("installer", config["ENVOY"]["password"]),
-            )
+        response = gateway.get("/production.json?details=1", timeout=60)
 
         if response.status_code != 200:
-            logging.error(f"--> fetch_production_historic(): Received HTTP status code {response.status_code}. Restarting the driver in 60 seconds.")
-            sleep(60)
-            keep_running = False
-            sys.exit()
+            logging.error(f"--> fetch_production_historic(){gateway.label}: Received HTTP status code {response.status_code}")
+            return False
 
         if response.elapsed.total_seconds() > 5:
-            logging.warning("--> fetch_production_historic(): HTTP request took longer than 5 seconds: %s seconds" % response.elapsed.total_seconds())
+            logging.warning(f"--> fetch_production_historic(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed.total_seconds()} seconds")
 
         total_jsonpayload = {}
+        # phases of the meters with measured energy, the D-Bus services get their paths before the stream delivers them
+        layout = {}
 
         for meter in response.json().values():
 
@@ -934,11 +665,7 @@ def fetch_production_historic():
 
                 if "measurementType" in content and (content["measurementType"] == "production" or content["measurementType"] == "total-consumption" or content["measurementType"] == "net-consumption"):
 
-                    meter_name = reduce(
-                        lambda a, kv: a.replace(*kv),
-                        replace_meters,
-                        content["measurementType"],
-                    )
+                    meter_name = meter_names[content["measurementType"]]
 
                     jsonpayload = {}
 
@@ -948,6 +675,9 @@ def fetch_production_historic():
 
                         for phase in content["lines"]:
 
+                            if float(phase["vahLifetime"]) > 0:
+                                layout.setdefault(meter_name, []).append("L" + str(i))
+
                             jsonpayload.update(
                                 {
                                     "L"
@@ -973,57 +703,61 @@ def fetch_production_historic():
                     total_jsonpayload.update({meter_name: jsonpayload})
 
         # make fetched data globally available
-        data_production_historic = total_jsonpayload
+        gateway.data_production_historic.publish(total_jsonpayload)
+        gateway.phase_layout.update(layout)
+
+        # the lifetime counters and the phase layout of the next start
+        gateway.save_state()
 
     except requests.exceptions.ConnectTimeout as e:
-        logging.error("--> fetch_production_historic(): ConnectTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_production_historic(){gateway.label}: ConnectTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.ReadTimeout as e:
-        logging.error("--> fetch_production_historic(): ReadTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_production_historic(){gateway.label}: ReadTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.Timeout as e:
-        logging.error("--> fetch_production_historic(): Timeout occurred: %s" % e)
+        logging.error(f"--> fetch_production_historic(){gateway.label}: Timeout occurred: {e}")
+        return False
 
     except Exception:
         exception_type, exception_object, exception_traceback = sys.exc_info()
         file = exception_traceback.tb_frame.f_code.co_filename
         line = exception_traceback.tb_lineno
-        logging.error(f"--> fetch_production_historic(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-        keep_running = False
-        sys.exit()
+        logging.error(f"--> fetch_production_historic(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+        return False
 
 
-def fetch_devices():
-    logging.info("step: fetch_devices")
+def fetch_devices(gateway):
+    logging.info("step: fetch_devices" + gateway.label)
 
-    global replace_devices, data_devices, keep_running, request_auth, request_headers, request_schema
+    global device_names
+
+    # the D7 token is loaded in parallel, try again in a second
+    if not gateway.authenticated.is_set():
+        return 1
 
     try:
 
-        url = "%s://%s/inventory.json" % (request_schema, config["ENVOY"]["address"])
-        if request_auth == "token":
-            response = requests.get(url, timeout=60, headers=request_headers, verify=False)
-        else:
-            response = requests.get(
-                url,
-                timeout=60,
-                auth=HTTPDigestAuth("installer", config["ENVOY"]["password"]),
-            )
+        response = gateway.get_changed("/inventory.json", timeout=60)
+
+        # the inventory did not change since the last request, the published data is still valid
+        if response is None:
+            return
 
         if response.status_code != 200:
-            logging.error(f"--> fetch_devices(): Received HTTP status code {response.status_code}. Restarting the driver in 60 seconds.")
-            sleep(60)
-            keep_running = False
-            sys.exit()
+            logging.error(f"--> fetch_devices(){gateway.label}: Received HTTP status code {response.status_code}")
+            return False
 
         if response.elapsed.total_seconds() > 5:
-            logging.warning("--> fetch_devices(): HTTP request took longer than 5 seconds: %s seconds" % response.elapsed.total_seconds())
+            logging.warning(f"--> fetch_devices(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed.total_seconds()} seconds")
 
         total_jsonpayload = {}
 
         for device_type in response.json():
 
-            device_name = reduce(lambda a, kv: a.replace(*kv), replace_devices, device_type["type"])
+            device_name = device_names[device_type["type"]]
 
             jsonpayload = {}
 
@@ -1049,66 +783,66 @@ def fetch_devices():
 
             total_jsonpayload.update({device_name: jsonpayload})
 
-        # make fetched data globally available
-        data_devices = total_jsonpayload
+        # make fetched data globally available, the version changes only if the data changed
+        gateway.data_devices.publish(total_jsonpayload, only_changed=True)
 
     except requests.exceptions.ConnectTimeout as e:
-        logging.error("--> fetch_devices(): ConnectTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_devices(){gateway.label}: ConnectTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.ReadTimeout as e:
-        logging.error("--> fetch_devices(): ReadTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_devices(){gateway.label}: ReadTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.Timeout as e:
-        logging.error("--> fetch_devices(): Timeout occurred: %s" % e)
+        logging.error(f"--> fetch_devices(){gateway.label}: Timeout occurred: {e}")
+        return False
 
     except Exception:
         exception_type, exception_object, exception_traceback = sys.exc_info()
         file = exception_traceback.tb_frame.f_code.co_filename
         line = exception_traceback.tb_lineno
-        logging.error(f"--> fetch_devices(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-        keep_running = False
-        sys.exit()
+        logging.error(f"--> fetch_devices(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+        return False
 
 
-def fetch_inverters():
-    logging.info("step: fetch_inverters")
+def fetch_inverters(gateway):
+    logging.info("step: fetch_inverters" + gateway.label)
 
-    global data_inverters, inverters, keep_running, request_auth, request_headers, request_schema
+    # the D7 token is loaded in parallel, try again in a second
+    if not gateway.authenticated.is_set():
+        return 1
 
     try:
 
-        url = "%s://%s/api/v1/production/inverters" % (
-            request_schema,
-            config["ENVOY"]["address"],
-        )
-        if request_auth == "token":
-            response = requests.get(url, timeout=60, headers=request_headers, verify=False)
+        # an unchanged response is skipped as long as no counted inverter report gets too old
+        if time() < gateway.inverters_expiry:
+            response = gateway.get_changed("/api/v1/production/inverters", timeout=60)
+            if response is None:
+                # no new reports yet
+                return gateway.report_schedule.update({}, time()) if gateway.report_schedule is not None else None
         else:
-            response = requests.get(
-                url,
-                timeout=60,
-                auth=HTTPDigestAuth("installer", config["ENVOY"]["password"]),
-            )
+            response = gateway.get("/api/v1/production/inverters", timeout=60)
 
         if response.status_code != 200:
-            logging.error(f"--> fetch_inverters(): Received HTTP status code {response.status_code}. Restarting the driver in 60 seconds.")
-            sleep(60)
-            keep_running = False
-            sys.exit()
+            logging.error(f"--> fetch_inverters(){gateway.label}: Received HTTP status code {response.status_code}")
+            return False
 
         if response.elapsed.total_seconds() > 5:
-            logging.warning("--> fetch_inverters(): HTTP request took longer than 5 seconds: %s seconds" % response.elapsed.total_seconds())
+            logging.warning(f"--> fetch_inverters(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed.total_seconds()} seconds")
 
         total_jsonpayload = {}
 
         inverters_producing = 0
         inverters_total = 0
+        inverters_expiry = float("inf")
         for inverter in response.json():
 
             # count reporting inverters and set power to 0 if lastReportDate is older than 900 (default microinverter reporting interval) seconds + 300 seconds
             if inverter["lastReportDate"] + 1200 > int(time()):
                 inverters_total += 1
                 inverter_power = inverter["lastReportWatts"]
+                inverters_expiry = min(inverters_expiry, inverter["lastReportDate"] + 1200)
             else:
                 inverter_power = 0
 
@@ -1126,60 +860,62 @@ def fetch_inverters():
             if inverter_power > 5:
                 inverters_producing += 1
 
-        inverters.update({"reporting": inverters_total, "producing": inverters_producing})
+        gateway.inverters.update({"reporting": inverters_total, "producing": inverters_producing})
+        gateway.inverters_expiry = inverters_expiry
 
-        if inverters["config"] is None:
-            inverters.update({"config": inverters_total})
+        if gateway.inverters["config"] is None:
+            gateway.inverters.update({"config": inverters_total})
 
-        # make fetched data globally available
-        data_inverters = total_jsonpayload
+        # make fetched data globally available, the version changes only if the data changed
+        gateway.data_inverters.publish(total_jsonpayload, only_changed=True)
+
+        # seconds until the next poll, after the expected reports of the microinverters
+        if gateway.report_schedule is not None:
+            delay = gateway.report_schedule.update({serial: inverter["lastReportDate"] for serial, inverter in total_jsonpayload.items()}, time())
+            logging.debug(f"--> fetch_inverters(){gateway.label}: report period {gateway.report_schedule.period}, window {gateway.report_schedule.window}, next poll in {round(delay)} seconds")
+            return delay
 
     except requests.exceptions.ConnectTimeout as e:
-        logging.error("--> fetch_inverters(): ConnectTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_inverters(){gateway.label}: ConnectTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.ReadTimeout as e:
-        logging.error("--> fetch_inverters(): ReadTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_inverters(){gateway.label}: ReadTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.Timeout as e:
-        logging.error("--> fetch_inverters(): Timeout occurred: %s" % e)
+        logging.error(f"--> fetch_inverters(){gateway.label}: Timeout occurred: {e}")
+        return False
 
     except Exception:
         exception_type, exception_object, exception_traceback = sys.exc_info()
         file = exception_traceback.tb_frame.f_code.co_filename
         line = exception_traceback.tb_lineno
-        logging.error(f"--> fetch_inverters(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-        keep_running = False
-        sys.exit()
+        logging.error(f"--> fetch_inverters(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+        return False
 
 
-def fetch_events():
-    logging.info("step: fetch_events")
+def fetch_events(gateway):
+    logging.info("step: fetch_events" + gateway.label)
 
-    global data_events, keep_running, request_auth, request_headers, request_schema
+    # the D7 token is loaded in parallel, try again in a second
+    if not gateway.authenticated.is_set():
+        return 1
 
     try:
 
-        url = "%s://%s/datatab/event_dt.rb?start=0&length=10" % (
-            request_schema,
-            config["ENVOY"]["address"],
-        )
-        if request_auth == "token":
-            response = requests.get(url, timeout=60, headers=request_headers, verify=False)
-        else:
-            response = requests.get(
-                url,
-                timeout=60,
-                auth=HTTPDigestAuth("installer", config["ENVOY"]["password"]),
-            )
+        response = gateway.get_changed("/datatab/event_dt.rb?start=0&length=10", timeout=60)
+
+        # the events did not change since the last request, the published data is still valid
+        if response is None:
+            return
 
         if response.status_code != 200:
-            logging.error(f"--> fetch_events(): Received HTTP status code {response.status_code}. Restarting the driver in 60 seconds.")
-            sleep(60)
-            keep_running = False
-            sys.exit()
+            logging.error(f"--> fetch_events(){gateway.label}: Received HTTP status code {response.status_code}")
+            return False
 
         if response.elapsed.total_seconds() > 5:
-            logging.warning("--> fetch_events(): HTTP request took longer than 5 seconds: %s seconds" % response.elapsed.total_seconds())
+            logging.warning(f"--> fetch_events(){gateway.label}: HTTP request took longer than 5 seconds: {response.elapsed.total_seconds()} seconds")
 
         total_jsonpayload = {}
 
@@ -1196,103 +932,92 @@ def fetch_events():
                 }
             )
 
-        # make fetched data globally available
-        data_events = total_jsonpayload
+        # make fetched data globally available, the version changes only if the data changed
+        gateway.data_events.publish(total_jsonpayload, only_changed=True)
 
     except requests.exceptions.ConnectTimeout as e:
-        logging.error("--> fetch_events(): ConnectTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_events(){gateway.label}: ConnectTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.ReadTimeout as e:
-        logging.error("--> fetch_events(): ReadTimeout occurred: %s" % e)
+        logging.error(f"--> fetch_events(){gateway.label}: ReadTimeout occurred: {e}")
+        return False
 
     except requests.exceptions.Timeout as e:
-        logging.error("--> fetch_events(): Timeout occurred: %s" % e)
+        logging.error(f"--> fetch_events(){gateway.label}: Timeout occurred: {e}")
+        return False
 
     except Exception:
         exception_type, exception_object, exception_traceback = sys.exc_info()
         file = exception_traceback.tb_frame.f_code.co_filename
         line = exception_traceback.tb_lineno
-        logging.error(f"--> fetch_events(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-        keep_running = False
-        sys.exit()
-
-
-def fetch_handler():
-    logging.info("step: fetch_handler")
-
-    global config, keep_running
-    global fetch_production_historic_interval, fetch_devices_interval, fetch_inverters_interval, fetch_events_interval
-    global fetch_production_historic_last, fetch_devices_last, fetch_inverters_last, fetch_events_last
-
-    while 1:
-
-        if keep_running is False:
-            logging.info("--> fetch_handler(): got exit signal")
-            sys.exit()
-
-        time_now = int(time())
-
-        if (time_now - fetch_production_historic_last) > fetch_production_historic_interval:
-            try:
-                fetch_production_historic()
-                fetch_production_historic_last = time_now
-                logging.info("--> fetch_handler() --> fetch_production_historic(): JSON data feched. Wait %s seconds for next run" % fetch_production_historic_interval)
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logging.error(f"--> fetch_handler() --> fetch_production_historic(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-                logging.error(f"Try again in {fetch_production_historic_interval} seconds")
-
-        if fetch_devices_enabled == 1 and ((time_now - fetch_devices_last) > fetch_devices_interval):
-            try:
-                fetch_devices()
-                fetch_devices_last = time_now
-                logging.info("--> fetch_handler() --> fetch_devices(): JSON data feched. Wait %s seconds for next run" % fetch_devices_interval)
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logging.error(f"--> fetch_handler() --> fetch_devices(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-                logging.error(f"Try again in {fetch_devices_interval} seconds")
-
-        if fetch_inverters_enabled == 1 and ((time_now - fetch_inverters_last) > fetch_inverters_interval):
-            try:
-                fetch_inverters()
-                fetch_inverters_last = time_now
-                logging.info("--> fetch_handler() --> fetch_inverters(): JSON data feched. Wait %s seconds for next run" % fetch_inverters_interval)
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logging.error(f"--> fetch_handler() --> fetch_inverters(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-                logging.error(f"Try again in {fetch_inverters_interval} seconds")
-
-        if fetch_events_enabled == 1 and ((time_now - fetch_events_last) > fetch_events_interval):
-            try:
-                fetch_events()
-                fetch_events_last = time_now
-                logging.info("--> fetch_handler() --> fetch_events(): JSON data feched. Wait %s seconds for next run" % fetch_events_interval)
-            except Exception:
-                exception_type, exception_object, exception_traceback = sys.exc_info()
-                file = exception_traceback.tb_frame.f_code.co_filename
-                line = exception_traceback.tb_lineno
-                logging.error(f"--> fetch_handler() --> fetch_events(): Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
-                logging.error(f"Try again in {fetch_events_interval} seconds")
-
-        # slow down requests to prevent overloading the Envoy
-        sleep(1)
+        logging.error(f"--> fetch_events(){gateway.label}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+        return False
+
+
+def fetch_tasks(gateway):
+    """Return the enabled fetch functions of a gateway with their intervals.
+
+    The functions return False if the request failed, the scheduler repeats them with a backoff.
+    A failing endpoint of one gateway does not affect the other tasks and gateways.
+    fetch_inverters() returns the seconds until the next poll if it is aligned to the reports,
+    check_token() the seconds until the token of a D7 gateway is due for renewal.
+    """
+    tasks = [(check_token, TOKEN_BACKOFF_MAX)] if gateway.request_auth == "token" else []
+    tasks.append((fetch_production_historic, gateway.config.fetch_production_historic_interval))
+    if settings.fetch_devices_enabled == 1:
+        tasks.append((fetch_devices, settings.fetch_devices_interval))
+    if settings.fetch_inverters_enabled == 1:
+        tasks.append((fetch_inverters, settings.fetch_inverters_interval))
+    if settings.fetch_events_enabled == 1:
+        tasks.append((fetch_events, settings.fetch_events_interval))
+    return tasks
+
+
+def publish_mqtt_snapshots(versions):
+    """Publish the data of all gateways which changed since the versions, updates the versions."""
+    global client, gateways
+
+    for gateway in gateways:
+        version = versions.setdefault(gateway.name, {"meter_stream": 0, "devices": 0, "inverters": 0, "events": 0})
+
+        # check if data_meter_stream is not empty and data is changed
+        if gateway.data_meter_stream.changed_since(version["meter_stream"]):
+            snapshot = gateway.data_meter_stream.snapshot
+            version["meter_stream"] = snapshot.version
+            # the stream sample has no JSON representation, publish its values as dicts
+            client.publish(gateway.topic(settings.mqtt_topic_meters), json.dumps(snapshot.data.to_dict()))
+            logging.info(f"--> publish_mqtt_data() --> data_meter_stream{gateway.label}: MQTT data published")
+
+        # check if data_devices is enabled, not empty and data is changed
+        if settings.fetch_devices_enabled == 1 and gateway.data_devices and (settings.fetch_devices_publishing_type == 1 or gateway.data_devices.changed_since(version["devices"])):
+            snapshot = gateway.data_devices.snapshot
+            version["devices"] = snapshot.version
+            client.publish(gateway.topic(settings.mqtt_topic_devices), json.dumps(snapshot.data))
+            logging.info(f"--> publish_mqtt_data() --> data_devices{gateway.label}: MQTT data published")
+
+        # check if data_inverters is enabled, not empty and data is changed
+        if settings.fetch_inverters_enabled == 1 and gateway.data_inverters and (settings.fetch_inverters_publishing_type == 1 or gateway.data_inverters.changed_since(version["inverters"])):
+            snapshot = gateway.data_inverters.snapshot
+            version["inverters"] = snapshot.version
+            client.publish(gateway.topic(settings.mqtt_topic_inverters), json.dumps(snapshot.data))
+            logging.info(f"--> publish_mqtt_data() --> data_inverters{gateway.label}: MQTT data published")
+
+        # check if data_events is enabled, not empty and data is changed
+        if settings.fetch_events_enabled == 1 and gateway.data_events and (settings.fetch_events_publishing_type == 1 or gateway.data_events.changed_since(version["events"])):
+            snapshot = gateway.data_events.snapshot
+            version["events"] = snapshot.version
+            client.publish(gateway.topic(settings.mqtt_topic_events), json.dumps(snapshot.data))
+            logging.info(f"--> publish_mqtt_data() --> data_events{gateway.label}: MQTT data published")
 
 
 def publish_mqtt_data():
     logging.info("step: publish_mqtt_data")
 
-    global client, config, keep_running, data_meter_stream, data_devices, data_inverters, data_events
+    global keep_running
 
-    data_previous_meter_stream = {}
-    data_previous_devices = {}
-    data_previous_inverters = {}
-    data_previous_events = {}
+    # versions of the last published data per gateway
+    versions = {}
 
     while 1:
 
@@ -1301,35 +1026,9 @@ def publish_mqtt_data():
             sys.exit()
 
         try:
-            # check if data_meter_stream is not empty and data is changed
-            if data_meter_stream and data_previous_meter_stream != data_meter_stream:
-                data_previous_meter_stream = data_meter_stream
-                client.publish(config["MQTT"]["topic_meters"], json.dumps(data_meter_stream))
-                logging.info("--> publish_mqtt_data() --> data_meter_stream: MQTT data published")
-
-            # check if data_devices is enabled, not empty and data is changed
-            if fetch_devices_enabled == 1 and data_devices and ((fetch_devices_publishing_type == 0 and data_previous_devices != data_devices) or fetch_devices_publishing_type == 1):
-                data_previous_devices = data_devices
-                client.publish(config["MQTT"]["topic_devices"], json.dumps(data_devices))
-                logging.info("--> publish_mqtt_data() --> data_devices: MQTT data published")
-
-            # check if data_inverters is enabled, not empty and data is changed
-            if fetch_inverters_enabled == 1 and data_inverters and ((fetch_inverters_publishing_type == 0 and data_previous_inverters != data_inverters) or fetch_inverters_publishing_type == 1):
-                data_previous_inverters = data_inverters
-                client.publish(config["MQTT"]["topic_inverters"], json.dumps(data_inverters))
-                logging.info("--> publish_mqtt_data() --> data_inverters: MQTT data published")
-
-            # check if data_events is enabled, not empty and data is changed
-            if fetch_events_enabled == 1 and data_events and ((fetch_events_publishing_type == 0 and data_previous_events != data_events) or fetch_events_publishing_type == 1):
-                data_previous_events = data_events
-                client.publish(config["MQTT"]["topic_events"], json.dumps(data_events))
-                logging.info("--> publish_mqtt_data() --> data_events: MQTT data published")
-
-            # check if publish_interval is greater or equals 1, else the load is too much
-            if int(config["MQTT"]["publish_interval"]) >= 1:
-                publish_interval = int(config["MQTT"]["publish_interval"])
-            else:
-                publish_interval = 1
+            publish_mqtt_snapshots(versions)
+
+            publish_interval = settings.mqtt_publish_interval
 
             logging.info("--> publish_mqtt_data(): MQTT data published. Wait %s seconds for next run" % publish_interval)
 
@@ -1346,21 +1045,46 @@ def publish_mqtt_data():
 
 
 # VICTRON ENERGY - VENUS OS
-class DbusEnphaseEnvoyPvService:
+def get_bus():
+    """Return a private bus connection, every service of this process needs its own one to export its root object."""
+    return dbus.SessionBus(private=True) if "DBUS_SESSION_BUS_ADDRESS" in os.environ else dbus.SystemBus(private=True)
+
+
+class DbusEnphaseEnvoyService:
+    """Common part of the D-Bus services which are fed from the meter stream.
+
+    Creates the management and mandatory paths, registers the service and schedules the updates.
+    Subclasses add their own paths in _add_paths() and set the values in _update_values().
+    The service can be registered with the cached values of the last run before the first row of
+    the stream arrives, /Connected is 1 while the rows are fresh.
+    paths: the paths of the totals
+    phase_paths: function which returns the paths of a phase, they are added for every phase of the
+    meter_name in the phase layout of the gateways, also for phases which appear at runtime
+    gateways: the gateways whose stream is published, the base class uses the first one
+    """
+
+    meter_name = None
+
     def __init__(
         self,
         servicename,
         deviceinstance,
         paths,
-        productname="Enphase PV",
-        connection="Enphase PV service",
-        hardware="Microinverters",
+        phase_paths,
+        gateways,
+        productname,
+        connection,
+        hardware,
     ):
 
-        global config
-
-        self._dbusservice = VeDbusService(servicename, register=False)
+        self._dbusservice = VeDbusService(servicename, bus=get_bus(), register=False)
+        self._servicename = servicename
         self._paths = paths
+        self._phase_paths = phase_paths
+        self._gateways = gateways
+        self._phases = []
+        self._layout_versions = None
+        self._first_value = True
 
         logging.debug("%s /DeviceInstance = %d" % (servicename, deviceinstance))
 
@@ -1381,22 +1105,42 @@ class DbusEnphaseEnvoyPvService:
         self._dbusservice.add_path("/CustomName", productname)
         self._dbusservice.add_path("/FirmwareVersion", "0.2.4-dev (20241008)")
         self._dbusservice.add_path("/HardwareVersion", hardware)
-        self._dbusservice.add_path("/Connected", 1)
+        self._dbusservice.add_path("/Connected", self._connected())
 
         self._dbusservice.add_path("/Latency", None)
         self._dbusservice.add_path("/ErrorCode", 0)
-        self._dbusservice.add_path(
-            "/Position",
-            int(config["PV"]["position"]),
-            writeable=True,
-            onchangecallback=self.callback_position,
-        )  # only needed for pvinverter
-        self._dbusservice.add_path("/StatusCode", 0)  # Dummy path so VRM detects us as a PV-inverter
 
-        self._dbusservice.add_path("/DeviceName", "")  # used to populate working inverters after
+        self._add_paths()
+
+        self._add_paths_settings(self._dbusservice, self._paths)
+        self._add_phases(self._dbusservice)
+
+        # register VeDbusService after all paths where added
+        self._dbusservice.register()
+        logging.info(f"{servicename}: registered {monotonic() - driver_started:.1f} seconds after the start" + ("" if self._has_data() else " before the first data"))
+
+        if settings.dbus_update_mode == 1:
+            # the stream thread signals new values, at most one update is queued in the main loop
+            self._update_lock = threading.Lock()
+            self._update_queued = False
+            self._update_interval = 1 / settings.dbus_update_max_rate
+            self._update_next = 0
+            for gateway in self._gateways:
+                gateway.data_meter_stream.subscribe(self._queue_update)
+                # production.json can add phases before the stream delivers them
+                gateway.data_production_historic.subscribe(self._queue_update)
+            # the data published before the subscription
+            self._queue_update(None)
+            GLib.timeout_add_seconds(10, self._check_running)
+        else:
+            GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
 
-        for path, settings in self._paths.items():
-            self._dbusservice.add_path(
+    def _add_paths(self):
+        pass
+
+    def _add_paths_settings(self, dbusservice, paths):
+        for path, settings in paths.items():
+            dbusservice.add_path(
                 path,
                 settings["initial"],
                 writeable=True,
@@ -1404,111 +1148,223 @@ class DbusEnphaseEnvoyPvService:
                 gettextcallback=settings["textformat"],
             )
 
-        # register VeDbusService after all paths where added
-        self._dbusservice.register()
+    def _add_phases(self, dbusservice):
+        """Add the paths of the phases which are new in the phase layout of the gateways.
+
+        dbusservice: the service before its registration, afterwards a ServiceContext which announces the new paths in ItemsChanged
+        """
+        layout_versions = [gateway.phase_layout.version for gateway in self._gateways]
+        if layout_versions == self._layout_versions:
+            return
+        self._layout_versions = layout_versions
+
+        for phase_name in PHASES:
+            if phase_name not in self._phases and any(phase_name in gateway.phases(self.meter_name) for gateway in self._gateways):
+                self._add_paths_settings(dbusservice, self._phase_paths(phase_name))
+                self._phases.append(phase_name)
+                logging.info(f"{self._servicename}: added the paths of {phase_name}")
+
+    def _update_values(self, dbusservice, meter_stream):
+        raise NotImplementedError
+
+    def _meter_stream(self):
+        return self._gateways[0].data_meter_stream.data
+
+    def _has_data(self):
+        # the cached values are shown until a gateway delivered its first row, gateways without rows are skipped
+        return any(gateway.data_meter_stream for gateway in self._gateways)
+
+    def _connected(self):
+        return 1 if any(gateway.data_meter_stream.timestamp > time() - connected_timeout for gateway in self._gateways) else 0
+
+    def _update_connected(self):
+        with self._dbusservice as dbusservice:
+            dbusservice["/Connected"] = self._connected()
+
+    def _queue_update(self, snapshot):
+        # called in the stream thread for every new row
+        with self._update_lock:
+            if self._update_queued:
+                return
+            self._update_queued = True
+
+        delay = self._update_next - monotonic()
+        if delay > 0:
+            GLib.timeout_add(int(delay * 1000) + 1, self._update_queued_values)
+        else:
+            GLib.idle_add(self._update_queued_values, priority=GLib.PRIORITY_DEFAULT)
+
+    def _update_queued_values(self):
+        # rows which arrive while the update runs queue the next one
+        with self._update_lock:
+            self._update_queued = False
+        self._update_next = monotonic() + self._update_interval
+        self._update()
+        return False
 
-        GLib.timeout_add(1000, self._update)  # pause 1000ms before the next request
+    def _check_running(self):
+        if keep_running is False:
+            logging.info("--> %s->_check_running(): got exit signal" % self.__class__.__name__)
+            sys.exit()
+        # no new rows are queued while the stream is reconnected
+        self._update_connected()
+        return True
 
     def _update(self):
 
         if keep_running is False:
-            logging.info("--> DbusEnphaseEnvoyPvService->_update(): got exit signal")
+            logging.info("--> %s->_update(): got exit signal" % self.__class__.__name__)
             sys.exit()
 
-        self._dbusservice["/Ac/Power"] = round(data_meter_stream["pv"]["power"], 2) if data_meter_stream["pv"]["power"] is not None else None
-        self._dbusservice["/Ac/Current"] = round(data_meter_stream["pv"]["current"], 2) if data_meter_stream["pv"]["current"] is not None else None
-        self._dbusservice["/Ac/Voltage"] = round(data_meter_stream["pv"]["voltage"], 2) if data_meter_stream["pv"]["voltage"] is not None else None
+        # collect all changes and emit them in one ItemsChanged signal instead of one PropertiesChanged per path
+        with self._dbusservice as dbusservice:
+            # phases which appeared in production.json or the stream get their paths before their values are set
+            self._add_phases(dbusservice)
+
+            if not self._has_data():
+                dbusservice["/Connected"] = self._connected()
+                return True
+
+            self._update_values(dbusservice, self._meter_stream())
+            dbusservice["/Connected"] = self._connected()
+
+            # increment UpdateIndex - to show that new data is available
+            index = dbusservice["/UpdateIndex"] + 1  # increment index
+            if index > 255:  # maximum value of the index
+                index = 0  # overflow from 255 to 0
+            dbusservice["/UpdateIndex"] = index
+
+        if self._first_value:
+            self._first_value = False
+            logging.warning(f"{self._servicename}: first value on D-Bus {monotonic() - driver_started:.1f} seconds after the start")
+
+        return True
+
+    def _handlechangedvalue(self, path, value):
+        logging.debug("someone else updated %s to %s" % (path, value))
+        return True  # accept the change
+
+
+class DbusEnphaseEnvoyPvService(DbusEnphaseEnvoyService):
+
+    meter_name = "pv"
+
+    def __init__(
+        self,
+        servicename,
+        deviceinstance,
+        paths,
+        phase_paths,
+        gateways,
+        productname="Enphase PV",
+        connection="Enphase PV service",
+        hardware="Microinverters",
+    ):
+        super().__init__(servicename, deviceinstance, paths, phase_paths, gateways, productname, connection, hardware)
+
+    def _add_paths(self):
+        self._dbusservice.add_path(
+            "/Position",
+            settings.pv_position,
+            writeable=True,
+            onchangecallback=self.callback_position,
+        )  # only needed for pvinverter
+        self._dbusservice.add_path("/StatusCode", 0)  # Dummy path so VRM detects us as a PV-inverter
+
+        self._dbusservice.add_path("/DeviceName", "")  # used to populate working inverters after
+
+    def _inverters(self):
+        return self._gateways[0].inverters
+
+    def _auth_token(self):
+        return self._gateways[0].auth_token["auth_token"]
+
+    def _update_values(self, dbusservice, meter_stream):
+        inverters = self._inverters()
+
+        dbusservice["/Ac/Power"] = round(meter_stream["pv"]["power"], 2) if meter_stream["pv"]["power"] is not None else None
+        dbusservice["/Ac/Current"] = round(meter_stream["pv"]["current"], 2) if meter_stream["pv"]["current"] is not None else None
+        dbusservice["/Ac/Voltage"] = round(meter_stream["pv"]["voltage"], 2) if meter_stream["pv"]["voltage"] is not None else None
         # needed for VRM historical data
-        self._dbusservice["/Ac/Energy/Forward"] = round(data_meter_stream["pv"]["energy_forward"], 2) if data_meter_stream["pv"]["energy_forward"] is not None else None
+        dbusservice["/Ac/Energy/Forward"] = round(meter_stream["pv"]["energy_forward"], 2) if meter_stream["pv"]["energy_forward"] is not None else None
 
-        self._dbusservice["/ErrorCode"] = 0
+        dbusservice["/ErrorCode"] = 0
 
         # is only displayed for Fronius inverters (product ID 0xA142) in GUI but displayed in VRM portal
         # if power above or equal to 5 W, set status code to 7 (running)
-        if self._dbusservice["/Ac/Power"] >= 5:
-            if self._dbusservice["/StatusCode"] != 7:
-                self._dbusservice["/StatusCode"] = 7
+        if dbusservice["/Ac/Power"] >= 5:
+            if dbusservice["/StatusCode"] != 7:
+                dbusservice["/StatusCode"] = 7
         # else set status code to 8 (standby)
         else:
-            if self._dbusservice["/StatusCode"] != 8:
-                self._dbusservice["/StatusCode"] = 8
+            if dbusservice["/StatusCode"] != 8:
+                dbusservice["/StatusCode"] = 8
 
-        self._dbusservice["/DeviceName"] = (
+        dbusservice["/DeviceName"] = (
             str(inverters["producing"]) + " of " + str(inverters["config"]) + " ⚡️" + (" (" + str(inverters["config"] - inverters["reporting"]) + " u/a)" if inverters["config"] > inverters["reporting"] else "")
         )
 
-        self._dbusservice["/Enphase/AuthToken"] = auth_token["auth_token"]
-        self._dbusservice["/Enphase/MicroInvertersConfig"] = inverters["config"]
-        self._dbusservice["/Enphase/MicroInvertersReporting"] = inverters["reporting"]
-        self._dbusservice["/Enphase/MicroInvertersProducing"] = inverters["producing"]
+        dbusservice["/Enphase/AuthToken"] = self._auth_token()
+        dbusservice["/Enphase/MicroInvertersConfig"] = inverters["config"]
+        dbusservice["/Enphase/MicroInvertersReporting"] = inverters["reporting"]
+        dbusservice["/Enphase/MicroInvertersProducing"] = inverters["producing"]
 
-        if "L1" in data_meter_stream["pv"]:
-            self._dbusservice["/Ac/L1/Power"] = round(data_meter_stream["pv"]["L1"]["power"], 2) if data_meter_stream["pv"]["L1"]["power"] is not None else None
-            self._dbusservice["/Ac/L1/Current"] = round(data_meter_stream["pv"]["L1"]["current"], 2) if data_meter_stream["pv"]["L1"]["current"] is not None else None
-            self._dbusservice["/Ac/L1/Voltage"] = round(data_meter_stream["pv"]["L1"]["voltage"], 2) if data_meter_stream["pv"]["L1"]["voltage"] is not None else None
-            self._dbusservice["/Ac/L1/Frequency"] = round(data_meter_stream["pv"]["L1"]["frequency"], 4) if data_meter_stream["pv"]["L1"]["frequency"] is not None else None
+        if "L1" in meter_stream["pv"] and "/Ac/L1/Power" in dbusservice:
+            dbusservice["/Ac/L1/Power"] = round(meter_stream["pv"]["L1"]["power"], 2) if meter_stream["pv"]["L1"]["power"] is not None else None
+            dbusservice["/Ac/L1/Current"] = round(meter_stream["pv"]["L1"]["current"], 2) if meter_stream["pv"]["L1"]["current"] is not None else None
+            dbusservice["/Ac/L1/Voltage"] = round(meter_stream["pv"]["L1"]["voltage"], 2) if meter_stream["pv"]["L1"]["voltage"] is not None else None
+            dbusservice["/Ac/L1/Frequency"] = round(meter_stream["pv"]["L1"]["frequency"], 4) if meter_stream["pv"]["L1"]["frequency"] is not None else None
             # needed for VRM historical data
-            self._dbusservice["/Ac/L1/Energy/Forward"] = round(data_meter_stream["pv"]["L1"]["energy_forward"], 2) if data_meter_stream["pv"]["L1"]["energy_forward"] is not None else None
+            dbusservice["/Ac/L1/Energy/Forward"] = round(meter_stream["pv"]["L1"]["energy_forward"], 2) if meter_stream["pv"]["L1"]["energy_forward"] is not None else None
 
-        if "L2" in data_meter_stream["pv"]:
-            self._dbusservice["/Ac/L2/Power"] = round(data_meter_stream["pv"]["L2"]["power"], 2) if data_meter_stream["pv"]["L2"]["power"] is not None else None
-            self._dbusservice["/Ac/L2/Current"] = round(data_meter_stream["pv"]["L2"]["current"], 2) if data_meter_stream["pv"]["L2"]["current"] is not None else None
-            self._dbusservice["/Ac/L2/Voltage"] = round(data_meter_stream["pv"]["L2"]["voltage"], 2) if data_meter_stream["pv"]["L2"]["voltage"] is not None else None
-            self._dbusservice["/Ac/L2/Frequency"] = round(data_meter_stream["pv"]["L2"]["frequency"], 4) if data_meter_stream["pv"]["L2"]["frequency"] is not None else None
+        if "L2" in meter_stream["pv"] and "/Ac/L2/Power" in dbusservice:
+            dbusservice["/Ac/L2/Power"] = round(meter_stream["pv"]["L2"]["power"], 2) if meter_stream["pv"]["L2"]["power"] is not None else None
+            dbusservice["/Ac/L2/Current"] = round(meter_stream["pv"]["L2"]["current"], 2) if meter_stream["pv"]["L2"]["current"] is not None else None
+            dbusservice["/Ac/L2/Voltage"] = round(meter_stream["pv"]["L2"]["voltage"], 2) if meter_stream["pv"]["L2"]["voltage"] is not None else None
+            dbusservice["/Ac/L2/Frequency"] = round(meter_stream["pv"]["L2"]["frequency"], 4) if meter_stream["pv"]["L2"]["frequency"] is not None else None
             # needed for VRM historical data
-            self._dbusservice["/Ac/L2/Energy/Forward"] = round(data_meter_stream["pv"]["L2"]["energy_forward"], 2) if data_meter_stream["pv"]["L2"]["energy_forward"] is not None else None
+            dbusservice["/Ac/L2/Energy/Forward"] = round(meter_stream["pv"]["L2"]["energy_forward"], 2) if meter_stream["pv"]["L2"]["energy_forward"] is not None else None
 
-        if "L3" in data_meter_stream["pv"]:
-            self._dbusservice["/Ac/L3/Power"] = round(data_meter_stream["pv"]["L3"]["power"], 2) if data_meter_stream["pv"]["L3"]["power"] is not None else None
-            self._dbusservice["/Ac/L3/Current"] = round(data_meter_stream["pv"]["L3"]["current"], 2) if data_meter_stream["pv"]["L3"]["current"] is not None else None
-            self._dbusservice["/Ac/L3/Voltage"] = round(data_meter_stream["pv"]["L3"]["voltage"], 2) if data_meter_stream["pv"]["L3"]["voltage"] is not None else None
-            self._dbusservice["/Ac/L3/Frequency"] = round(data_meter_stream["pv"]["L3"]["frequency"], 4) if data_meter_stream["pv"]["L3"]["frequency"] is not None else None
+        if "L3" in meter_stream["pv"] and "/Ac/L3/Power" in dbusservice:
+            dbusservice["/Ac/L3/Power"] = round(meter_stream["pv"]["L3"]["power"], 2) if meter_stream["pv"]["L3"]["power"] is not None else None
+            dbusservice["/Ac/L3/Current"] = round(meter_stream["pv"]["L3"]["current"], 2) if meter_stream["pv"]["L3"]["current"] is not None else None
+            dbusservice["/Ac/L3/Voltage"] = round(meter_stream["pv"]["L3"]["voltage"], 2) if meter_stream["pv"]["L3"]["voltage"] is not None else None
+            dbusservice["/Ac/L3/Frequency"] = round(meter_stream["pv"]["L3"]["frequency"], 4) if meter_stream["pv"]["L3"]["frequency"] is not None else None
             # needed for VRM historical data
-            self._dbusservice["/Ac/L3/Energy/Forward"] = round(data_meter_stream["pv"]["L3"]["energy_forward"], 2) if data_meter_stream["pv"]["L3"]["energy_forward"] is not None else None
+            dbusservice["/Ac/L3/Energy/Forward"] = round(meter_stream["pv"]["L3"]["energy_forward"], 2) if meter_stream["pv"]["L3"]["energy_forward"] is not None else None
 
         logging.debug(
             "PV: {:.1f} W - {:.1f} V - {:.1f} A".format(
-                data_meter_stream["pv"]["power"],
-                data_meter_stream["pv"]["voltage"],
-                data_meter_stream["pv"]["current"],
+                meter_stream["pv"]["power"],
+                meter_stream["pv"]["voltage"],
+                meter_stream["pv"]["current"],
             )
         )
-        if "L1" in data_meter_stream["pv"] and data_meter_stream["pv"]["power"] != data_meter_stream["pv"]["L1"]["power"]:
+        if "L1" in meter_stream["pv"] and meter_stream["pv"]["power"] != meter_stream["pv"]["L1"]["power"]:
             logging.debug(
                 "|- L1: {:.1f} W - {:.1f} V - {:.1f} A".format(
-                    data_meter_stream["pv"]["L1"]["power"],
-                    data_meter_stream["pv"]["L1"]["voltage"],
-                    data_meter_stream["pv"]["L1"]["current"],
+                    meter_stream["pv"]["L1"]["power"],
+                    meter_stream["pv"]["L1"]["voltage"],
+                    meter_stream["pv"]["L1"]["current"],
                 )
             )
-        if "L2" in data_meter_stream["pv"]:
+        if "L2" in meter_stream["pv"]:
             logging.debug(
                 "|- L2: {:.1f} W - {:.1f} V - {:.1f} A".format(
-                    data_meter_stream["pv"]["L2"]["power"],
-                    data_meter_stream["pv"]["L2"]["voltage"],
-                    data_meter_stream["pv"]["L2"]["current"],
+                    meter_stream["pv"]["L2"]["power"],
+                    meter_stream["pv"]["L2"]["voltage"],
+                    meter_stream["pv"]["L2"]["current"],
                 )
             )
-        if "L3" in data_meter_stream["pv"]:
+        if "L3" in meter_stream["pv"]:
             logging.debug(
                 "|- L3: {:.1f} W - {:.1f} V - {:.1f} A".format(
-                    data_meter_stream["pv"]["L3"]["power"],
-                    data_meter_stream["pv"]["L3"]["voltage"],
-                    data_meter_stream["pv"]["L3"]["current"],
+                    meter_stream["pv"]["L3"]["power"],
+                    meter_stream["pv"]["L3"]["voltage"],
+                    meter_stream["pv"]["L3"]["current"],
                 )
             )
 
-        # increment UpdateIndex - to show that new data is available
-        index = self._dbusservice["/UpdateIndex"] + 1  # increment index
-        if index > 255:  # maximum value of the index
-            index = 0  # overflow from 255 to 0
-        self._dbusservice["/UpdateIndex"] = index
-        return True
-
-    def _handlechangedvalue(self, path, value):
-        logging.debug("someone else updated %s to %s" % (path, value))
-        return True  # accept the change
-
     def callback_position(self, path, value):
         logging.info("Position changed to %s" % value)
         try:
@@ -1530,8 +1386,129 @@ class DbusEnphaseEnvoyPvService:
             return False
 
 
+class DbusEnphaseEnvoyAggregatedPvService(DbusEnphaseEnvoyPvService):
+    """One PV inverter with the sum of the PV of all gateways.
+
+    Power, current and energy are summed, voltage and frequency are averaged over the gateways
+    which measure the phase. A new row of any gateway updates the service.
+    """
+
+    def _meter_stream(self):
+        pv = {"power": 0, "current": 0, "voltage": 0, "energy_forward": 0}
+        voltages = []
+        phases = {}
+
+        for gateway in self._gateways:
+            if not gateway.data_meter_stream:
+                continue
+            meter = gateway.data_meter_stream.data["pv"]
+            pv["power"] += meter["power"]
+            pv["current"] += meter["current"]
+            pv["energy_forward"] += meter["energy_forward"]
+            voltages.append(meter["voltage"])
+
+            for phase_name in ("L1", "L2", "L3"):
+                if phase_name in meter:
+                    phase = phases.setdefault(phase_name, {"power": 0, "current": 0, "voltage": [], "frequency": [], "energy_forward": 0})
+                    phase["power"] += meter[phase_name]["power"]
+                    phase["current"] += meter[phase_name]["current"]
+                    phase["energy_forward"] += meter[phase_name]["energy_forward"]
+                    phase["voltage"].append(meter[phase_name]["voltage"])
+                    phase["frequency"].append(meter[phase_name]["frequency"])
+
+        if voltages:
+            pv["voltage"] = sum(voltages) / len(voltages)
+        for phase_name, phase in phases.items():
+            phase["voltage"] = sum(phase["voltage"]) / len(phase["voltage"])
+            phase["frequency"] = sum(phase["frequency"]) / len(phase["frequency"])
+            pv[phase_name] = phase
+
+        return {"pv": pv}
+
+    def _inverters(self):
+        return sum_inverters(self._gateways)
+
+    def _auth_token(self):
+        # every gateway has its own token
+        return ""
+
+
+class DbusEnphaseEnvoyMeterService(DbusEnphaseEnvoyService):
+    """Meter of the Envoy-S (total and per phase) like the grid meter or the AC loads.
+
+    meter_name: the meter of the stream sample, e.g. "grid"
+    with_reverse: publish the energy reverse, which is only integrated for the grid
+    """
+
+    meter_name = None
+    with_reverse = False
+
+    def _update_values(self, dbusservice, meter_stream):
+        meter = meter_stream[self.meter_name]
+
+        dbusservice["/Ac/Power"] = round(meter["power"], 2)
+        dbusservice["/Ac/Current"] = round(meter["current"], 2)
+        dbusservice["/Ac/Voltage"] = round(meter["voltage"], 2)
+        # needed for VRM historical data
+        dbusservice["/Ac/Energy/Forward"] = round(meter["energy_forward"], 2)
+        if self.with_reverse:
+            dbusservice["/Ac/Energy/Reverse"] = round(meter["energy_reverse"], 2)
+
+        for phase_name in ("L1", "L2", "L3"):
+            if phase_name in meter and "/Ac/%s/Power" % phase_name in dbusservice:
+                phase = meter[phase_name]
+                dbusservice["/Ac/%s/Power" % phase_name] = round(phase["power"], 2)
+                dbusservice["/Ac/%s/Current" % phase_name] = round(phase["current"], 2)
+                dbusservice["/Ac/%s/Voltage" % phase_name] = round(phase["voltage"], 2)
+                dbusservice["/Ac/%s/Frequency" % phase_name] = round(phase["frequency"], 4)
+                dbusservice["/Ac/%s/Energy/Forward" % phase_name] = round(phase["energy_forward"], 2)
+                if self.with_reverse:
+                    dbusservice["/Ac/%s/Energy/Reverse" % phase_name] = round(phase["energy_reverse"], 2)
+
+        logging.debug("{}: {:.1f} W - {:.1f} V - {:.1f} A".format(self.meter_name, meter["power"], meter["voltage"], meter["current"]))
+
+
+class DbusEnphaseEnvoyGridService(DbusEnphaseEnvoyMeterService):
+    """Grid meter from the net-consumption CT of the Envoy-S, the energy is integrated by the driver."""
+
+    meter_name = "grid"
+    with_reverse = True
+
+    def __init__(
+        self,
+        servicename,
+        deviceinstance,
+        paths,
+        phase_paths,
+        gateways,
+        productname="Enphase Grid meter",
+        connection="Enphase Grid meter service",
+        hardware="Envoy-S net-consumption CT",
+    ):
+        super().__init__(servicename, deviceinstance, paths, phase_paths, gateways, productname, connection, hardware)
+
+
+class DbusEnphaseEnvoyAcloadService(DbusEnphaseEnvoyMeterService):
+    """AC loads from the total-consumption meter of the Envoy-S."""
+
+    meter_name = "consumption"
+
+    def __init__(
+        self,
+        servicename,
+        deviceinstance,
+        paths,
+        phase_paths,
+        gateways,
+        productname="Enphase Consumption",
+        connection="Enphase Consumption service",
+        hardware="Envoy-S total-consumption CT",
+    ):
+        super().__init__(servicename, deviceinstance, paths, phase_paths, gateways, productname, connection, hardware)
+
+
 def main():
-    global client, fetch_production_historic_last, fetch_devices_last, fetch_inverters_last, fetch_events_last, request_schema, auth_token, keep_running
+    global client, gateways
 
     _thread.daemon = True  # allow the program to quit
 
@@ -1543,7 +1520,7 @@ def main():
     DBusGMainLoop(set_as_default=True)
 
     # MQTT configuration
-    if MQTT_enabled == 1:
+    if settings.mqtt_enabled == 1:
         # create new instance
         client = mqtt.Client("EnphaseEnvoyPV_" + get_vrm_portal_id())
         client.on_disconnect = on_disconnect
@@ -1551,122 +1528,78 @@ def main():
         client.on_publish = on_publish
 
         # check tls and use settings, if provided
-        if "tls_enabled" in config["MQTT"] and config["MQTT"]["tls_enabled"] == "1":
+        if settings.mqtt_tls_enabled:
             logging.info("MQTT client: TLS is enabled")
 
-            if "tls_path_to_ca" in config["MQTT"] and config["MQTT"]["tls_path_to_ca"] != "":
-                logging.info("MQTT client: TLS: custom ca %s used" % config["MQTT"]["tls_path_to_ca"])
-                client.tls_set(config["MQTT"]["tls_path_to_ca"], tls_version=2)
+            if settings.mqtt_tls_path_to_ca != "":
+                logging.info("MQTT client: TLS: custom ca %s used" % settings.mqtt_tls_path_to_ca)
+                client.tls_set(settings.mqtt_tls_path_to_ca, tls_version=2)
             else:
                 client.tls_set(tls_version=2)
 
-            if "tls_insecure" in config["MQTT"] and config["MQTT"]["tls_insecure"] != "":
+            if settings.mqtt_tls_insecure:
                 logging.info("MQTT client: TLS certificate server hostname verification disabled")
                 client.tls_insecure_set(True)
 
         # check if username and password are set
-        if "username" in config["MQTT"] and "password" in config["MQTT"] and config["MQTT"]["username"] != "" and config["MQTT"]["password"] != "":
-            logging.info("MQTT client: Using username %s and password to connect" % config["MQTT"]["username"])
-            client.username_pw_set(username=config["MQTT"]["username"], password=config["MQTT"]["password"])
+        if settings.mqtt_username != "" and settings.mqtt_password != "":
+            logging.info("MQTT client: Using username %s and password to connect" % settings.mqtt_username)
+            client.username_pw_set(username=settings.mqtt_username, password=settings.mqtt_password)
 
         # connect to broker
-        logging.info(f"MQTT client: Connecting to broker {config['MQTT']['broker_address']} on port {config['MQTT']['broker_port']}")
+        logging.info(f"MQTT client: Connecting to broker {settings.mqtt_broker_address} on port {settings.mqtt_broker_port}")
         client.connect(
-            host=config["MQTT"]["broker_address"],
-            port=int(config["MQTT"]["broker_port"]),
+            host=settings.mqtt_broker_address,
+            port=settings.mqtt_broker_port,
         )
         client.loop_start()
 
-    # Auth token for firmware D7
-    if request_auth == "token":
-        # check auth token
-        # start threat for fetching data every x seconds in background
-        tokenManager_thread = threading.Thread(target=tokenManager, name="Thread-TokenManager")
-        tokenManager_thread.daemon = True
-        tokenManager_thread.start()
-
-        # wait to fetch auth_token
-        i = 0
-        while auth_token["auth_token"] == "":
-            if i % 60 != 0 or i == 0:
-                logging.info("--> token still empty")
-            else:
-                logging.warning("token still empty")
-
-            if keep_running is False:
-                logging.info("--> wait for first data: got exit signal")
-                sys.exit()
-
-            if i > 300:
-                logging.error("Maximum of 300 seconds wait time reached. Restarting the driver.")
-                keep_running = False
-                sys.exit()
-
-            sleep(1)
-            i += 1
-
-    # Enphase Envoy-S
-    # start threat for fetching data every x seconds in background
-    fetch_handler_thread = threading.Thread(target=fetch_handler, name="Thread-FetchHandler")
-    fetch_handler_thread.daemon = True
-    fetch_handler_thread.start()
-
-    # wait to fetch data_production_historic else data_meter_stream cannot be fully merged
-    i = 0
-    while not bool(data_production_historic):
-        if i % 60 != 0 or i == 0:
-            logging.info("--> data_production_historic not yet ready")
-        else:
-            logging.warning(
-                f"--> data_production_historic not yet ready after {i} seconds.\n"
-                + f"Try accessing {request_schema}://{config['ENVOY']['address']}/production.json?details=1 from your PC and see,\n"
-                + "if it downloads a file with JSON content."
-            )
-
-        if keep_running is False:
-            logging.info("--> wait for first data: got exit signal")
-            sys.exit()
-
-        if i > 300:
-            logging.error("Maximum of 300 seconds wait time reached. Restarting the driver.")
-            keep_running = False
-            sys.exit()
-
-        sleep(1)
-        i += 1
-
-    # start threat for fetching continuously the stream in background
-    fetch_meter_stream_thread = threading.Thread(target=fetch_meter_stream, name="Thread-FetchMeterStream")
-    fetch_meter_stream_thread.daemon = True
-    fetch_meter_stream_thread.start()
-
-    # wait to fetch fetch_meter_stream else dbus initialisation for phase count is wrong
-    i = 0
-    while not bool(data_meter_stream):
-        if i % 60 != 0 or i == 0:
-            logging.info("--> data_meter_stream not yet ready")
-        else:
-            logging.warning(
-                f"--> data_meter_stream not yet ready after {i} seconds.\n"
-                + f"Try accessing {request_schema}://{config['ENVOY']['address']}/stream/meter from your PC with the Envoy-S installer credentials and see,\n"
-                + "if it downloads a file with JSON content (one JSON per line). When it's working like expected you have\n"
-                + "to interrupt the download after a few seconds, since the Envoy-S is streaming the data."
-            )
+    # one gateway per [ENVOY] or [ENVOY:<name>] section
+    gateways.extend(EnphaseEnvoy(gateway_config) for gateway_config in settings.gateways)
 
-        if keep_running is False:
-            logging.info("--> wait for first data: got exit signal")
-            sys.exit()
-
-        if i > 300:
-            logging.error("Maximum of 300 seconds wait time reached. Restarting the driver.")
-            keep_running = False
-            sys.exit()
-
-        sleep(1)
-        i += 1
-
-    # start threat for publishing mqtt data in background
-    if MQTT_enabled == 1:
+    # one event loop thread runs all fetch tasks, the blocking requests run in a thread pool
+    if settings.fetch_engine == "asyncio":
+        # one worker per periodic task and one per stream for its setup and reauthentication, so a slow request never waits for another one
+        async_engine = AsyncEngine(max_workers=sum(len(fetch_tasks(gateway)) + 1 for gateway in gateways))
+        async_engine.start()
+        logging.info("Using the asyncio engine")
+    else:
+        async_engine = None
+
+    # the token, production.json and the stream are fetched in parallel, the requests of a gateway wait only for its token
+
+    # intervals of the fetch tasks by name, a reload of the config.ini changes them
+    task_intervals = {}
+
+    # Enphase Envoy-S, the token of a D7 gateway is loaded and renewed by the check_token() task
+    if async_engine is not None:
+        # one task per gateway and endpoint, the stream first so it is set up before the periodic tasks start their requests
+        for gateway in gateways:
+            async_engine.spawn(fetch_meter_stream_async(gateway, async_engine))
+            for function, interval in fetch_tasks(gateway):
+                task_intervals[function.__name__ + gateway.label] = interval
+                async_engine.periodic(function.__name__ + gateway.label, interval, function, gateway)
+        fetch_scheduler = None
+    else:
+        # one worker per gateway and endpoint, started at the deadlines of the scheduler
+        fetch_scheduler = Scheduler()
+        for gateway in gateways:
+            for function, interval in fetch_tasks(gateway):
+                task_intervals[function.__name__ + gateway.label] = interval
+                fetch_scheduler.add(function.__name__ + gateway.label, interval, function, gateway)
+        fetch_scheduler.start()
+
+    # start one threat per gateway for fetching continuously the stream in background, the asyncio engine reads it in its loop
+    if async_engine is None:
+        for gateway in gateways:
+            fetch_meter_stream_thread = threading.Thread(target=fetch_meter_stream, args=(gateway,), name="Thread-FetchMeterStream" + gateway.label)
+            fetch_meter_stream_thread.daemon = True
+            fetch_meter_stream_thread.start()
+
+    # start threat for publishing mqtt data in background, the asyncio engine publishes in its loop
+    if settings.mqtt_enabled == 1 and async_engine is not None:
+        async_engine.periodic("publish_mqtt_data", settings.mqtt_publish_interval, publish_mqtt_snapshots, {}, blocking=False)
+    elif settings.mqtt_enabled == 1:
         publish_mqtt_data_thread = threading.Thread(target=publish_mqtt_data, name="Thread-PublishMqttData")
         publish_mqtt_data_thread.daemon = True
         publish_mqtt_data_thread.start()
@@ -1693,73 +1626,190 @@ def main():
     def _str(p, v):
         return str("%s" % v)
 
-    paths_dbus = {
-        "/Ac/Power": {"initial": 0, "textformat": _w},
-        "/Ac/Current": {"initial": 0, "textformat": _a},
-        "/Ac/Voltage": {"initial": 0, "textformat": _v},
-        "/Ac/Energy/Forward": {"initial": None, "textformat": _kwh},
-        "/Ac/MaxPower": {"initial": int(config["PV"]["max"]), "textformat": _w},
-        "/UpdateIndex": {"initial": 0, "textformat": _n},
-        "/Enphase/AuthToken": {
-            "initial": "",
-            "textformat": _str,
-        },  # used to populate chaging token
-        "/Enphase/MicroInvertersConfig": {
-            "initial": inverters["config"],
-            "textformat": _n,
-        },
-        "/Enphase/MicroInvertersReporting": {
-            "initial": inverters["reporting"],
-            "textformat": _n,
-        },
-        "/Enphase/MicroInvertersProducing": {
-            "initial": inverters["producing"],
-            "textformat": _n,
-        },
-    }
-
-    if "L1" in data_meter_stream["pv"]:
-        paths_dbus.update(
-            {
-                "/Ac/L1/Power": {"initial": 0, "textformat": _w},
-                "/Ac/L1/Current": {"initial": 0, "textformat": _a},
-                "/Ac/L1/Voltage": {"initial": 0, "textformat": _v},
-                "/Ac/L1/Frequency": {"initial": None, "textformat": _hz},
-                "/Ac/L1/Energy/Forward": {"initial": None, "textformat": _kwh},
+    # energy of the gateways from the cached state, None if a gateway has no cached value
+    def cached_energy(energy_gateways, meter_name, key, phase_name=None):
+        total = 0
+        for gateway in energy_gateways:
+            values = gateway.cached_state.get("energy", {}).get(meter_name, {})
+            if phase_name is not None:
+                values = values.get(phase_name, {})
+            if key not in values:
+                return None
+            total += values[key]
+        return round(total, 2)
+
+    # paths of the PV services, the paths of the phases are added for the phase layouts of the gateways
+    def paths_pv(pv_gateways):
+        inverters = sum_inverters(pv_gateways)
+        paths = {
+            "/Ac/Power": {"initial": 0, "textformat": _w},
+            "/Ac/Current": {"initial": 0, "textformat": _a},
+            "/Ac/Voltage": {"initial": 0, "textformat": _v},
+            "/Ac/Energy/Forward": {"initial": cached_energy(pv_gateways, "pv", "energy_forward"), "textformat": _kwh},
+            "/Ac/MaxPower": {"initial": sum(gateway.max_power for gateway in pv_gateways), "textformat": _w},
+            "/UpdateIndex": {"initial": 0, "textformat": _n},
+            "/Enphase/AuthToken": {
+                "initial": "",
+                "textformat": _str,
+            },  # used to populate chaging token
+            "/Enphase/MicroInvertersConfig": {
+                "initial": inverters["config"],
+                "textformat": _n,
+            },
+            "/Enphase/MicroInvertersReporting": {
+                "initial": inverters["reporting"],
+                "textformat": _n,
+            },
+            "/Enphase/MicroInvertersProducing": {
+                "initial": inverters["producing"],
+                "textformat": _n,
+            },
+        }
+
+        return paths
+
+    def phase_paths_pv(pv_gateways):
+        def phase_paths(phase_name):
+            return {
+                "/Ac/%s/Power" % phase_name: {"initial": 0, "textformat": _w},
+                "/Ac/%s/Current" % phase_name: {"initial": 0, "textformat": _a},
+                "/Ac/%s/Voltage" % phase_name: {"initial": 0, "textformat": _v},
+                "/Ac/%s/Frequency" % phase_name: {"initial": None, "textformat": _hz},
+                "/Ac/%s/Energy/Forward" % phase_name: {"initial": cached_energy([gateway for gateway in pv_gateways if phase_name in gateway.phases("pv")], "pv", "energy_forward", phase_name), "textformat": _kwh},
             }
-        )
 
-    if "L2" in data_meter_stream["pv"]:
-        paths_dbus.update(
-            {
-                "/Ac/L2/Power": {"initial": 0, "textformat": _w},
-                "/Ac/L2/Current": {"initial": 0, "textformat": _a},
-                "/Ac/L2/Voltage": {"initial": 0, "textformat": _v},
-                "/Ac/L2/Frequency": {"initial": None, "textformat": _hz},
-                "/Ac/L2/Energy/Forward": {"initial": None, "textformat": _kwh},
-            }
+        return phase_paths
+
+    if settings.pv_aggregate == 1 and len(gateways) > 1:
+        # one PV inverter for all gateways, it takes the place of the single gateway service
+        DbusEnphaseEnvoyAggregatedPvService(
+            servicename="com.victronenergy.pvinverter.enphase_envoy",
+            deviceinstance=61,
+            paths=paths_pv(gateways),
+            phase_paths=phase_paths_pv(gateways),
+            gateways=gateways,
+            hardware=" + ".join(gateway.hardware for gateway in gateways),
         )
+    else:
+        for gateway in gateways:
+            DbusEnphaseEnvoyPvService(
+                servicename=gateway.servicename,
+                deviceinstance=gateway.deviceinstance,
+                paths=paths_pv([gateway]),
+                phase_paths=phase_paths_pv([gateway]),
+                gateways=[gateway],
+                hardware=gateway.hardware,
+            )
 
-    if "L3" in data_meter_stream["pv"]:
-        paths_dbus.update(
-            {
-                "/Ac/L3/Power": {"initial": 0, "textformat": _w},
-                "/Ac/L3/Current": {"initial": 0, "textformat": _a},
-                "/Ac/L3/Voltage": {"initial": 0, "textformat": _v},
-                "/Ac/L3/Frequency": {"initial": None, "textformat": _hz},
-                "/Ac/L3/Energy/Forward": {"initial": None, "textformat": _kwh},
+    # paths of the meter services, the paths of the phases are added for the phase layout of the gateway
+    def paths_meter(gateway, meter_name, with_reverse):
+        paths = {
+            "/Ac/Power": {"initial": 0, "textformat": _w},
+            "/Ac/Current": {"initial": 0, "textformat": _a},
+            "/Ac/Voltage": {"initial": 0, "textformat": _v},
+            "/Ac/Energy/Forward": {"initial": cached_energy([gateway], meter_name, "energy_forward"), "textformat": _kwh},
+            "/UpdateIndex": {"initial": 0, "textformat": _n},
+        }
+        if with_reverse:
+            paths["/Ac/Energy/Reverse"] = {"initial": cached_energy([gateway], meter_name, "energy_reverse"), "textformat": _kwh}
+
+        return paths
+
+    def phase_paths_meter(gateway, meter_name, with_reverse):
+        def phase_paths(phase_name):
+            paths = {
+                "/Ac/%s/Power" % phase_name: {"initial": 0, "textformat": _w},
+                "/Ac/%s/Current" % phase_name: {"initial": 0, "textformat": _a},
+                "/Ac/%s/Voltage" % phase_name: {"initial": 0, "textformat": _v},
+                "/Ac/%s/Frequency" % phase_name: {"initial": None, "textformat": _hz},
+                "/Ac/%s/Energy/Forward" % phase_name: {"initial": cached_energy([gateway], meter_name, "energy_forward", phase_name), "textformat": _kwh},
             }
+            if with_reverse:
+                paths["/Ac/%s/Energy/Reverse" % phase_name] = {"initial": cached_energy([gateway], meter_name, "energy_reverse", phase_name), "textformat": _kwh}
+            return paths
+
+        return phase_paths
+
+    # grid meter from the net-consumption CT
+    if settings.grid_enabled == 1:
+        gateway = get_gateway(settings.grid_gateway)
+        DbusEnphaseEnvoyGridService(
+            servicename="com.victronenergy.grid.enphase_envoy",
+            deviceinstance=settings.grid_deviceinstance,
+            paths=paths_meter(gateway, "grid", with_reverse=True),
+            phase_paths=phase_paths_meter(gateway, "grid", with_reverse=True),
+            gateways=[gateway],
         )
 
-    DbusEnphaseEnvoyPvService(
-        servicename="com.victronenergy.pvinverter.enphase_envoy",
-        deviceinstance=61,
-        paths=paths_dbus,
-        hardware=hardware,
-    )
+    # AC loads from the total-consumption CT
+    if settings.acload_enabled == 1:
+        gateway = get_gateway(settings.acload_gateway)
+        DbusEnphaseEnvoyAcloadService(
+            servicename="com.victronenergy.acload.enphase_envoy",
+            deviceinstance=settings.acload_deviceinstance,
+            paths=paths_meter(gateway, "consumption", with_reverse=False),
+            phase_paths=phase_paths_meter(gateway, "consumption", with_reverse=False),
+            gateways=[gateway],
+        )
 
     logging.info("Connected to dbus and switching over to GLib.MainLoop() (= event based)")
     mainloop = GLib.MainLoop()
+
+    # write the energy counters before the service is stopped or restarted
+    def on_signal(signal_name):
+        global keep_running
+        logging.info("Received %s, writing energy counters and stopping driver" % signal_name)
+        keep_running = False
+        if async_engine is not None:
+            async_engine.stop()
+        if fetch_scheduler is not None:
+            fetch_scheduler.stop()
+        for gateway in gateways:
+            if gateway.energy_store is not None:
+                gateway.energy_store.stop()
+            gateway.save_state()
+        mainloop.quit()
+        return False
+
+    # apply the changed settings of the config.ini which need no restart, the other ones are logged
+    def reload_config(reason):
+        try:
+            applied = settings.reload()
+        except Exception as e:
+            logging.error(f"Could not reload the config.ini ({reason}), keeping the running settings: {e}")
+            return
+
+        logging.warning(f"Reloaded the config.ini ({reason}), applied settings: {', '.join(applied) if applied else 'none'}")
+        logging.getLogger().setLevel(settings.logging_level)
+
+        # the publishing types and MQTT topics are read on every run, the intervals of the tasks are changed here
+        for gateway in gateways:
+            if gateway.report_schedule is not None:
+                gateway.report_schedule.fallback_interval = settings.fetch_inverters_interval
+            for function, interval in fetch_tasks(gateway):
+                name = function.__name__ + gateway.label
+                if task_intervals.get(name) != interval:
+                    task_intervals[name] = interval
+                    (async_engine or fetch_scheduler).set_interval(name, interval)
+
+        if settings.mqtt_enabled == 1 and async_engine is not None:
+            async_engine.set_interval("publish_mqtt_data", settings.mqtt_publish_interval)
+
+    def on_reload_signal():
+        reload_config("SIGHUP")
+        return True
+
+    def check_config_file():
+        if settings.changed():
+            reload_config("file changed")
+        return True
+
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGHUP, on_reload_signal)
+    GLib.timeout_add_seconds(CONFIG_CHECK_INTERVAL, check_config_file)
+
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGTERM, on_signal, "SIGTERM")
+    GLib.unix_signal_add(GLib.PRIORITY_HIGH, signal.SIGINT, on_signal, "SIGINT")
+
     mainloop.run()
 
 
@@ -0,0 +1,124 @@
+#!/usr/bin/env python
+
+import hashlib
+import os
+import threading
+from urllib.parse import urlsplit
+
+from requests.auth import AuthBase
+from requests.cookies import extract_cookies_to_jar
+from requests.utils import parse_dict_header
+
+DIGEST_HASHES = {
+    "MD5": hashlib.md5,
+    "MD5-SESS": hashlib.md5,
+    "SHA": hashlib.sha1,
+    "SHA-256": hashlib.sha256,
+    "SHA-256-SESS": hashlib.sha256,
+    "SHA-512": hashlib.sha512,
+}
+
+
+class DigestAuth(AuthBase):
+    """HTTP digest authentication which keeps the challenge of the Envoy across requests and threads.
+
+    HTTPDigestAuth of requests keeps the challenge per thread and the driver created a new one for each
+    request, so every request was sent twice: without authorization and after the 401 challenge. This
+    one answers the last challenge right away with the next nonce count and needs a second round trip
+    only if the Envoy rejects the nonce, e.g. because it expired.
+    """
+
+    def __init__(self, username, password):
+        self.username = username
+        self.password = password
+        self._lock = threading.Lock()
+        self._challenge = None
+        self._nonce_count = 0
+        # requests: built Authorization headers, challenges: received challenges
+        self.stats = {"requests": 0, "challenges": 0}
+
+    def challenge(self, header):
+        """Store the challenge of a "WWW-Authenticate: Digest ..." header, return False if it is no digest challenge."""
+        if not header.lower().startswith("digest "):
+            return False
+        with self._lock:
+            self._challenge = parse_dict_header(header[7:])
+            self._nonce_count = 0
+            self.stats["challenges"] += 1
+        return True
+
+    def header(self, method, url):
+        """Return the Authorization header for the request, None before the first challenge."""
+        with self._lock:
+            if self._challenge is None:
+                return None
+            challenge = self._challenge
+            self._nonce_count += 1
+            nonce_count = "%08x" % self._nonce_count
+            self.stats["requests"] += 1
+
+        realm = challenge.get("realm", "")
+        nonce = challenge.get("nonce", "")
+        algorithm = challenge.get("algorithm", "MD5").upper()
+        qop = challenge.get("qop")
+        opaque = challenge.get("opaque")
+        hash_function = DIGEST_HASHES.get(algorithm)
+        if hash_function is None:
+            return None
+
+        def digest(value):
+            return hash_function(value.encode("utf-8")).hexdigest()
+
+        parts = urlsplit(url)
+        path = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        cnonce = os.urandom(8).hex()
+
+        ha1 = digest("%s:%s:%s" % (self.username, realm, self.password))
+        if algorithm.endswith("-SESS"):
+            ha1 = digest("%s:%s:%s" % (ha1, nonce, cnonce))
+        ha2 = digest("%s:%s" % (method, path))
+
+        if qop is None:
+            response = digest("%s:%s:%s" % (ha1, nonce, ha2))
+        elif "auth" in [item.strip() for item in qop.split(",")]:
+            response = digest("%s:%s:%s:%s:%s:%s" % (ha1, nonce, nonce_count, cnonce, "auth", ha2))
+        else:
+            # auth-int is not supported
+            return None
+
+        header = 'username="%s", realm="%s", nonce="%s", uri="%s", response="%s"' % (self.username, realm, nonce, path, response)
+        if opaque:
+            header += ', opaque="%s"' % opaque
+        header += ', algorithm="%s"' % challenge.get("algorithm", "MD5")
+        if qop:
+            header += ', qop="auth", nc=%s, cnonce="%s"' % (nonce_count, cnonce)
+        return "Digest " + header
+
+    def handle_401(self, r, **kwargs):
+        """Answer a new challenge of the Envoy once, a second 401 is returned to the caller."""
+        if r.status_code != 401 or not self.challenge(r.headers.get("www-authenticate", "")):
+            return r
+        authorization = self.header(r.request.method, r.request.url)
+        if authorization is None:
+            return r
+
+        # consume the content to release the connection
+        r.content
+        r.close()
+        prep = r.request.copy()
+        extract_cookies_to_jar(prep._cookies, r.request, r.raw)
+        prep.prepare_cookies(prep._cookies)
+        prep.headers["Authorization"] = authorization
+
+        # sent without response hooks, so the retry is not answered again
+        _r = r.connection.send(prep, **kwargs)
+        _r.history.append(r)
+        _r.request = prep
+        return _r
+
+    def __call__(self, r):
+        authorization = self.header(r.method, r.url)
+        if authorization is not None:
+            r.headers["Authorization"] = authorization
+        r.register_hook("response", self.handle_401)
+        return r
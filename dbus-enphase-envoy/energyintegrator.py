@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+
+class EnergyIntegrator:
+    """Integrates the power of a meter to imported (forward) and exported (reverse) energy.
+
+    Uses the trapezoidal rule on monotonic timestamps for the total and every phase. If the power
+    changes its sign between two samples, the interval is split at the zero crossing.
+    Gaps longer than max_gap seconds (e.g. stream reconnects) are integrated for max_gap seconds
+    with the last known power only. Every sample costs O(1) and updates preallocated lists.
+    """
+
+    def __init__(self, phases=("L1", "L2", "L3"), max_gap=10):
+        self.phases = tuple(phases)
+        self.max_gap = max_gap
+        self.gaps = 0
+
+        # index 0 is the total, followed by the phases. Energy in Wh
+        self._index = {phase: index + 1 for index, phase in enumerate(self.phases)}
+        self.forward = [0.0] * (len(self.phases) + 1)
+        self.reverse = [0.0] * (len(self.phases) + 1)
+        self._power = [0.0] * (len(self.phases) + 1)
+        self._seen = [True] + [False] * len(self.phases)
+        self._timestamp = None
+
+    def load(self, data):
+        """Load the energy in kWh from the format of to_dict()."""
+        if "energy_forward" in data:
+            self.forward[0] = float(data["energy_forward"]) * 1000
+            self.reverse[0] = float(data["energy_reverse"]) * 1000
+        for phase, index in self._index.items():
+            if phase in data:
+                self.forward[index] = float(data[phase]["energy_forward"]) * 1000
+                self.reverse[index] = float(data[phase]["energy_reverse"]) * 1000
+                self._seen[index] = True
+
+    def to_dict(self):
+        """Return the energy in kWh for the total and every phase which delivered values."""
+        data = {
+            "energy_forward": round(self.forward[0] / 1000, 3),
+            "energy_reverse": round(self.reverse[0] / 1000, 3),
+        }
+        for phase, index in self._index.items():
+            if self._seen[index]:
+                data[phase] = {
+                    "energy_forward": round(self.forward[index] / 1000, 3),
+                    "energy_reverse": round(self.reverse[index] / 1000, 3),
+                }
+        return data
+
+    def add(self, timestamp, meter):
+        """Integrate the power of a MeterSample (total and active phases) up to timestamp in seconds."""
+        previous = self._timestamp
+        self._timestamp = timestamp
+        elapsed = timestamp - previous if previous is not None else 0
+
+        hold = elapsed > self.max_gap
+        if hold:
+            elapsed = self.max_gap
+            self.gaps += 1
+
+        self._integrate(0, meter.power, elapsed, hold)
+
+        index_of = self._index
+        for phase, phase_sample, active in zip(meter.layout, meter.phases, meter.active):
+            index = index_of[phase]
+            self._seen[index] = self._seen[index] or active
+            self._integrate(index, phase_sample.power if active else 0.0, elapsed, hold)
+
+    def apply(self, meter):
+        """Write the energy in kWh to a MeterSample (total and active phases)."""
+        meter.energy_forward = round(self.forward[0] / 1000, 3)
+        meter.energy_reverse = round(self.reverse[0] / 1000, 3)
+
+        index_of = self._index
+        for phase, phase_sample, active in zip(meter.layout, meter.phases, meter.active):
+            if active:
+                index = index_of[phase]
+                phase_sample.energy_forward = round(self.forward[index] / 1000, 3)
+                phase_sample.energy_reverse = round(self.reverse[index] / 1000, 3)
+
+    def _integrate(self, index, power, elapsed, hold):
+        start = self._power[index]
+        self._power[index] = power
+
+        if elapsed <= 0:
+            return
+
+        # during a gap only the last known power is held
+        end = start if hold else power
+
+        # W * s / 3600 = Wh, the trapezoid halves the sum of both values
+        if start >= 0 and end >= 0:
+            self.forward[index] += (start + end) * elapsed / 7200
+        elif start <= 0 and end <= 0:
+            self.reverse[index] -= (start + end) * elapsed / 7200
+        else:
+            crossing = start / (start - end) * elapsed
+            if start > 0:
+                self.forward[index] += start * crossing / 7200
+                self.reverse[index] -= end * (elapsed - crossing) / 7200
+            else:
+                self.reverse[index] -= start * crossing / 7200
+                self.forward[index] += end * (elapsed - crossing) / 7200
@@ -0,0 +1,167 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import struct
+import zlib
+from time import time
+
+# magic, phase mask, sequence number, timestamp, energy forward/reverse of the total and L1, L2, L3 in kWh
+RECORD = struct.Struct("<HHId8d")
+RECORD_CRC = struct.Struct("<I")
+RECORD_SIZE = RECORD.size + RECORD_CRC.size
+RECORD_MAGIC = 0xE1E7
+
+
+def write_atomic(path, text, sync=False):
+    """Replace a file atomically, so a power loss leaves either the old or the new content behind."""
+    directory = os.path.dirname(path)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+
+    path_tmp = path + ".tmp"
+    with open(path_tmp, "w") as file:
+        file.write(text)
+        if sync:
+            file.flush()
+            os.fsync(file.fileno())
+    os.replace(path_tmp, path)
+
+    if sync and directory:
+        fd = os.open(directory, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+
+class EnergyJournal:
+    """Crash-safe storage of the energy counters in a JSON snapshot and an append-only journal.
+
+    Every save appends a fixed-size binary record with a CRC32 to the journal instead of rewriting
+    the snapshot. After max_records records the journal is compacted: the snapshot is replaced
+    atomically and the journal is truncated. On load the last valid record newer than the snapshot
+    wins, torn or corrupt records at the end of the journal are dropped.
+
+    The snapshot keeps the format of the previous data_watt_hours.json ({"grid": {...}}), so it
+    can still be read by older versions of the driver.
+    """
+
+    def __init__(self, snapshot_file, journal_file=None, max_records=96, phases=("L1", "L2", "L3")):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file if journal_file is not None else os.path.splitext(snapshot_file)[0] + ".journal"
+        self.max_records = max_records
+        self.phases = tuple(phases)
+
+        self.seq = 0
+        self.records = 0
+
+    def load(self):
+        """Return the newest valid data from the snapshot and the journal or {}.
+
+        Also truncates the journal behind the last valid record, so new records are appended aligned.
+        """
+        data = {}
+        snapshot_seq = 0
+        snapshot_timestamp = 0
+        try:
+            if os.path.isfile(self.snapshot_file):
+                with open(self.snapshot_file, "r") as file:
+                    data = json.load(file)
+                if "journal" in data:
+                    snapshot_seq = int(data["journal"]["seq"])
+                else:
+                    # snapshot written by a previous version, only newer records win
+                    snapshot_timestamp = os.path.getmtime(self.snapshot_file)
+        except (OSError, KeyError, ValueError) as e:
+            logging.error("EnergyJournal: Could not load snapshot %s: %s" % (self.snapshot_file, e))
+            data = {}
+        self.seq = snapshot_seq
+
+        if not os.path.isfile(self.journal_file):
+            return data
+
+        with open(self.journal_file, "rb") as file:
+            content = file.read()
+
+        valid = 0
+        self.records = 0
+        with memoryview(content) as view:
+            for offset in range(0, len(content) - RECORD_SIZE + 1, RECORD_SIZE):
+                record = self._decode(view[offset : offset + RECORD_SIZE])
+                if record is None:
+                    break
+                valid = offset + RECORD_SIZE
+                self.records += 1
+
+                seq, timestamp, values = record
+                if seq > snapshot_seq and timestamp > snapshot_timestamp and seq > self.seq:
+                    data = {"grid": values, "journal": {"seq": seq, "timestamp": timestamp}}
+                self.seq = max(self.seq, seq)
+
+        if valid != len(content):
+            logging.warning("EnergyJournal: Dropped %d bytes of incomplete or corrupt records from %s" % (len(content) - valid, self.journal_file))
+            with open(self.journal_file, "r+b") as file:
+                file.truncate(valid)
+
+        return data
+
+    def save(self, data):
+        """Append the data ({"grid": {...}}) as record and compact the journal if it is full."""
+        self.seq += 1
+        record = self._encode(self.seq, time(), data["grid"])
+
+        directory = os.path.dirname(self.journal_file)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        with open(self.journal_file, "ab") as file:
+            file.write(record)
+            file.flush()
+            os.fsync(file.fileno())
+        self.records += 1
+
+        if self.records >= self.max_records:
+            self.compact(data)
+
+    def compact(self, data):
+        """Replace the snapshot atomically with the data and empty the journal."""
+        snapshot = {"grid": data["grid"], "journal": {"seq": self.seq, "timestamp": time()}}
+        write_atomic(self.snapshot_file, json.dumps(snapshot), sync=True)
+
+        # records up to seq are ignored on load now, so a crash before the truncate is harmless
+        with open(self.journal_file, "wb"):
+            pass
+        self.records = 0
+        logging.info("EnergyJournal: Compacted journal into %s" % self.snapshot_file)
+
+    def _encode(self, seq, timestamp, grid):
+        mask = 1 if "energy_forward" in grid else 0
+        values = [grid.get("energy_forward", 0.0), grid.get("energy_reverse", 0.0)]
+        for index, phase in enumerate(self.phases):
+            if phase in grid:
+                mask |= 2 << index
+                values += [grid[phase]["energy_forward"], grid[phase]["energy_reverse"]]
+            else:
+                values += [0.0, 0.0]
+
+        record = RECORD.pack(RECORD_MAGIC, mask, seq, timestamp, *values)
+        return record + RECORD_CRC.pack(zlib.crc32(record))
+
+    def _decode(self, record):
+        """Return (seq, timestamp, data) of a record or None, if it is not valid."""
+        if RECORD_CRC.unpack_from(record, RECORD.size)[0] != zlib.crc32(record[: RECORD.size]):
+            return None
+
+        magic, mask, seq, timestamp, *values = RECORD.unpack_from(record)
+        if magic != RECORD_MAGIC:
+            return None
+
+        grid = {}
+        if mask & 1:
+            grid = {"energy_forward": values[0], "energy_reverse": values[1]}
+        for index, phase in enumerate(self.phases):
+            if mask & (2 << index):
+                grid[phase] = {"energy_forward": values[2 + index * 2], "energy_reverse": values[3 + index * 2]}
+        return seq, timestamp, grid
@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import threading
+from time import time
+
+from energyjournal import EnergyJournal, write_atomic
+
+
+class EnergyStore:
+    """Write-behind persistence for the locally calculated energy counters.
+
+    The counters stay in memory and are authoritative, the store only reads them with the snapshot
+    function. A background thread writes the snapshot to the working file (volatile, e.g. RAM disk)
+    and to the storage file (persistent, e.g. SD card) in their own intervals, so the thread which
+    updates the counters never waits for the disk. Unchanged snapshots are not written again.
+
+    The persistent storage is an EnergyJournal: a small record is appended instead of rewriting
+    the file, which is crash-safe and reduces the wear of the SD card.
+    """
+
+    def __init__(self, snapshot, working_file, storage_file, working_interval=60, storage_interval=900):
+        self.snapshot = snapshot
+        self.working_file = working_file
+        self.storage_file = storage_file
+        self.working_interval = working_interval
+        self.storage_interval = storage_interval
+        self.journal = EnergyJournal(storage_file)
+
+        # get last modification timestamp
+        self.timestamp_storage_file = max(os.path.getmtime(path) if os.path.isfile(path) else 0 for path in (storage_file, self.journal.journal_file))
+        self._written = {working_file: None, storage_file: None}
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def load(self):
+        """Return the last saved data from the working file, else from the persistent storage, else {}."""
+        # always recover the journal, so new records are appended after the last valid one
+        data = self.journal.load()
+
+        if os.path.isfile(self.working_file):
+            try:
+                with open(self.working_file, "r") as file:
+                    data = json.load(file)
+                logging.info("Loaded JSON for energy forward/reverse once")
+                logging.debug(json.dumps(data))
+                return data
+            except (OSError, ValueError) as e:
+                logging.error("EnergyStore: Could not load %s: %s" % (self.working_file, e))
+
+        if data:
+            logging.info("Loaded JSON for energy forward/reverse once from persistent storage")
+            logging.debug(json.dumps(data))
+        return data
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="Thread-EnergyStore")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self, timeout=5):
+        """Stop the background thread and write the current snapshot to both files."""
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
+        self._thread = None
+        self.flush(persistent=True)
+
+    def flush(self, persistent=False):
+        """Write the current snapshot to the working file and, if persistent or due, to the storage file."""
+        with self._lock:
+            data = self.snapshot()
+            if self._written[self.working_file] != data:
+                write_atomic(self.working_file, json.dumps(data))
+                self._written[self.working_file] = data
+
+            timestamp = time()
+            if persistent or self.timestamp_storage_file + self.storage_interval < timestamp:
+                if self._written[self.storage_file] != data:
+                    self.journal.save(data)
+                    self._written[self.storage_file] = data
+                    logging.info("Written energy forward/reverse to persistent storage.")
+                self.timestamp_storage_file = timestamp
+
+            logging.debug("--> energy store: %s" % json.dumps(data))
+
+    def _run(self):
+        while not self._stop.wait(self.working_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logging.error("EnergyStore: Exception occurred while writing: %s" % repr(e))
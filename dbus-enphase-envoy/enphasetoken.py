@@ -2,36 +2,108 @@
 
 from time import time
 from datetime import datetime
+import base64
 import json
 # import requests
 import os
 import sys
 import logging
+import threading
 
 from authentication import Authentication
 
+# lifetime of a token without an exp claim
+TOKEN_LIFETIME_DEFAULT = 60 * 60 * 12
+# a token is renewed this share of its lifetime before it expires, but at least REFRESH_MARGIN_MIN seconds before
+REFRESH_SHARE = 0.1
+REFRESH_MARGIN_MIN = 60 * 5
+# a rejected token is only renewed if it is older than this seconds, e.g. a wrong serial number gets rejected tokens only
+REJECTED_RENEWAL_MIN = 60 * 5
+
+
+def decode_claims(token):
+    """Return the claims of the payload of a JWT without checking the signature, {} if it is no JWT."""
+    try:
+        payload = token.split(".")[1]
+        # base64url without padding
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+    except (IndexError, ValueError, TypeError, AttributeError):
+        return {}
+    return claims if isinstance(claims, dict) else {}
+
 
 class getToken:
-    def __init__(self, user, password, serial, force=False):
+    """The token of a D7 gateway.
+
+    The token stays in memory, the token file is only read on the first refresh() and written after
+    a renewal. The expiry is taken from the exp claim of the token, so tokens with another lifetime
+    than 12 hours are renewed in time too.
+    """
+
+    def __init__(self, user, password, serial, force=False, token_file="/data/etc/dbus-enphase-envoy/auth_token.json"):
         self.user = user
         self.password = password
         self.serial = serial
+        # request a new token on the next refresh()
         self.force = force
+        # every gateway has its own token
+        self.token_file = token_file
+        self.json_data = None
+        self._lock = threading.Lock()
 
-    def refresh(self):
-        token_file = "/data/etc/dbus-enphase-envoy/auth_token.json"
+    def load(self):
+        if os.path.isfile(self.token_file):
+            try:
+                with open(self.token_file, "r") as file:
+                    return json.load(file)
+            except (OSError, ValueError) as e:
+                logging.error(f"EnphaseToken: Could not load {self.token_file}: {e}")
+        return {"auth_token": "", "created": 0}
+
+    def expires(self, json_data):
+        """Return the expiry of the token from its exp claim, else 12 hours after its creation."""
+        claims = decode_claims(json_data["auth_token"])
+        if isinstance(claims.get("exp"), (int, float)):
+            return claims["exp"]
+        return json_data["created"] + TOKEN_LIFETIME_DEFAULT
+
+    def refresh_at(self, json_data):
+        """Return the time when the token is due for renewal."""
+        expires = self.expires(json_data)
+        claims = decode_claims(json_data["auth_token"])
+        issued = claims["iat"] if isinstance(claims.get("iat"), (int, float)) else json_data["created"]
+        return expires - max(REFRESH_MARGIN_MIN, REFRESH_SHARE * (expires - issued))
+
+    def refresh(self, rejected=None):
+        """Return the token, a new one if the token is due for renewal or it is rejected.
+
+        rejected: the token the gateway answered with 401, it is renewed unless another thread renewed it already
+        """
+        with self._lock:
+            return self._refresh(rejected)
+
+    def _refresh(self, rejected):
+        token_file = self.token_file
         # token_file = "./auth_token.json"
 
-        if os.path.isfile(token_file):
-            with open(token_file, "r") as file:
-                file = open(token_file, "r")
-                json_data = json.load(file)
-        else:
-            json_data = {"auth_token": "", "created": 0}
+        if self.json_data is None:
+            self.json_data = self.load()
+        json_data = self.json_data
+
+        # renewed in the meantime
+        if rejected is not None and rejected != json_data["auth_token"]:
+            return json_data
 
-        # request a new token, if the old one is older than 12 hours
-        if json_data["created"] + (60 * 60 * 12) - (60 * 5) < time():
-            logging.warning(f"EnphaseToken: Token expired. Creation date: {datetime.fromtimestamp(json_data['created'])} UTC")
+        if rejected is not None and json_data["created"] > time() - REJECTED_RENEWAL_MIN:
+            logging.error("EnphaseToken: New token rejected by the gateway. Check the serial number in the config.ini")
+            return json_data
+
+        # request a new token, if the old one is about to expire or was rejected by the gateway
+        if self.force or rejected is not None or self.refresh_at(json_data) < time():
+            if rejected is not None:
+                logging.warning("EnphaseToken: Token rejected by the gateway.")
+            else:
+                logging.warning(f"EnphaseToken: Token expired or about to expire. Expiry date: {datetime.fromtimestamp(self.expires(json_data))} UTC")
 
             try:
                 token = Authentication()
@@ -45,10 +117,13 @@ class getToken:
                     "created": int(time()),
                 }
 
+                self.json_data = json_data
+                self.force = False
+
                 with open(token_file, "w") as file:
                     file.write(json.dumps(json_data))
 
-                logging.warning(f"EnphaseToken: Token successfully requested. New creation date: {datetime.fromtimestamp(json_data['created'])} UTC")
+                logging.warning(f"EnphaseToken: Token successfully requested. New expiry date: {datetime.fromtimestamp(self.expires(json_data))} UTC")
 
                 return json_data
 
@@ -115,7 +190,7 @@ class getToken:
                 return False
 
         else:
-            logging.info(f"EnphaseToken: Token still valid. Creation date {datetime.fromtimestamp(json_data['created'])} UTC")
+            logging.info(f"EnphaseToken: Token still valid. Expiry date {datetime.fromtimestamp(self.expires(json_data))} UTC")
             return json_data
 
 
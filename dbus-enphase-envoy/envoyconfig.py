@@ -0,0 +1,296 @@
+#!/usr/bin/env python
+
+import configparser
+import logging
+import os
+import re
+
+from envoysession import normalize_fingerprint
+
+# paths of the Envoy which are requested, their URLs are built once per gateway
+ENDPOINTS = (
+    "/stream/meter",
+    "/production.json?details=1",
+    "/inventory.json",
+    "/api/v1/production/inverters",
+    "/datatab/event_dt.rb?start=0&length=10",
+    "/auth/check_jwt",
+)
+
+LOGGING_LEVELS = {"DEBUG": logging.DEBUG, "INFO": logging.INFO, "WARNING": logging.WARNING, "ERROR": logging.ERROR}
+
+# settings which are applied at runtime when the config file changed, the other ones need a restart
+RELOADABLE = (
+    "logging_level",
+    "fetch_devices_interval",
+    "fetch_devices_publishing_type",
+    "fetch_inverters_interval",
+    "fetch_inverters_publishing_type",
+    "fetch_events_interval",
+    "fetch_events_publishing_type",
+    "mqtt_publish_interval",
+    "mqtt_topic_meters",
+    "mqtt_topic_devices",
+    "mqtt_topic_inverters",
+    "mqtt_topic_events",
+)
+GATEWAY_RELOADABLE = ("fetch_production_historic_interval",)
+
+
+class ConfigError(Exception):
+    """The config.ini is missing or has an invalid setting."""
+
+
+class ConfigSection:
+    """Reads the options of one section of the config.ini, the [DEFAULT] section is included."""
+
+    def __init__(self, config, section):
+        self.name = section
+        self.options = config[section] if section in config else config["DEFAULT"]
+
+    def get(self, option, default=""):
+        return self.options[option] if option in self.options else default
+
+    def flag(self, option):
+        return self.get(option) == "1"
+
+    def number(self, option, default, minimum=None, cast=int):
+        """Return the option as number, default if it is not set or not above the minimum."""
+        value = self.get(option)
+        if value == "":
+            return default
+        try:
+            value = cast(value)
+        except ValueError:
+            raise ConfigError('The %s in the section [%s] of the "config.ini" is not a number' % (option, self.name))
+        return value if minimum is None or value > minimum else default
+
+
+class GatewayConfig:
+    """Settings of one Envoy from an [ENVOY] or [ENVOY:<name>] section.
+
+    The [ENVOY] section keeps the service name, device instance and files of a single Envoy installation,
+    the named sections get their own ones. Settings of the PV inverter fall back to the [PV] section.
+    """
+
+    def __init__(self, config, section, gateway_sections):
+        envoy = ConfigSection(config, section)
+        pv_defaults = ConfigSection(config, "PV")
+        self.section = section
+        self.name = section.split(":", 1)[1].strip() if ":" in section else ""
+
+        # the name is part of the D-Bus service name and of the file names
+        if ":" in section and re.fullmatch(r"[A-Za-z0-9_]+", self.name) is None:
+            raise ConfigError('The section [%s] in the "config.ini" needs a name with letters, digits and underscores only, e.g. [ENVOY:garage]' % section)
+
+        self.address = envoy.get("address")
+        if self.address in ("", "IP_ADDR_OR_FQDN"):
+            raise ConfigError('The "config.ini" is using invalid default values like IP_ADDR_OR_FQDN.')
+
+        self.firmware = "D7" if envoy.get("firmware") == "D7" else "D5"
+        self.password = ""
+        self.enlighten_user = ""
+        self.enlighten_password = ""
+        self.serial = ""
+        self.session_cookie = False
+
+        # D7.x.x firmware
+        if self.firmware == "D7":
+            self.request_auth = "token"
+            self.request_schema = "https"
+            missing = [key for key in ("enlighten_user", "enlighten_password", "serial") if envoy.get(key) == ""]
+            if missing:
+                raise ConfigError('This Envoy values are missing in the section [%s] of the "config.ini": %s' % (section, ", ".join(missing)))
+            self.enlighten_user = envoy.get("enlighten_user")
+            self.enlighten_password = envoy.get("enlighten_password")
+            self.serial = envoy.get("serial")
+            # validate the token once with /auth/check_jwt and send the session cookie instead of the token
+            self.session_cookie = envoy.flag("session_cookie")
+
+        # D5.x.x firmware
+        else:
+            self.request_auth = "digest"
+            self.request_schema = "http"
+            self.password = envoy.get("password")
+            if self.password == "":
+                raise ConfigError('This Envoy values are missing in the section [%s] of the "config.ini": password' % section)
+
+        self.fetch_production_historic_interval = envoy.number("fetch_production_historic_interval", 900, minimum=900)
+
+        # the [ENVOY] section keeps the device instance 61, the named sections follow the grid meter and AC load
+        if envoy.get("deviceinstance") != "":
+            self.deviceinstance = envoy.number("deviceinstance", 61)
+        else:
+            self.deviceinstance = 61 if self.name == "" else 64 + [item for item in gateway_sections if item != "ENVOY"].index(section)
+
+        # the PV settings of the section overwrite the ones of the [PV] section
+        pv = envoy if envoy.get("inverter_count") != "" else pv_defaults
+        if pv.get("inverter_count") != "" and pv.get("inverter_type") != "":
+            self.hardware = pv.get("inverter_count") + "x " + pv.get("inverter_type")
+            self.inverter_count = pv.number("inverter_count", None)
+        else:
+            self.hardware = "Microinverters"
+            self.inverter_count = None
+
+        self.max = envoy.number("max", None) if envoy.get("max") != "" else pv_defaults.number("max", 0)
+
+        # SHA-256 fingerprint of the certificate of the Envoy, new connections to other certificates are refused
+        self.certificate_fingerprint = normalize_fingerprint(envoy.get("certificate_fingerprint"))
+        if self.certificate_fingerprint != "" and re.fullmatch(r"[0-9a-f]{64}", self.certificate_fingerprint) is None:
+            raise ConfigError('The certificate_fingerprint in the section [%s] of the "config.ini" is not a SHA-256 fingerprint' % section)
+
+        # the URLs of the requested paths, only unknown paths are formatted per request
+        self.urls = {path: self.url(path) for path in ENDPOINTS}
+
+    def url(self, path):
+        return "%s://%s%s" % (self.request_schema, self.address, path)
+
+
+class DriverConfig:
+    """Settings of the driver, read once from the config.ini and validated.
+
+    reload() reads the file again and applies the settings of RELOADABLE and GATEWAY_RELOADABLE, the
+    running fetch tasks and services read them from this object. Changes of other settings are logged,
+    they need a restart of the driver.
+    """
+
+    def __init__(self, config_file):
+        self.config_file = config_file
+        if not os.path.exists(config_file):
+            raise ConfigError('The "' + config_file + '" is not found. Did you copy or rename the "config.sample.ini" to "config.ini"?')
+
+        # the modification time of the read file, to detect changes
+        self.mtime = os.stat(config_file).st_mtime
+        config = configparser.RawConfigParser()
+        try:
+            config.read(config_file)
+        except configparser.Error as e:
+            raise ConfigError('The "config.ini" can not be parsed: %s' % e)
+
+        # ERROR = shows errors only
+        # WARNING = shows ERROR and warnings
+        # INFO = shows WARNING and running functions
+        # DEBUG = shows INFO and data/values
+        self.logging_level = LOGGING_LEVELS.get(config["DEFAULT"].get("logging", "WARNING"), logging.WARNING)
+
+        # one gateway per [ENVOY] or [ENVOY:<name>] section
+        gateway_sections = [section for section in config.sections() if section == "ENVOY" or section.startswith("ENVOY:")]
+        if len(gateway_sections) == 0:
+            raise ConfigError('The "config.ini" contains no [ENVOY] section.')
+        self.gateways = [GatewayConfig(config, section, gateway_sections) for section in gateway_sections]
+
+        data = ConfigSection(config, "DATA")
+
+        # devices, minimum interval 60 seconds
+        self.fetch_devices_enabled = 1 if data.flag("fetch_devices") else 0
+        self.fetch_devices_interval = data.number("fetch_devices_interval", 60, minimum=60) if self.fetch_devices_enabled else 3600
+        self.fetch_devices_publishing_type = 0 if not self.fetch_devices_enabled or data.get("fetch_devices_publishing_type") == "0" else 1
+
+        # inverters, minimum interval 5 seconds, optionally aligned to the reports of the microinverters
+        self.fetch_inverters_enabled = 1 if data.flag("fetch_inverters") else 0
+        self.fetch_inverters_interval = data.number("fetch_inverters_interval", 5, minimum=5) if self.fetch_inverters_enabled else 300
+        self.fetch_inverters_align = 1 if self.fetch_inverters_enabled and data.flag("fetch_inverters_align") else 0
+        self.fetch_inverters_publishing_type = 0 if not self.fetch_inverters_enabled or data.get("fetch_inverters_publishing_type") == "0" else 1
+
+        # events, minimum interval 900 seconds
+        self.fetch_events_enabled = 1 if data.flag("fetch_events") else 0
+        self.fetch_events_interval = data.number("fetch_events_interval", 900, minimum=900) if self.fetch_events_enabled else 3600
+        self.fetch_events_publishing_type = 0 if not self.fetch_events_enabled or data.get("fetch_events_publishing_type") == "0" else 1
+
+        # threads = one thread per task
+        # asyncio = one asyncio event loop for the tasks of all gateways
+        self.fetch_engine = "asyncio" if data.get("engine") == "asyncio" else "threads"
+
+        # write-behind energy store
+        self.energy_working_interval = data.number("energy_working_interval", 60, minimum=9)
+        self.energy_storage_interval = data.number("energy_storage_interval", 900, minimum=299)
+
+        pv = ConfigSection(config, "PV")
+        self.pv_position = pv.number("position", 0)
+        self.pv_aggregate = 1 if pv.flag("aggregate") else 0
+        # 0 = every second
+        # 1 = on every new stream value, limited to dbus_update_max_rate updates per second
+        self.dbus_update_mode = 1 if pv.flag("dbus_update_mode") else 0
+        self.dbus_update_max_rate = pv.number("dbus_update_max_rate", 5, minimum=0, cast=float)
+
+        # grid meter from the net-consumption CT and AC load from the total-consumption CT, of the first gateway by default
+        grid = ConfigSection(config, "GRID")
+        self.grid_enabled = 1 if grid.flag("enabled") else 0
+        self.grid_deviceinstance = grid.number("deviceinstance", 62) if self.grid_enabled else 62
+        self.grid_gateway = grid.get("gateway") if self.grid_enabled else ""
+
+        acload = ConfigSection(config, "ACLOAD")
+        self.acload_enabled = 1 if acload.flag("enabled") else 0
+        self.acload_deviceinstance = acload.number("deviceinstance", 63) if self.acload_enabled else 63
+        self.acload_gateway = acload.get("gateway") if self.acload_enabled else ""
+
+        for option, gateway_name in (("[GRID] gateway", self.grid_gateway), ("[ACLOAD] gateway", self.acload_gateway)):
+            if gateway_name != "" and gateway_name not in [gateway.name for gateway in self.gateways]:
+                raise ConfigError('The %s "%s" in the "config.ini" has no [ENVOY:%s] section' % (option, gateway_name, gateway_name))
+
+        mqtt = ConfigSection(config, "MQTT")
+        self.mqtt_enabled = 1 if mqtt.flag("enabled") else 0
+        self.mqtt_broker_address = mqtt.get("broker_address")
+        self.mqtt_broker_port = mqtt.number("broker_port", 1883)
+        self.mqtt_tls_enabled = mqtt.flag("tls_enabled")
+        self.mqtt_tls_path_to_ca = mqtt.get("tls_path_to_ca")
+        self.mqtt_tls_insecure = mqtt.get("tls_insecure") != ""
+        self.mqtt_username = mqtt.get("username")
+        self.mqtt_password = mqtt.get("password")
+        # at least every second, else the load is too much
+        self.mqtt_publish_interval = max(1, mqtt.number("publish_interval", 5))
+        self.mqtt_topic_meters = mqtt.get("topic_meters", "enphase/envoy-s/meters")
+        self.mqtt_topic_devices = mqtt.get("topic_devices", "enphase/envoy-s/devices")
+        self.mqtt_topic_inverters = mqtt.get("topic_inverters", "enphase/envoy-s/inverters")
+        self.mqtt_topic_events = mqtt.get("topic_events", "enphase/envoy-s/events")
+
+    def gateway(self, name):
+        for gateway in self.gateways:
+            if gateway.name == name:
+                return gateway
+        return None
+
+    def changed(self):
+        """Return True if the config file was modified since it was read."""
+        try:
+            return os.stat(self.config_file).st_mtime != self.mtime
+        except OSError:
+            return False
+
+    def reload(self):
+        """Read the config file again and apply the settings which can change at runtime.
+
+        Returns the names of the applied settings, the ones of a gateway with its section. Raises ConfigError
+        if the file is invalid, the running settings are kept then.
+        """
+        # a file which can't be read is not read again until it changes
+        self.mtime = os.stat(self.config_file).st_mtime if os.path.exists(self.config_file) else self.mtime
+        new = DriverConfig(self.config_file)
+        applied = []
+        restart = []
+
+        for name, value in vars(new).items():
+            if name in ("config_file", "mtime", "gateways") or getattr(self, name) == value:
+                continue
+            if name in RELOADABLE:
+                setattr(self, name, value)
+                applied.append(name)
+            else:
+                restart.append(name)
+
+        if [gateway.section for gateway in new.gateways] != [gateway.section for gateway in self.gateways]:
+            restart.append("[ENVOY] sections")
+        else:
+            for gateway, new_gateway in zip(self.gateways, new.gateways):
+                for name, value in vars(new_gateway).items():
+                    if getattr(gateway, name) == value:
+                        continue
+                    if name in GATEWAY_RELOADABLE:
+                        setattr(gateway, name, value)
+                        applied.append("[%s] %s" % (gateway.section, name))
+                    elif name != "urls":
+                        restart.append("[%s] %s" % (gateway.section, name))
+
+        if restart:
+            logging.warning("DriverConfig: Changed settings which need a restart of the driver: %s" % ", ".join(restart))
+        return applied
@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import hashlib
+import hmac
+import logging
+import ssl
+import threading
+import weakref
+from http.cookiejar import DefaultCookiePolicy
+from time import perf_counter
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+
+# timings of the current request of the thread, summed over the requests of a digest authentication
+_timing = threading.local()
+
+
+class TimedConnectionMixin:
+    def connect(self):
+        # includes the TLS handshake
+        time_start = perf_counter()
+        super().connect()
+        _timing.connect = (_timing.connect or 0) + perf_counter() - time_start
+        _timing.resumed = _timing.resumed or getattr(self.sock, "session_reused", False)
+
+    def getresponse(self):
+        # the request is sent, wait for the response header
+        time_start = perf_counter()
+        response = super().getresponse()
+        _timing.ttfb += perf_counter() - time_start
+        return response
+
+
+class TimedHTTPConnection(TimedConnectionMixin, HTTPConnection):
+    pass
+
+
+class TimedHTTPSConnection(TimedConnectionMixin, HTTPSConnection):
+    pass
+
+
+class TimedHTTPConnectionPool(HTTPConnectionPool):
+    ConnectionCls = TimedHTTPConnection
+
+
+class TimedHTTPSConnectionPool(HTTPSConnectionPool):
+    ConnectionCls = TimedHTTPSConnection
+
+
+class ResumingSSLContext(ssl.SSLContext):
+    """SSL context which offers the TLS session of the previous connection, so a new connection needs no full handshake.
+
+    The session is taken from the previous socket when the next one is opened, so session tickets
+    which TLS 1.3 sends after the handshake are included.
+    """
+
+    def __init__(self, protocol=ssl.PROTOCOL_TLS_CLIENT):
+        super().__init__()
+        self.reset()
+
+    def reset(self):
+        """Forget the TLS session, the next connection makes a full handshake."""
+        self._last_socket = None
+        self._last_session = None
+
+    def wrap_socket(self, sock, *args, **kwargs):
+        last_socket = self._last_socket() if self._last_socket is not None else None
+        if last_socket is not None and last_socket.session is not None:
+            self._last_session = last_socket.session
+        if self._last_session is not None and "session" not in kwargs:
+            kwargs["session"] = self._last_session
+
+        ssl_socket = super().wrap_socket(sock, *args, **kwargs)
+        self._last_socket = weakref.ref(ssl_socket)
+        return ssl_socket
+
+
+class EnvoyHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter with timed connections, TLS session resumption and optional certificate pinning."""
+
+    def __init__(self, fingerprint=None, **kwargs):
+        self.fingerprint = fingerprint
+
+        # the Envoy uses a self-signed certificate, it is either pinned or not verified (like verify=False)
+        self.ssl_context = ResumingSSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.ssl_context.check_hostname = False
+        self.ssl_context.verify_mode = ssl.CERT_NONE
+
+        super().__init__(**kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs["ssl_context"] = self.ssl_context
+        if self.fingerprint:
+            # SHA-256 of the DER certificate, checked on every new connection
+            pool_kwargs["assert_fingerprint"] = self.fingerprint
+        super().init_poolmanager(connections, maxsize, block, **pool_kwargs)
+        self.poolmanager.pool_classes_by_scheme = {"http": TimedHTTPConnectionPool, "https": TimedHTTPSConnectionPool}
+
+
+def normalize_fingerprint(fingerprint):
+    """Return a SHA-256 fingerprint as lower case hex digits, the config allows colons and upper case."""
+    return fingerprint.replace(":", "").strip().lower()
+
+
+def check_fingerprint(certificate, fingerprint):
+    """Raise ssl.SSLError if the SHA-256 of the DER certificate does not match the fingerprint, like assert_fingerprint of urllib3."""
+    expected = normalize_fingerprint(fingerprint)
+    digest = hashlib.sha256(certificate or b"").hexdigest()
+    if not hmac.compare_digest(digest, expected):
+        raise ssl.SSLError(f'Fingerprints did not match. Expected "{expected}", got "{digest}"')
+
+
+def set_read_timeout(response, timeout):
+    """Change the read timeout of a streamed response for its next reads."""
+    sock = getattr(getattr(response.raw, "connection", None), "sock", None)
+    if sock is not None:
+        sock.settimeout(timeout)
+
+
+class EnvoySession:
+    """Pooled HTTP(S) connections to one Envoy with keep-alive and per request timings.
+
+    The polled requests reuse the kept-alive connections, new connections resume the TLS session of
+    the previous one. Every response gets a timings dict:
+    connect: seconds for TCP connect and TLS handshake, None if a pooled connection was reused
+    ttfb: seconds from sending the request until the response header was received (both requests of a digest authentication)
+    resumed: True if the TLS session of a previous connection was resumed
+
+    get_changed() skips responses which did not change since the last request of the same URL.
+    """
+
+    def __init__(self, fingerprint=None, pool_maxsize=4):
+        self.session = requests.Session()
+        adapter = EnvoyHTTPAdapter(fingerprint=fingerprint, pool_connections=1, pool_maxsize=pool_maxsize)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # the credentials are set per request, cookies like the session of /auth/check_jwt are not stored and sent along
+        self.session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "resumed": 0, "connect": 0.0, "ttfb": 0.0, "unchanged": 0}
+        # validators of the last 200 response per URL: ETag, Last-Modified and BLAKE2b hash of the body
+        self._validators = {}
+
+    def get(self, url, **kwargs):
+        _timing.connect = None
+        _timing.resumed = False
+        _timing.ttfb = 0.0
+
+        # the Envoy uses a self-signed certificate, verify is set per request, else REQUESTS_CA_BUNDLE would overwrite it
+        kwargs.setdefault("verify", False)
+        response = self.session.get(url, **kwargs)
+
+        connect = _timing.connect
+        ttfb = _timing.ttfb
+        response.timings = {"connect": connect, "ttfb": ttfb, "resumed": _timing.resumed}
+
+        with self._lock:
+            self.stats["requests"] += 1
+            self.stats["ttfb"] += ttfb
+            if connect is not None:
+                self.stats["connections"] += 1
+                self.stats["connect"] += connect
+                if _timing.resumed:
+                    self.stats["resumed"] += 1
+
+        logging.debug(
+            "EnvoySession: GET %s: %d, connect %s, ttfb %.3f s"
+            % (
+                response.request.path_url,
+                response.status_code,
+                "%.3f s%s" % (connect, " (TLS resumed)" if _timing.resumed else "") if connect is not None else "reused",
+                ttfb,
+            )
+        )
+        return response
+
+    def get_changed(self, url, **kwargs):
+        """Like get(), but return None if the response did not change since the last 200 response of the URL.
+
+        Sends If-None-Match and If-Modified-Since if the Envoy sent an ETag or Last-Modified header
+        (304 Not Modified), else compares a hash of the body. Responses with another status are
+        returned, so the caller handles them like before.
+        """
+        with self._lock:
+            validators = self._validators.get(url)
+
+        headers = dict(kwargs.pop("headers", None) or {})
+        if validators is not None:
+            if validators["etag"]:
+                headers["If-None-Match"] = validators["etag"]
+            if validators["last_modified"]:
+                headers["If-Modified-Since"] = validators["last_modified"]
+
+        response = self.get(url, headers=headers, **kwargs)
+
+        if response.status_code == 304 and validators is not None:
+            changed = False
+        elif response.status_code == 200:
+            body_hash = hashlib.blake2b(response.content, digest_size=16).digest()
+            changed = validators is None or body_hash != validators["hash"]
+            with self._lock:
+                self._validators[url] = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified"), "hash": body_hash}
+        else:
+            return response
+
+        if changed:
+            return response
+
+        with self._lock:
+            self.stats["unchanged"] += 1
+        logging.debug("EnvoySession: GET %s: unchanged (%d)" % (response.request.path_url, response.status_code))
+        return None
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python
+
+# fields of a phase and of the total of a meter in the order they are published
+PHASE_FIELDS = (
+    "power",
+    "current",
+    "voltage",
+    "power_react",
+    "power_appearent",
+    "power_factor",
+    "frequency",
+    "whToday",
+    "vahToday",
+    "whLifetime",
+    "vahLifetime",
+    "energy_forward",
+    "energy_reverse",
+)
+METER_FIELDS = (
+    "power",
+    "current",
+    "voltage",
+    "power_react",
+    "power_appearent",
+    "whToday",
+    "vahToday",
+    "whLifetime",
+    "vahLifetime",
+    "energy_forward",
+    "energy_reverse",
+)
+
+
+class PhaseSample:
+    """Values of one phase of a meter, filled once per row."""
+
+    __slots__ = PHASE_FIELDS + ("with_reverse",)
+
+    def __init__(self, with_reverse=False):
+        for field in PHASE_FIELDS:
+            setattr(self, field, 0)
+        self.with_reverse = with_reverse
+
+    def __getitem__(self, key):
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        return key in PHASE_FIELDS and (key != "energy_reverse" or self.with_reverse)
+
+    def update(self, values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        data = {
+            "power": self.power,
+            "current": self.current,
+            "voltage": self.voltage,
+            "power_react": self.power_react,
+            "power_appearent": self.power_appearent,
+            "power_factor": self.power_factor,
+            "frequency": self.frequency,
+            "whToday": self.whToday,
+            "vahToday": self.vahToday,
+            "whLifetime": self.whLifetime,
+            "vahLifetime": self.vahLifetime,
+            "energy_forward": self.energy_forward,
+        }
+        if self.with_reverse:
+            data["energy_reverse"] = self.energy_reverse
+        return data
+
+
+class MeterSample:
+    """Values of one meter (pv, grid or consumption) for a fixed phase layout.
+
+    A phase is only part of the sample while it is active (voltage above 0 in the last row).
+    The item access mirrors the previous dict structure, e.g. sample["L1"]["power"].
+    index: phase name -> index in layout, shared by the samples of a schema
+    """
+
+    __slots__ = METER_FIELDS + ("name", "layout", "phases", "active", "with_reverse", "_index")
+
+    def __init__(self, name, layout, with_reverse=False, index=None):
+        for field in METER_FIELDS:
+            setattr(self, field, 0)
+        self.name = name
+        self.layout = tuple(layout)
+        self.phases = tuple(PhaseSample(with_reverse) for _ in self.layout)
+        self.active = [False] * len(self.layout)
+        self.with_reverse = with_reverse
+        self._index = index if index is not None else {phase_name: index for index, phase_name in enumerate(self.layout)}
+
+    def phase(self, phase_name):
+        """Return the PhaseSample of an active phase or None."""
+        index = self._index.get(phase_name)
+        return self.phases[index] if index is not None and self.active[index] else None
+
+    def __getitem__(self, key):
+        index = self._index.get(key)
+        if index is not None:
+            if self.active[index]:
+                return self.phases[index]
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        index = self._index.get(key)
+        if index is not None:
+            return self.active[index]
+        return key in METER_FIELDS and (key != "energy_reverse" or self.with_reverse)
+
+    def update(self, values):
+        for key, value in values.items():
+            setattr(self, key, value)
+
+    def to_dict(self):
+        data = {}
+        for phase_name, phase_sample, active in zip(self.layout, self.phases, self.active):
+            if active:
+                data[phase_name] = phase_sample.to_dict()
+
+        data["power"] = self.power
+        data["current"] = self.current
+        data["voltage"] = self.voltage
+        data["power_react"] = self.power_react
+        data["power_appearent"] = self.power_appearent
+        data["whToday"] = self.whToday
+        data["vahToday"] = self.vahToday
+        data["whLifetime"] = self.whLifetime
+        data["vahLifetime"] = self.vahLifetime
+        data["energy_forward"] = self.energy_forward
+        if self.with_reverse:
+            data["energy_reverse"] = self.energy_reverse
+        return data
+
+
+class StreamSample:
+    """All meters of one "/stream/meter" row.
+
+    A new sample is decoded for every row and not changed after it is published, so other threads
+    read the values of a single row without a lock.
+    """
+
+    __slots__ = ("meters", "_by_name")
+
+    def __init__(self, meters):
+        self.meters = tuple(meters)
+        self._by_name = {meter.name: meter for meter in self.meters}
+
+    def __getitem__(self, key):
+        return self._by_name[key]
+
+    def __contains__(self, key):
+        return key in self._by_name
+
+    def get(self, key, default=None):
+        return self._by_name.get(key, default)
+
+    def to_dict(self):
+        return {meter.name: meter.to_dict() for meter in self.meters}
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+from functools import reduce
+
+from metersample import MeterSample, StreamSample
+
+# keys of the meters and phases in the "/stream/meter" rows of the Envoy-S
+STREAM_METERS = ("production", "net-consumption", "total-consumption")
+STREAM_PHASES = ("ph-a", "ph-b", "ph-c")
+
+
+class ReplacementTable(dict):
+    """Maps raw Envoy-S names to the names used by the driver.
+
+    Each name is computed only once from the replacement pairs and then looked up.
+    """
+
+    def __init__(self, replacements):
+        super().__init__()
+        self.replacements = tuple(replacements)
+
+    def __missing__(self, key):
+        value = reduce(lambda a, kv: a.replace(*kv), self.replacements, key)
+        self[key] = value
+        return value
+
+
+class MeterSchema:
+    """Precompiled decoding schema for the "/stream/meter" rows.
+
+    Built once for the detected phase layout. Maps the raw meter and phase keys of the Envoy-S
+    to the fields of a StreamSample, so a row is decoded in a single pass without renaming keys
+    or building dicts per row. Every row gets its own sample, a published sample is not changed
+    anymore and can be read by other threads without a lock.
+    """
+
+    def __init__(self, meter_names, phase_names, phases):
+        self.phases = tuple(phase for phase in STREAM_PHASES if phase in phases)
+        self.layout = tuple(phase_names[phase] for phase in self.phases)
+        self.other_phases = tuple(phase for phase in STREAM_PHASES if phase not in phases)
+        self.meter_names = tuple(meter_names[meter] for meter in STREAM_METERS)
+
+        # phase name -> index, shared by the samples of all rows
+        self.index = {phase_name: index for index, phase_name in enumerate(self.layout)}
+
+        # (raw meter, meter name, with reverse energy, ((raw phase, phase name, index), ...))
+        self.meters = tuple(
+            (
+                meter,
+                meter_name,
+                meter_name == "grid",
+                tuple((phase, phase_name, index) for index, (phase, phase_name) in enumerate(zip(self.phases, self.layout))),
+            )
+            for meter, meter_name in zip(STREAM_METERS, self.meter_names)
+        )
+
+    @classmethod
+    def detect(cls, data, meter_names, phase_names):
+        """Create the schema for the phases which have a voltage on at least one meter."""
+        phases = [phase for phase in STREAM_PHASES if any(data[meter][phase]["v"] > 0 for meter in STREAM_METERS)]
+        return cls(meter_names, phase_names, phases)
+
+    def matches(self, data):
+        """Check if the phase layout of the row is still covered by this schema."""
+        for phase in self.other_phases:
+            for meter in STREAM_METERS:
+                if data[meter][phase]["v"] > 0:
+                    return False
+        return True
+
+    def decode(self, data, historic):
+        """Decode one row into a new StreamSample and return it.
+
+        historic: the data of fetch_production_historic()
+        Phases without lifetime counters in historic are not part of the sample.
+        The grid energy is calculated locally and not touched here.
+        """
+        meters = []
+
+        for meter, meter_name, is_grid, phases in self.meters:
+            meter_sample = MeterSample(meter_name, self.layout, with_reverse=is_grid, index=self.index)
+            meters.append(meter_sample)
+            meter_data = data[meter]
+            meter_historic = historic[meter_name]
+            is_pv = meter_name == "pv"
+            active = meter_sample.active
+            phase_samples = meter_sample.phases
+
+            total_power = 0
+            total_current = 0
+            total_voltage = 0
+            total_power_react = 0
+            total_power_appearent = 0
+
+            for phase, phase_name, index in phases:
+                values = meter_data[phase]
+
+                if values["v"] > 0:
+                    power = float(values["p"])
+                    current = float(values["i"])
+                    voltage = float(values["v"])
+                    power_react = float(values["q"])
+                    power_appearent = float(values["s"])
+
+                    total_power += power
+                    total_current += current
+                    total_voltage += voltage
+                    total_power_react += power_react
+                    total_power_appearent += power_appearent
+
+                    # if PV power is below 5 W, than show 0 W. This prevents showing 1-2 W on PV when no sun is shining
+                    if is_pv and values["p"] < 5:
+                        power = 0.0
+                        current = 0.0
+
+                    # a cached production.json of another phase layout, the phase is shown with the next fetch
+                    phase_historic = meter_historic.get(phase_name)
+                    if phase_historic is None:
+                        continue
+
+                    phase_sample = phase_samples[index]
+                    phase_sample.power = power
+                    phase_sample.current = current
+                    phase_sample.voltage = voltage
+                    phase_sample.power_react = power_react
+                    phase_sample.power_appearent = power_appearent
+                    phase_sample.power_factor = float(values["pf"])
+                    phase_sample.frequency = float(values["f"])
+                    phase_sample.whToday = phase_historic["whToday"]
+                    phase_sample.vahToday = phase_historic["vahToday"]
+                    phase_sample.whLifetime = phase_historic["whLifetime"]
+                    phase_sample.vahLifetime = phase_historic["vahLifetime"]
+
+                    if not is_grid:
+                        phase_sample.energy_forward = float(round(phase_historic["whLifetime"] / 1000, 3))
+
+                    active[index] = True
+
+            # if PV power is below 5 W, than show 0 W. This prevents showing 1-2 W on PV when no sun is shining
+            if is_pv and total_power < 5:
+                total_power = 0
+                total_current = 0
+
+            meter_sample.power = total_power
+            meter_sample.current = total_current
+            meter_sample.voltage = total_voltage
+            meter_sample.power_react = total_power_react
+            meter_sample.power_appearent = total_power_appearent
+            meter_sample.whToday = meter_historic["whToday"]
+            meter_sample.vahToday = meter_historic["vahToday"]
+            meter_sample.whLifetime = meter_historic["whLifetime"]
+            meter_sample.vahLifetime = meter_historic["vahLifetime"]
+
+            if not is_grid:
+                meter_sample.energy_forward = round(meter_historic["whLifetime"] / 1000, 3)
+
+        return StreamSample(meters)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python
+
+import threading
+
+PHASES = ("L1", "L2", "L3")
+
+
+class PhaseLayout:
+    """Phases of the meters of a gateway, which get D-Bus paths.
+
+    The phases are collected from the cached state of the last run, the lines of production.json
+    and the rows of the stream. A phase is only added, never removed, so its paths stay when its
+    voltage drops to 0 for a while (e.g. at night). Every added phase increases the version, the
+    D-Bus services compare it to add the paths of new phases at runtime.
+    """
+
+    def __init__(self, layout=None):
+        self._lock = threading.Lock()
+        self.layout = {}
+        self.version = 0
+        if layout:
+            self.update(layout)
+            # the cached layout is the start, not a change
+            self.version = 0
+
+    def phases(self, meter_name):
+        return self.layout.get(meter_name, ())
+
+    def update(self, layout):
+        """Add the phases of {meter_name: phases}, return True if a phase was added."""
+        with self._lock:
+            updated = dict(self.layout)
+            for meter_name, phases in layout.items():
+                known = updated.get(meter_name, ())
+                if not set(phases).issubset(known):
+                    updated[meter_name] = tuple(phase_name for phase_name in PHASES if phase_name in known or phase_name in phases)
+
+            if updated == self.layout:
+                return False
+
+            # replaced as a whole, readers never lock
+            self.layout = updated
+            self.version += 1
+            return True
+
+    def changed_since(self, version):
+        return self.version > version
+
+    def to_dict(self):
+        return {meter_name: list(phases) for meter_name, phases in self.layout.items()}
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+from collections import deque
+from statistics import median
+
+# seconds after the expected reports until the poll, the Envoy needs some time to process them
+REPORT_MARGIN = 10
+# reports of a fleet spread over more seconds are not aligned to
+REPORT_WINDOW_MAX = 60
+# share of the report intervals which have to be within REPORT_TOLERANCE of the period
+REPORT_REGULAR_SHARE = 0.8
+REPORT_TOLERANCE = 0.1
+# report intervals needed before the polls are aligned
+REPORT_SAMPLES_MIN = 3
+# polls after a late report, before the next period is waited for
+REPORT_RETRIES = 3
+
+
+class ReportSchedule:
+    """Learns when the microinverters of an Envoy report from their lastReportDate and returns the
+    seconds until the next poll of /api/v1/production/inverters.
+
+    The microinverters report about every 300 seconds, usually all within a short window. The period
+    is the median of the intervals between two reports of the same inverter, the window is the
+    shortest arc of the circle of one period which contains the report phases of all inverters.
+    The next poll is REPORT_MARGIN seconds after the expected end of the next window. If the reports
+    are irregular, spread over more than REPORT_WINDOW_MAX seconds or not yet known, the fixed
+    fallback interval is returned.
+    """
+
+    def __init__(self, fallback_interval):
+        self.fallback_interval = fallback_interval
+        self.last_reports = {}
+        self.intervals = deque(maxlen=100)
+        self.period = None
+        self.window = None
+        self.expected = None
+        self.retries = 0
+
+    def update(self, reports, now):
+        """Learn from the lastReportDate per serial number and return the seconds until the next poll.
+
+        reports: the lastReportDate per serial number, an empty dict if the response did not change
+        """
+        for serial, report in reports.items():
+            last = self.last_reports.get(serial)
+            if last is not None and report > last:
+                self.intervals.append(report - last)
+            self.last_reports[serial] = report
+
+        self.period = self._period()
+        if self.period is None:
+            self.expected = None
+            return self.fallback_interval
+
+        # inverters which reported in the last two periods
+        recent = [report for report in self.last_reports.values() if report > now - 2 * self.period]
+        if not recent:
+            self.expected = None
+            return self.fallback_interval
+
+        window_end, self.window = self._window(recent)
+        if self.window > REPORT_WINDOW_MAX:
+            self.expected = None
+            return self.fallback_interval
+
+        # the reports of the expected window are late, e.g. after a communication problem
+        if self.expected is not None and max(recent) < self.expected - self.window - REPORT_TOLERANCE * self.period and self.retries < REPORT_RETRIES:
+            self.retries += 1
+            return REPORT_MARGIN
+        self.retries = 0
+
+        # the next end of the window, which is not yet polled
+        base = now - REPORT_MARGIN
+        self.expected = base + (window_end - base) % self.period
+        if self.expected <= base:
+            self.expected += self.period
+
+        return max(1, self.expected + REPORT_MARGIN - now)
+
+    def _period(self):
+        if len(self.intervals) < REPORT_SAMPLES_MIN:
+            return None
+        period = median(self.intervals)
+        regular = sum(1 for interval in self.intervals if abs(interval - period) <= REPORT_TOLERANCE * period)
+        return period if regular >= REPORT_REGULAR_SHARE * len(self.intervals) else None
+
+    def _window(self, reports):
+        """Return the phase of the window end and the length of the window."""
+        phases = sorted(report % self.period for report in reports)
+        gaps = [(phases[(index + 1) % len(phases)] - phases[index]) % self.period for index in range(len(phases))]
+        largest = max(range(len(gaps)), key=gaps.__getitem__)
+        if gaps[largest] == 0:
+            return phases[0], 0
+        # the window ends before the largest gap between two report phases
+        return phases[largest], self.period - gaps[largest]
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+
+import heapq
+import itertools
+import logging
+import random
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
+
+# failed runs are repeated after BACKOFF_MIN seconds, doubled after every further failure
+BACKOFF_MIN = 5
+# up to the larger of the interval and BACKOFF_MAX seconds
+BACKOFF_MAX = 300
+
+
+def next_delay(interval, failures, jitter=0.1):
+    """Return the seconds until the next run of a job with jitter, backed off after failures."""
+    if failures > 0:
+        delay = min(max(interval, BACKOFF_MAX), BACKOFF_MIN * 2 ** (failures - 1))
+    else:
+        delay = interval
+    # spread the requests of several endpoints and gateways
+    return delay * random.uniform(1 - jitter, 1 + jitter)
+
+
+def is_delay(result):
+    """Return True if a job returned the seconds until its next run."""
+    return isinstance(result, (int, float)) and not isinstance(result, bool)
+
+
+class Job:
+    def __init__(self, name, interval, function, args):
+        self.name = name
+        self.interval = interval
+        self.function = function
+        self.args = args
+        self.deadline = None
+        self.running = False
+        # deadline set by trigger() during a run
+        self.triggered = None
+        self.failures = 0
+        # start of the last run
+        self.started = None
+
+
+class Scheduler:
+    """Runs periodic jobs at their deadlines, each job in its own worker.
+
+    One thread sleeps until the next deadline of a priority queue and hands the due jobs to a thread
+    pool with one worker per job, so a slow job never delays another one and a job never runs twice
+    at the same time. A job fails if it raises an exception or returns False, it is repeated with
+    an exponential backoff. A job can return the seconds until its next run instead of its interval.
+    A job which raises SystemExit stops the scheduler.
+    """
+
+    def __init__(self, jitter=0.1):
+        self.jitter = jitter
+        self.jobs = {}
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._executor = None
+        self._thread = None
+        self._stopped = False
+
+    def add(self, name, interval, function, *args, delay=0):
+        """Add a job which calls function(*args) every interval seconds, the first time after delay seconds."""
+        job = Job(name, interval, function, args)
+        with self._condition:
+            self.jobs[name] = job
+            self._schedule(job, monotonic() + delay)
+        return job
+
+    def trigger(self, name, delay=0):
+        """Run the job in delay seconds instead of at its deadline, right after the current run if it is running."""
+        with self._condition:
+            job = self.jobs[name]
+            if job.running:
+                job.triggered = monotonic() + delay
+            else:
+                self._schedule(job, monotonic() + delay)
+
+    def set_interval(self, name, interval):
+        """Change the interval of a job, a waiting job runs the new interval after its last start."""
+        with self._condition:
+            job = self.jobs[name]
+            job.interval = interval
+            # a running job and the backoff of a failed job use the new interval from their next deadline
+            if not job.running and job.failures == 0 and job.started is not None:
+                self._schedule(job, max(job.started + interval, monotonic()))
+
+    def start(self):
+        self._executor = ThreadPoolExecutor(max_workers=max(1, len(self.jobs)), thread_name_prefix="Thread-Scheduler")
+        self._thread = threading.Thread(target=self._run, name="Thread-Scheduler")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        with self._condition:
+            self._stopped = True
+            self._condition.notify()
+
+    def _schedule(self, job, deadline):
+        # earlier entries of the job stay in the queue and are skipped, because their deadline is outdated
+        job.deadline = deadline
+        heapq.heappush(self._queue, (deadline, next(self._sequence), job))
+        self._condition.notify()
+
+    def _run(self):
+        with self._condition:
+            while not self._stopped:
+                if not self._queue:
+                    self._condition.wait()
+                    continue
+
+                deadline, _, job = self._queue[0]
+                timeout = deadline - monotonic()
+                if timeout > 0:
+                    # sleeps until the next deadline, add() and trigger() wake it up earlier
+                    self._condition.wait(timeout)
+                    continue
+
+                heapq.heappop(self._queue)
+                if deadline != job.deadline or job.running:
+                    continue
+
+                job.running = True
+                self._executor.submit(self._execute, job)
+
+        self._executor.shutdown(wait=False)
+
+    def _execute(self, job):
+        time_start = job.started = monotonic()
+        result = None
+        failed = False
+        try:
+            result = job.function(*job.args)
+            failed = result is False
+        except SystemExit:
+            logging.info("--> Scheduler: %s stopped the driver" % job.name)
+            self.stop()
+            return
+        except Exception:
+            exception_type, exception_object, exception_traceback = sys.exc_info()
+            file = exception_traceback.tb_frame.f_code.co_filename
+            line = exception_traceback.tb_lineno
+            logging.error(f"--> Scheduler: {job.name}: Exception occurred: {repr(exception_object)} of type {exception_type} in {file} line #{line}")
+            failed = True
+
+        with self._condition:
+            job.running = False
+            job.failures = job.failures + 1 if failed else 0
+            if is_delay(result):
+                delay = result
+            else:
+                delay = next_delay(job.interval, job.failures, self.jitter)
+
+            if job.triggered is not None:
+                deadline = job.triggered
+                job.triggered = None
+            else:
+                # fixed rate while the job succeeds, the backoff starts after a failed run
+                deadline = (monotonic() if failed else time_start) + delay
+            deadline = max(deadline, monotonic())
+
+            if failed:
+                logging.error(f"--> Scheduler: {job.name} failed {job.failures} time(s). Try again in {round(deadline - monotonic())} seconds")
+            else:
+                logging.info(f"--> Scheduler: {job.name}: done. Wait {round(deadline - monotonic())} seconds for next run")
+
+            self._schedule(job, deadline)
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+import threading
+from collections import namedtuple
+from time import time
+
+# data is published as a whole, version increases with every publication
+Snapshot = namedtuple("Snapshot", ("version", "timestamp", "data"))
+
+
+class SnapshotStore:
+    """Versioned publication of the data of a fetch thread to the consumers.
+
+    The producer replaces the snapshot with a single assignment, so readers never lock and always
+    see a version, timestamp and data which belong together. This requires a new data object for
+    every publication, published data is never changed in place. Consumers remember the version
+    they processed and check changed_since(version) in O(1) instead of comparing the data, or block
+    in wait() until a newer version is published. Callbacks registered with subscribe() are called
+    in the publishing thread for every new version.
+    """
+
+    def __init__(self, data=None):
+        self._snapshot = Snapshot(0, 0, data if data is not None else {})
+        self._condition = threading.Condition()
+        self._subscribers = []
+
+    def __bool__(self):
+        return self._snapshot.version > 0
+
+    @property
+    def snapshot(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version
+
+    @property
+    def timestamp(self):
+        return self._snapshot.timestamp
+
+    @property
+    def data(self):
+        return self._snapshot.data
+
+    def publish(self, data, only_changed=False):
+        """Publish new data and return the version.
+
+        only_changed: keep the version if the data is equal to the published data, only the timestamp
+        is refreshed. Compares once per publication instead of once per consumer and check.
+        """
+        with self._condition:
+            snapshot = self._snapshot
+            if only_changed and snapshot.version > 0 and snapshot.data == data:
+                self._snapshot = Snapshot(snapshot.version, time(), snapshot.data)
+                return snapshot.version
+
+            snapshot = self._snapshot = Snapshot(snapshot.version + 1, time(), data)
+            self._condition.notify_all()
+
+        for callback in self._subscribers:
+            callback(snapshot)
+        return snapshot.version
+
+    def subscribe(self, callback):
+        """Call callback(snapshot) after every new version. It runs in the publishing thread and must not block."""
+        self._subscribers.append(callback)
+
+    def changed_since(self, version):
+        return self._snapshot.version > version
+
+    def wait(self, version=0, timeout=None):
+        """Block until a version newer than version is published or the timeout passed.
+
+        Returns the current snapshot, check its version to see if the wait timed out.
+        """
+        snapshot = self._snapshot
+        if snapshot.version > version:
+            return snapshot
+        with self._condition:
+            self._condition.wait_for(lambda: self._snapshot.version > version, timeout)
+            return self._snapshot
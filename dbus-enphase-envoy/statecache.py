@@ -0,0 +1,60 @@
+#!/usr/bin/env python
+
+import json
+import logging
+import os
+import threading
+from time import time
+
+from energyjournal import write_atomic
+
+# version of the file format, files of other versions are ignored
+STATE_VERSION = 1
+
+
+class StateCache:
+    """Last known state of a gateway, persisted to start the D-Bus services before the Envoy answers.
+
+    Keeps the phase layout of the meters, the lifetime counters of production.json, the energy
+    counters of the last stream row and the inverter counts. After a restart the services are
+    registered with these values right away and marked as disconnected until the first row of the
+    stream arrives. The file is only written if the state changed. save() is called by the stream,
+    the fetch tasks and the signal handler, the saves are serialized.
+    """
+
+    def __init__(self, state_file):
+        self.state_file = state_file
+        self._written = None
+        # the saves share the temporary file of write_atomic()
+        self._lock = threading.Lock()
+
+    def load(self):
+        """Return the saved state, {} if there is none or it can't be read."""
+        if not os.path.isfile(self.state_file):
+            return {}
+
+        try:
+            with open(self.state_file, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logging.error("StateCache: Could not load %s: %s" % (self.state_file, e))
+            return {}
+
+        if not isinstance(data, dict) or data.get("version") != STATE_VERSION:
+            logging.warning("StateCache: Ignoring %s of an other version" % self.state_file)
+            return {}
+
+        logging.info("StateCache: Loaded the state from %s, saved %i seconds ago" % (self.state_file, time() - data["timestamp"]))
+        self._written = data["state"]
+        return data["state"]
+
+    def save(self, state):
+        """Write the state if it changed since the last save."""
+        with self._lock:
+            if not state or state == self._written:
+                return False
+
+            write_atomic(self.state_file, json.dumps({"version": STATE_VERSION, "timestamp": time(), "state": state}))
+            self._written = state
+        logging.debug("--> state cache: %s" % json.dumps(state))
+        return True
@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+import json
+
+# bytes requested per read from the stream. For chunked responses (like the Envoy-S sends them)
+# a read returns as soon as a chunk arrived, so this does not delay the rows
+STREAM_CHUNK_SIZE = 2048
+
+
+class MeterStreamDecoder:
+    """Incremental decoder for the "data: " frames of the Envoy-S "/stream/meter" endpoint.
+
+    Raw chunks are appended to a reusable buffer and the frames are searched in place.
+    The JSON is decoded directly from a memoryview of the buffer, so a frame is copied only once.
+    Frames split across chunk boundaries stay in the buffer until the rest arrives.
+    """
+
+    def __init__(self, marker=b"data: ", max_frame_size=65536):
+        self.marker = marker
+        self.max_frame_size = max_frame_size
+        self._buffer = bytearray()
+        self._decode = json.JSONDecoder().decode
+
+    def reset(self):
+        """Drop incomplete data, e.g. after a reconnect."""
+        del self._buffer[:]
+
+    def frames(self, chunk):
+        """Append a raw chunk and yield every complete frame as decoded JSON."""
+        buffer = self._buffer
+        buffer += chunk
+
+        marker = self.marker
+        marker_length = len(marker)
+        decode = self._decode
+        start = 0
+
+        try:
+            with memoryview(buffer) as view:
+                while True:
+                    end = buffer.find(b"\n", start)
+                    if end == -1:
+                        break
+
+                    line_start = start
+                    line_end = end - 1 if end > start and buffer[end - 1] == 13 else end
+                    # move on before decoding, so a broken frame is not decoded again
+                    start = end + 1
+
+                    if buffer.startswith(marker, line_start, line_end):
+                        yield decode(str(view[line_start + marker_length : line_end], "utf-8"))
+        finally:
+            if start:
+                del buffer[:start]
+
+        if len(buffer) > self.max_frame_size:
+            size = len(buffer)
+            self.reset()
+            raise ValueError(f"Stream frame exceeds {self.max_frame_size} bytes ({size} bytes without line break)")
+
+    def iter_frames(self, chunks):
+        """Yield the decoded frames of an iterable of raw chunks."""
+        for chunk in chunks:
+            yield from self.frames(chunk)
@@ -0,0 +1,87 @@
+#!/usr/bin/env python
+
+import logging
+import random
+from collections import deque
+from statistics import median
+from time import monotonic
+
+# a stream is stalled after this many median sample intervals without a sample
+HEARTBEAT_FACTOR = 3
+# limits of the heartbeat deadline in seconds, HEARTBEAT_DEFAULT is used until the cadence is known
+HEARTBEAT_MIN = 2
+HEARTBEAT_MAX = 60
+HEARTBEAT_DEFAULT = 15
+# sample intervals needed before the heartbeat deadline follows the cadence
+HEARTBEAT_SAMPLES_MIN = 5
+# reconnect delay in seconds, doubled after every failed connection, with jitter
+RECONNECT_MIN = 1
+RECONNECT_MAX = 30
+
+
+class StreamSupervisor:
+    """Watches the samples of a stream and decides when to reconnect.
+
+    The heartbeat deadline is HEARTBEAT_FACTOR times the median interval between the samples, so a
+    stalled stream is detected within seconds instead of after the read timeout of 60 seconds. A
+    failed connection is retried after an exponential backoff with jitter. A connection counts as
+    failed until it delivered a sample, so a stream which connects but stalls right away backs off too.
+    """
+
+    def __init__(self, label=""):
+        self.label = label
+        self.intervals = deque(maxlen=60)
+        self.sample_last = None
+        self._first_sample = True
+        self.failures = 0
+        # time of the last sample before the stream failed, to log the recovery time
+        self.failed_since = None
+        self.stats = {"connections": 0, "stalls": 0, "errors": 0, "recovery": None}
+
+    def heartbeat(self):
+        """Return the seconds without a sample after which the stream is stalled."""
+        if len(self.intervals) < HEARTBEAT_SAMPLES_MIN:
+            return HEARTBEAT_DEFAULT
+        return min(HEARTBEAT_MAX, max(HEARTBEAT_MIN, HEARTBEAT_FACTOR * median(self.intervals)))
+
+    def connected(self):
+        """Start the heartbeat of a new connection."""
+        self.stats["connections"] += 1
+        self.sample_last = monotonic()
+        self._first_sample = True
+
+    def samples(self, count):
+        """Count the samples of a chunk, return True if the stream recovered with them."""
+        if count == 0:
+            return False
+
+        now = monotonic()
+        # the interval to the first sample of a connection contains the connect time
+        if not self._first_sample:
+            self.intervals.extend([(now - self.sample_last) / count] * min(count, self.intervals.maxlen))
+        self._first_sample = False
+        self.sample_last = now
+
+        if self.failed_since is None:
+            return False
+
+        self.stats["recovery"] = now - self.failed_since
+        logging.warning(f"--> StreamSupervisor{self.label}: stream recovered after {self.stats['recovery']:.1f} seconds")
+        self.failures = 0
+        self.failed_since = None
+        return True
+
+    def stalled(self):
+        """Return True if the heartbeat deadline passed without a sample."""
+        return self.sample_last is not None and monotonic() - self.sample_last > self.heartbeat()
+
+    def failed(self, stalled=False):
+        """Count a failed or stalled connection and return the seconds to wait before reconnecting."""
+        if self.failed_since is None:
+            self.failed_since = self.sample_last if self.sample_last is not None else monotonic()
+        self.stats["stalls" if stalled else "errors"] += 1
+        # the heartbeat starts again with the next connection
+        self.sample_last = None
+        self.failures += 1
+        delay = min(RECONNECT_MAX, RECONNECT_MIN * 2 ** (self.failures - 1))
+        return delay * random.uniform(0.5, 1)
@@ -0,0 +1,117 @@
+#!/usr/bin/env python
+# Benchmark for the authentication of dbus-enphase-envoy
+#
+# Sends the polled requests of the fetch threads from several threads against the emulator
+# (tools/envoy_emulator.py) and counts the round trips the emulator answered (200 and 401 responses)
+# and checks that every request was authenticated in the end.
+#
+# D5 firmware: with a new HTTPDigestAuth per request (like before) and with one DigestAuth per
+# gateway which keeps the challenge.
+#   python tools/benchmark_auth.py --requests 400 --threads 2
+# Let the nonces of the emulator expire to see the re-challenges:
+#   python tools/benchmark_auth.py --requests 400 --nonce-lifetime 0.5
+#
+# D7 firmware: with the bearer token in every request and with the session cookie of /auth/check_jwt
+# (session_cookie = 1). --jwt-verify-time simulates the time the Envoy needs to verify a token.
+#   python tools/benchmark_auth.py --firmware D7 --requests 400 --jwt-verify-time 0.02
+
+import argparse
+import base64
+import json
+import os
+import sys
+import threading
+from time import perf_counter, time
+
+from requests.auth import HTTPDigestAuth
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy"))
+from digestauth import DigestAuth  # noqa: E402
+from envoysession import EnvoySession  # noqa: E402
+
+from envoy_emulator import EnvoyEmulator  # noqa: E402
+
+PATHS = ("/production.json?details=1", "/inventory.json", "/api/v1/production/inverters", "/datatab/event_dt.rb")
+PASSWORD = "12aB3C4d"
+# a JWT with an exp claim in one hour, the emulator does not check the signature
+TOKEN = (
+    ".".join(base64.urlsafe_b64encode(json.dumps(part).encode()).rstrip(b"=").decode() for part in ({"kid": "benchmark", "alg": "ES256"}, {"aud": "123456789012", "iat": int(time()), "exp": int(time()) + 3600}))
+    + ".signature"
+)
+
+
+def round_trips(emulator):
+    requests = emulator.stats()["requests"]
+    ok = sum(count for key, count in requests.items() if key.endswith(" 200"))
+    unauthorized = sum(count for key, count in requests.items() if key.endswith(" 401"))
+    return ok, unauthorized
+
+
+def start_session(emulator):
+    """Validate the token once like the driver with session_cookie = 1, return the headers with the session cookie."""
+    session = EnvoySession()
+    response = session.get(emulator.url + "/auth/check_jwt", headers={"Authorization": "Bearer " + TOKEN}, timeout=10)
+    session.close()
+    return {"Cookie": "sessionId=" + response.cookies["sessionId"]}
+
+
+def run(variant, request_options, emulator, count, threads):
+    """Send count requests from threads threads, request_options() returns the authentication of a request."""
+    session = EnvoySession(pool_maxsize=threads)
+    failed = []
+    ok_start, unauthorized_start = round_trips(emulator)
+
+    def worker(number):
+        for index in range(number, count, threads):
+            response = session.get(emulator.url + PATHS[index % len(PATHS)], timeout=60, **request_options())
+            if response.status_code != 200:
+                failed.append(response.status_code)
+
+    time_start = perf_counter()
+    workers = [threading.Thread(target=worker, args=(number,)) for number in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    elapsed = perf_counter() - time_start
+
+    ok, unauthorized = round_trips(emulator)
+    ok -= ok_start
+    unauthorized -= unauthorized_start
+    print(f"{variant:11} {count / elapsed:10.1f} {ok:6} {unauthorized:6} {(ok + unauthorized) / count:16.2f} {len(failed):7}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count the round trips of the digest authentication against the emulator")
+    parser.add_argument("--requests", type=int, default=400, help="requests per variant (default: 400)")
+    parser.add_argument("--threads", type=int, default=2, help="threads sending the requests, like the fetch and stream threads (default: 2)")
+    parser.add_argument("--firmware", choices=("D5", "D7"), default="D5", help="D5 = digest authentication, D7 = bearer token and session cookie (default: D5)")
+    parser.add_argument("--nonce-lifetime", type=float, default=0, help="seconds until a nonce of the emulator expires, 0 = never (default: 0)")
+    parser.add_argument("--jwt-verify-time", type=float, default=0.02, help="seconds the emulator needs to verify a token of D7 firmware (default: 0.02)")
+    args = parser.parse_args()
+
+    emulator = EnvoyEmulator(firmware=args.firmware, password=PASSWORD, seed=1, nonce_lifetime=args.nonce_lifetime, jwt_verify_time=args.jwt_verify_time).start()
+    try:
+        if args.firmware == "D7":
+            print(f"{args.requests} requests from {args.threads} thread(s), token verification: {args.jwt_verify_time} seconds")
+            print("variant     requests/s    200    401  trips/request  failed")
+            bearer = {"Authorization": "Bearer " + TOKEN}
+            run("bearer", lambda: {"headers": bearer}, emulator, args.requests, args.threads)
+            verifications = emulator.stats()["jwt_verifications"]
+            cookie = start_session(emulator)
+            run("session", lambda: {"headers": cookie}, emulator, args.requests, args.threads)
+            print(f"token verifications: bearer {verifications}, session {emulator.stats()['jwt_verifications'] - verifications}")
+        else:
+            digest_auth = DigestAuth("installer", PASSWORD)
+            print(f"{args.requests} requests from {args.threads} thread(s), nonce lifetime: {args.nonce_lifetime or 'unlimited'}")
+            print("variant     requests/s    200    401  trips/request  failed")
+            run("per-request", lambda: {"auth": HTTPDigestAuth("installer", PASSWORD)}, emulator, args.requests, args.threads)
+            run("cached", lambda: {"auth": digest_auth}, emulator, args.requests, args.threads)
+            print(f"challenges of the cached DigestAuth: {digest_auth.stats['challenges']}")
+    finally:
+        emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+#!/usr/bin/env python
+# Benchmark for the D-Bus updates of dbus-enphase-envoy
+#
+# Starts a private dbus-daemon, exports the paths of the PV service with velib and applies the same
+# stream rows twice: once path by path (one PropertiesChanged signal per changed path) and once
+# batched with "with service as s:" (one ItemsChanged signal per update). A second connection counts
+# the signals like systemcalc, the GUI or dbus-mqtt would receive them. Every signal is a message
+# the dbus-daemon has to route and a wake-up of each subscribed process.
+#
+# Requires dbus-python, PyGObject and dbus-daemon, e.g. on a GX device or a desktop Linux:
+#   python tools/benchmark_dbus_updates.py --updates 1000 --phases 3
+
+import argparse
+import os
+import subprocess
+import sys
+from time import perf_counter, process_time
+
+import dbus
+import dbus.lowlevel
+from dbus.mainloop.glib import DBusGMainLoop
+from gi.repository import GLib
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy"))
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy", "ext", "velib_python"))
+from meterschema import MeterSchema, ReplacementTable  # noqa: E402
+from vedbus import VeDbusService  # noqa: E402
+
+from envoy_emulator import EnvoyModel  # noqa: E402
+
+REPLACE_METERS = (("production", "pv"), ("net-consumption", "grid"), ("total-consumption", "consumption"))
+REPLACE_PHASES = (("ph-a", "L1"), ("ph-b", "L2"), ("ph-c", "L3"))
+
+
+def start_bus():
+    """Start a private session bus and return the process and its address."""
+    process = subprocess.Popen(["dbus-daemon", "--session", "--nofork", "--print-address=1"], stdout=subprocess.PIPE, text=True)
+    address = process.stdout.readline().strip()
+    return process, address
+
+
+def pv_values(meter, layout):
+    """Return the values of the pv meter in the D-Bus paths of the driver."""
+    values = {
+        "/Ac/Power": round(meter.power, 2),
+        "/Ac/Current": round(meter.current, 2),
+        "/Ac/Voltage": round(meter.voltage, 2),
+        "/Ac/Energy/Forward": round(meter.energy_forward, 2),
+        "/ErrorCode": 0,
+        "/StatusCode": 7 if meter.power >= 5 else 8,
+    }
+    for phase_name in layout:
+        phase = meter.phase(phase_name)
+        if phase is not None:
+            values.update(
+                {
+                    "/Ac/%s/Power" % phase_name: round(phase.power, 2),
+                    "/Ac/%s/Current" % phase_name: round(phase.current, 2),
+                    "/Ac/%s/Voltage" % phase_name: round(phase.voltage, 2),
+                    "/Ac/%s/Frequency" % phase_name: round(phase.frequency, 4),
+                    "/Ac/%s/Energy/Forward" % phase_name: round(phase.energy_forward, 2),
+                }
+            )
+    return values
+
+
+def create_service(bus, name, paths):
+    service = VeDbusService(name, bus=bus, register=False)
+    for path in paths:
+        service.add_path(path, None)
+    service.add_path("/UpdateIndex", 0)
+    service.register()
+    return service
+
+
+def update_single(service, values):
+    for path, value in values.items():
+        service[path] = value
+    service["/UpdateIndex"] = (service["/UpdateIndex"] + 1) % 256
+
+
+def update_batched(service, values):
+    with service as s:
+        for path, value in values.items():
+            s[path] = value
+        s["/UpdateIndex"] = (s["/UpdateIndex"] + 1) % 256
+
+
+class SignalCounter:
+    """Counts the signals of a service received on another connection."""
+
+    def __init__(self, bus, name):
+        self.count = 0
+        owner = bus.get_name_owner(name)
+        bus.add_match_string("type='signal',interface='com.victronenergy.BusItem',sender='%s'" % owner)
+        bus.add_message_filter(self._filter)
+
+    def _filter(self, bus, message):
+        if isinstance(message, dbus.lowlevel.SignalMessage):
+            self.count += 1
+        return dbus.lowlevel.HANDLER_RESULT_NOT_YET_HANDLED
+
+    def drain(self, context):
+        while context.iteration(False):
+            pass
+
+
+def run(variant, update, rows, service, counter, context):
+    counter.count = 0
+    cpu_start = process_time()
+    time_start = perf_counter()
+    for values in rows:
+        update(service, values)
+        # deliver the signals of this update, like the main loop of a consumer would
+        counter.drain(context)
+    elapsed = perf_counter() - time_start
+    cpu = process_time() - cpu_start
+
+    # count the signals which are still on their way
+    time_end = perf_counter() + 0.5
+    while perf_counter() < time_end:
+        counter.drain(context)
+    print(f"{variant:8} {counter.count / len(rows):16.1f} {elapsed / len(rows) * 1000000:12.0f} {cpu / len(rows) * 1000000:15.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the D-Bus updates of dbus-enphase-envoy on a private bus")
+    parser.add_argument("--updates", type=int, default=1000, help="updates per variant (default: 1000)")
+    parser.add_argument("--phases", type=int, choices=(1, 2, 3), default=3, help="phases of the generated rows (default: 3)")
+    args = parser.parse_args()
+
+    DBusGMainLoop(set_as_default=True)
+    process, address = start_bus()
+    try:
+        model = EnvoyModel(phases=args.phases, seed=1)
+        historic = {meter: {"whToday": 0.0, "vahToday": 0.0, "whLifetime": 1000000.0, "vahLifetime": 0.0} for meter in ("pv", "grid", "consumption")}
+        for meter in historic:
+            historic[meter].update({phase: dict(historic[meter]) for phase in ("L1", "L2", "L3")})
+
+        meter_names = ReplacementTable(REPLACE_METERS)
+        phase_names = ReplacementTable(REPLACE_PHASES)
+        schema = None
+        rows = []
+        for _ in range(args.updates):
+            data = model.meter_frame()
+            if schema is None or not schema.matches(data):
+                schema = MeterSchema.detect(data, meter_names, phase_names)
+            rows.append(pv_values(schema.decode(data, historic)["pv"], schema.layout))
+
+        context = GLib.MainContext.default()
+        counter_bus = dbus.bus.BusConnection(address)
+
+        print(f"{len(rows)} updates with {len(rows[0]) + 1} paths each")
+        print("variant  signals/update    us/update   CPU us/update")
+        for variant, update in (("single", update_single), ("batched", update_batched)):
+            service_bus = dbus.bus.BusConnection(address)
+            name = "com.victronenergy.pvinverter.benchmark_" + variant
+            service = create_service(service_bus, name, rows[0])
+            counter = SignalCounter(counter_bus, name)
+            run(variant, update, rows, service, counter, context)
+            service.__del__()
+            service_bus.close()
+    finally:
+        process.terminate()
+        process.wait()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
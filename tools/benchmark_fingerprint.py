@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+# Benchmark for the polling of unchanged responses of dbus-enphase-envoy
+#
+# Polls /api/v1/production/inverters of the emulator (tools/envoy_emulator.py) with a large fleet
+# like fetch_inverters(): once parsing every response and building the payload (like before) and
+# once with EnvoySession.get_changed(), which skips responses with the same body hash or a
+# 304 Not Modified answer to If-None-Match (--etag). The Envoy refreshes the inverter reports
+# every 300 seconds, so almost every poll returns the same body. The CPU time is the one of the
+# polling thread, without the emulator.
+#
+#   python tools/benchmark_fingerprint.py --inverters 300 --polls 200
+#   python tools/benchmark_fingerprint.py --inverters 300 --polls 200 --etag
+
+import argparse
+import os
+import sys
+from time import thread_time, time
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy"))
+from digestauth import DigestAuth  # noqa: E402
+from envoysession import EnvoySession  # noqa: E402
+
+from envoy_emulator import EnvoyEmulator  # noqa: E402
+
+PATH = "/api/v1/production/inverters"
+PASSWORD = "12aB3C4d"
+
+
+def build_payload(response):
+    """Same work as fetch_inverters() of the driver."""
+    total_jsonpayload = {}
+    for inverter in response.json():
+        inverter_power = inverter["lastReportWatts"] if inverter["lastReportDate"] + 1200 > int(time()) else 0
+        total_jsonpayload.update(
+            {
+                inverter["serialNumber"]: {
+                    "lastReportDate": inverter["lastReportDate"],
+                    "lastReportWatts": inverter["lastReportWatts"],
+                    "currentWatts": inverter_power,
+                }
+            }
+        )
+    return total_jsonpayload
+
+
+def run(variant, emulator, polls, conditional):
+    session = EnvoySession()
+    auth = DigestAuth("installer", PASSWORD)
+    parsed = 0
+    cpu_start = thread_time()
+    for _ in range(polls):
+        if conditional:
+            response = session.get_changed(emulator.url + PATH, auth=auth, timeout=60)
+        else:
+            response = session.get(emulator.url + PATH, auth=auth, timeout=60)
+        if response is not None:
+            build_payload(response)
+            parsed += 1
+    cpu = thread_time() - cpu_start
+    print(f"{variant:8} {parsed:7} {cpu / polls * 1000:12.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing of unchanged inverter responses")
+    parser.add_argument("--inverters", type=int, default=300, help="number of microinverters (default: 300)")
+    parser.add_argument("--polls", type=int, default=200, help="polls per variant (default: 200)")
+    parser.add_argument("--etag", action="store_true", help="the emulator sends ETag headers and answers with 304 Not Modified")
+    args = parser.parse_args()
+
+    emulator = EnvoyEmulator(firmware="D5", password=PASSWORD, inverters=args.inverters, seed=1, etag=args.etag).start()
+    try:
+        print(f"{args.polls} polls of {args.inverters} inverters, {'ETag' if args.etag else 'body hash'}")
+        print("variant   parsed  CPU ms/poll")
+        run("full", emulator, args.polls, False)
+        run("changed", emulator, args.polls, True)
+    finally:
+        emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
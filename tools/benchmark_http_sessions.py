@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+# Benchmark for the polled requests of dbus-enphase-envoy
+#
+# Sends the same requests as the fetch threads three times against the emulator (tools/envoy_emulator.py):
+# with a new connection per request (requests.get, like before), with a new connection per request
+# which resumes the TLS session and with the pooled EnvoySession (keep-alive and TLS session resumption).
+# Reports requests/s, the connections the emulator accepted, the resumed TLS sessions and the mean
+# connect time (TCP and TLS handshake) and time to first byte.
+#
+# D5 firmware (HTTP, digest authentication):
+#   python tools/benchmark_http_sessions.py --requests 200
+# D7 firmware (HTTPS, bearer token), creates a self-signed certificate with openssl:
+#   python tools/benchmark_http_sessions.py --requests 200 --tls
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+from time import perf_counter
+
+import urllib3
+from requests.auth import HTTPDigestAuth
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy"))
+from envoysession import EnvoySession  # noqa: E402
+
+from envoy_emulator import EnvoyEmulator  # noqa: E402
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+PATHS = ("/production.json?details=1", "/inventory.json", "/api/v1/production/inverters", "/datatab/event_dt.rb")
+PASSWORD = "12aB3C4d"
+TOKEN = "benchmark"
+
+
+def create_certificate(directory):
+    certfile = os.path.join(directory, "envoy.crt")
+    keyfile = os.path.join(directory, "envoy.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-newkey", "rsa:2048", "-nodes", "-days", "1", "-subj", "/CN=envoy.local", "-keyout", keyfile, "-out", certfile],
+        check=True,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    return certfile, keyfile
+
+
+class Client:
+    def __init__(self, url, tls, session):
+        self.url = url
+        self.tls = tls
+        self.session = session
+
+    def get(self, path):
+        if self.tls:
+            return self.session.get(self.url + path, headers={"Authorization": "Bearer " + TOKEN}, timeout=60)
+        return self.session.get(self.url + path, auth=HTTPDigestAuth("installer", PASSWORD), timeout=60)
+
+
+class SingleSession(EnvoySession):
+    """New connection per request, like requests.get() of the driver before, optionally with TLS session resumption."""
+
+    def __init__(self, resume):
+        super().__init__()
+        self.resume = resume
+
+    def get(self, url, **kwargs):
+        response = super().get(url, **kwargs)
+        self.session.close()
+        if not self.resume:
+            for adapter in self.session.adapters.values():
+                adapter.ssl_context.reset()
+        return response
+
+
+def run(variant, client, emulator, count):
+    connections_start = emulator.stats()["connections"]
+    time_start = perf_counter()
+    for index in range(count):
+        response = client.get(PATHS[index % len(PATHS)])
+        response.raise_for_status()
+        response.content
+    elapsed = perf_counter() - time_start
+    connections = emulator.stats()["connections"] - connections_start
+
+    stats = client.session.stats
+    connect = stats["connect"] / stats["connections"] * 1000 if stats["connections"] else 0
+    ttfb = stats["ttfb"] / stats["requests"] * 1000
+    print(f"{variant:8} {count / elapsed:10.1f} {connections:12} {stats['resumed']:8} {connect:11.2f} {ttfb:9.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark new connections per request against the pooled EnvoySession")
+    parser.add_argument("--requests", type=int, default=200, help="requests per variant (default: 200)")
+    parser.add_argument("--tls", action="store_true", help="D7 firmware with HTTPS and bearer token instead of D5 with digest authentication")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        certfile, keyfile = create_certificate(directory) if args.tls else (None, None)
+        emulator = EnvoyEmulator(firmware="D7" if args.tls else "D5", password=PASSWORD, token=TOKEN, certfile=certfile, keyfile=keyfile, seed=1).start()
+        try:
+            print(f"{args.requests} requests against {emulator.url} ({'D7, HTTPS' if args.tls else 'D5, HTTP with digest authentication'})")
+            print("variant   requests/s  connections  resumed  connect ms   ttfb ms")
+            for variant, session in (("single", SingleSession(False)), ("resumed", SingleSession(True)), ("pooled", EnvoySession())):
+                client = Client(emulator.url, args.tls, session)
+                run(variant, client, emulator, args.requests)
+        finally:
+            emulator.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+# Benchmark for the "/stream/meter" processing of dbus-enphase-envoy
+#
+# Compares the previous line based parsing (iter_lines, startswith, replace, json.loads)
+# with the incremental MeterStreamDecoder against a recorded stream capture.
+# Then compares the previous per row dict building with the MeterSchema decoding into a
+# StreamSample per row: rows/s and bytes allocated per row (tracemalloc).
+#
+# Record a capture from an Envoy-S or the emulator (tools/envoy_emulator.py):
+#   python tools/benchmark_meter_stream.py --record http://127.0.0.1:8080 --password 12aB3C4d --seconds 60 --capture stream.bin
+# Run the benchmark against the capture:
+#   python tools/benchmark_meter_stream.py --capture stream.bin
+# Without --capture a capture is generated with the emulator model.
+
+import argparse
+import io
+import json
+import os
+import sys
+import tracemalloc
+from functools import reduce
+from time import perf_counter, time
+
+import requests
+from requests.auth import HTTPDigestAuth
+
+sys.path.insert(1, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "dbus-enphase-envoy"))
+from streamdecoder import MeterStreamDecoder, STREAM_CHUNK_SIZE  # noqa: E402
+from meterschema import MeterSchema, ReplacementTable  # noqa: E402
+
+from envoy_emulator import EnvoyModel  # noqa: E402
+
+
+def record(url, seconds, password=None, token=None):
+    if token:
+        response = requests.get(url + "/stream/meter", stream=True, timeout=60, headers={"Authorization": "Bearer " + token}, verify=False)
+    else:
+        response = requests.get(url + "/stream/meter", stream=True, timeout=60, auth=HTTPDigestAuth("installer", password))
+    response.raise_for_status()
+
+    capture = bytearray()
+    time_end = time() + seconds
+    for chunk in response.iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        capture += chunk
+        if time() > time_end:
+            break
+    response.close()
+    return bytes(capture)
+
+
+def generate(rows, phases):
+    model = EnvoyModel(phases=phases, seed=1)
+    return b"".join(b"data: " + json.dumps(model.meter_frame()).encode() + b"\r\n\r\n" for _ in range(rows))
+
+
+def _response(capture):
+    response = requests.models.Response()
+    response.raw = io.BytesIO(capture)
+    response.status_code = 200
+    return response
+
+
+def parse_lines(capture):
+    marker = b"data: "
+    rows = []
+    for row in _response(capture).iter_lines():
+        if row.startswith(marker):
+            rows.append(json.loads(row.replace(marker, b"")))
+    return rows
+
+
+def parse_decoder(capture):
+    decoder = MeterStreamDecoder()
+    rows = []
+    for chunk in _response(capture).iter_content(chunk_size=STREAM_CHUNK_SIZE):
+        for data in decoder.frames(chunk):
+            rows.append(data)
+    return rows
+
+
+REPLACE_METERS = (("production", "pv"), ("net-consumption", "grid"), ("total-consumption", "consumption"))
+REPLACE_PHASES = (("ph-a", "L1"), ("ph-b", "L2"), ("ph-c", "L3"))
+
+
+def historic_data():
+    values = {"whToday": 1000.0, "vahToday": 1050.0, "whLifetime": 1000000.0, "vahLifetime": 1050000.0}
+    return {meter: dict(values, L1=dict(values), L2=dict(values), L3=dict(values)) for meter in ("pv", "grid", "consumption")}
+
+
+def decode_legacy(data, historic, energy):
+    # previous implementation: rename keys with reduce() and build new dicts for every row
+    total_jsonpayload = {}
+    for meter in ["production", "net-consumption", "total-consumption"]:
+        meter_name = reduce(lambda a, kv: a.replace(*kv), REPLACE_METERS, meter)
+        jsonpayload = {}
+        total_power = 0
+        total_current = 0
+        total_voltage = 0
+        total_power_react = 0
+        total_power_appearent = 0
+        for phase in ["ph-a", "ph-b", "ph-c"]:
+            phase_name = reduce(lambda a, kv: a.replace(*kv), REPLACE_PHASES, phase)
+            if data[meter][phase]["v"] > 0:
+                total_power += float(data[meter][phase]["p"])
+                total_current += float(data[meter][phase]["i"])
+                total_voltage += float(data[meter][phase]["v"])
+                total_power_react += float(data[meter][phase]["q"])
+                total_power_appearent += float(data[meter][phase]["s"])
+                if meter_name == "pv" and data[meter][phase]["p"] < 5:
+                    data[meter][phase]["p"] = 0
+                    data[meter][phase]["i"] = 0
+                phase_data = {
+                    "power": float(data[meter][phase]["p"]),
+                    "current": float(data[meter][phase]["i"]),
+                    "voltage": float(data[meter][phase]["v"]),
+                    "power_react": float(data[meter][phase]["q"]),
+                    "power_appearent": float(data[meter][phase]["s"]),
+                    "power_factor": float(data[meter][phase]["pf"]),
+                    "frequency": float(data[meter][phase]["f"]),
+                    "whToday": historic[meter_name][phase_name]["whToday"],
+                    "vahToday": historic[meter_name][phase_name]["vahToday"],
+                    "whLifetime": historic[meter_name][phase_name]["whLifetime"],
+                    "vahLifetime": historic[meter_name][phase_name]["vahLifetime"],
+                }
+                if meter_name == "pv":
+                    phase_data.update({"energy_forward": float(round(historic[meter_name][phase_name]["whLifetime"] / 1000, 3))})
+                if meter_name == "grid":
+                    phase_data.update(
+                        {
+                            "energy_forward": (energy["grid"][phase_name]["energy_forward"] if "grid" in energy and phase_name in energy["grid"] else 0),
+                            "energy_reverse": (energy["grid"][phase_name]["energy_reverse"] if "grid" in energy and phase_name in energy["grid"] else 0),
+                        }
+                    )
+                if meter_name == "consumption":
+                    phase_data.update({"energy_forward": float(round(historic[meter_name][phase_name]["whLifetime"] / 1000, 3))})
+                jsonpayload.update({phase_name: phase_data})
+        if meter_name == "pv" and total_power < 5:
+            total_power = 0
+            total_current = 0
+        jsonpayload.update(
+            {
+                "power": total_power,
+                "current": total_current,
+                "voltage": total_voltage,
+                "power_react": total_power_react,
+                "power_appearent": total_power_appearent,
+                "whToday": historic[meter_name]["whToday"],
+                "vahToday": historic[meter_name]["vahToday"],
+                "whLifetime": historic[meter_name]["whLifetime"],
+                "vahLifetime": historic[meter_name]["vahLifetime"],
+            }
+        )
+        if meter_name == "pv":
+            jsonpayload.update({"energy_forward": round(historic[meter_name]["whLifetime"] / 1000, 3)})
+        if meter_name == "grid":
+            jsonpayload.update(
+                {
+                    "energy_forward": (energy["grid"]["energy_forward"] if "grid" in energy else 0),
+                    "energy_reverse": (energy["grid"]["energy_reverse"] if "grid" in energy else 0),
+                }
+            )
+        if meter_name == "consumption":
+            jsonpayload.update({"energy_forward": round(historic[meter_name]["whLifetime"] / 1000, 3)})
+        total_jsonpayload.update({meter_name: jsonpayload})
+    return total_jsonpayload
+
+
+def legacy_decoder(historic, energy):
+    def decode(data):
+        return decode_legacy(data, historic, energy)
+
+    return decode
+
+
+def schema_decoder(historic, energy):
+    meter_names = ReplacementTable(REPLACE_METERS)
+    phase_names = ReplacementTable(REPLACE_PHASES)
+    state = {"schema": None}
+
+    def decode(data):
+        schema = state["schema"]
+        if schema is None or not schema.matches(data):
+            schema = state["schema"] = MeterSchema.detect(data, meter_names, phase_names)
+        return schema.decode(data, historic)
+
+    return decode
+
+
+def decode_rows(decode, rows):
+    result = None
+    for data in rows:
+        # keep only the last row, like the driver does
+        result = decode(data)
+    return result
+
+
+def measure_allocations(decode, rows):
+    """Return the bytes allocated per row, measured with tracemalloc."""
+    decode(rows[0])
+    allocated = 0
+    tracemalloc.start()
+    for data in rows:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        result = decode(data)
+        allocated += tracemalloc.get_traced_memory()[1] - current
+        del result
+    tracemalloc.stop()
+    return allocated / len(rows)
+
+
+def measure(function, capture, repeat):
+    best = None
+    for _ in range(repeat):
+        time_start = perf_counter()
+        rows = function(capture)
+        elapsed = perf_counter() - time_start
+        best = elapsed if best is None or elapsed < best else best
+    return rows, best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the /stream/meter parsing of dbus-enphase-envoy")
+    parser.add_argument("--capture", help="raw stream capture to use (or to write with --record)")
+    parser.add_argument("--record", metavar="URL", help="record a capture from this Envoy-S, e.g. http://127.0.0.1:8080")
+    parser.add_argument("--seconds", type=int, default=60, help="recording duration (default: 60)")
+    parser.add_argument("--password", default="", help="installer password for D5 firmware")
+    parser.add_argument("--token", default=None, help="token for D7 firmware")
+    parser.add_argument("--rows", type=int, default=20000, help="rows to generate without capture (default: 20000)")
+    parser.add_argument("--phases", type=int, choices=(1, 2, 3), default=3, help="phases to generate without capture (default: 3)")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per variant, the best is reported (default: 5)")
+    args = parser.parse_args()
+
+    if args.record:
+        capture = record(args.record, args.seconds, args.password, args.token)
+        if args.capture:
+            with open(args.capture, "wb") as file:
+                file.write(capture)
+            print(f"Recorded {len(capture)} bytes to {args.capture}")
+    elif args.capture:
+        with open(args.capture, "rb") as file:
+            capture = file.read()
+    else:
+        capture = generate(args.rows, args.phases)
+
+    rows_before, time_before = measure(parse_lines, capture, args.repeat)
+    rows_after, time_after = measure(parse_decoder, capture, args.repeat)
+
+    if rows_before != rows_after:
+        print("ERROR: the decoders returned different rows")
+        return 1
+
+    print(f"Capture: {len(capture)} bytes, {len(rows_before)} rows")
+    print(f"before (iter_lines + replace + json.loads): {len(rows_before) / time_before:12.0f} rows/s")
+    print(f"after  (MeterStreamDecoder):                 {len(rows_after) / time_after:12.0f} rows/s")
+    print(f"speedup: {time_before / time_after:.2f}x")
+
+    historic = historic_data()
+    # the grid energy is integrated separately by the driver
+    energy = {}
+
+    rows_legacy = json.loads(json.dumps(rows_before))
+    rows_schema = json.loads(json.dumps(rows_before))
+    if decode_rows(legacy_decoder(historic, energy), rows_legacy) != decode_rows(schema_decoder(historic, energy), rows_schema).to_dict():
+        print("ERROR: the meter decoders returned different data")
+        return 1
+
+    _, time_legacy = measure(lambda rows: decode_rows(legacy_decoder(historic, energy), rows), rows_legacy, args.repeat)
+    _, time_schema = measure(lambda rows: decode_rows(schema_decoder(historic, energy), rows), rows_schema, args.repeat)
+    bytes_legacy = measure_allocations(legacy_decoder(historic, energy), rows_legacy)
+    bytes_schema = measure_allocations(schema_decoder(historic, energy), rows_schema)
+
+    print()
+    print("Meter decoding                               rows/s   bytes allocated/row")
+    print(f"before (reduce + new dicts per row):  {len(rows_legacy) / time_legacy:12.0f} {bytes_legacy:21.0f}")
+    print(f"after  (MeterSchema + StreamSample):  {len(rows_schema) / time_schema:12.0f} {bytes_schema:21.0f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
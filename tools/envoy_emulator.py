@@ -0,0 +1,639 @@
+#!/usr/bin/env python
+# Local Enphase Envoy-S emulator for load and soak testing dbus-enphase-envoy without an Envoy
+#
+# Implements the endpoints the driver depends on:
+#   /stream/meter                    SSE "data: " lines at a configurable rate
+#   /production.json?details=1       lifetime and today counters incl. per phase lines
+#   /inventory.json                  microinverters (PCU) and Q-Relays (NSRB)
+#   /api/v1/production/inverters     per microinverter reports
+#   /datatab/event_dt.rb             latest events
+#   /auth/check_jwt                  D7 firmware: validates the bearer token and sets the sessionId cookie
+#   /emulator/stats                  request counters of the emulator (no authentication)
+#
+# D5 firmware: HTTP with digest authentication (user "installer"), --nonce-lifetime lets the nonces expire
+# D7 firmware: HTTPS with bearer token (create a self-signed certificate first), a JWT after its exp claim is rejected,
+#   the sessionId cookie of /auth/check_jwt is accepted instead of the token, --session-lifetime lets the sessions expire and
+#   --jwt-verify-time simulates the time the Envoy needs to verify the signature of a token, e.g.
+#   openssl req -x509 -newkey rsa:2048 -nodes -days 365 -subj "/CN=envoy.local" -keyout envoy.key -out envoy.crt
+#   python tools/envoy_emulator.py --firmware D7 --certfile envoy.crt --keyfile envoy.key --port 8443
+#
+# Then point the driver to the emulator in the "config.ini", e.g. address = 127.0.0.1:8443
+
+import argparse
+import base64
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import re
+import ssl
+import sys
+import threading
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from time import monotonic, sleep, time
+from urllib.parse import urlparse
+
+DIGEST_REALM = "enphaseenergy.com"
+DIGEST_USER = "installer"
+
+METERS = ("production", "net-consumption", "total-consumption")
+PHASES = ("ph-a", "ph-b", "ph-c")
+
+
+def token_expired(token):
+    """Return True if the token is a JWT and its exp claim passed, the signature is not checked."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return claims["exp"] < time()
+    except (IndexError, KeyError, TypeError, ValueError):
+        return False
+
+
+class EnvoyModel:
+    """Generates plausible meter, inverter, device and event data for the emulator."""
+
+    def __init__(self, phases=1, inverter_count=10, inverter_watts=300, seed=None):
+        self.phases = phases
+        self.inverter_count = inverter_count
+        self.inverter_watts = inverter_watts
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+        self.serials = ["1221%08d" % (i + 1) for i in range(inverter_count)]
+        # microinverters report every 300 seconds, all within a short window after the fleet phase
+        self.report_period = 300
+        self.report_phase = self.random.uniform(0, self.report_period)
+        self.report_spread = [self.random.uniform(0, 20) for _ in range(inverter_count)]
+        # last report date and watts per serial
+        self.reports = {}
+
+        self.time_last = time()
+        self.day = int(self.time_last // 86400)
+        self.consumption = [self.random.uniform(200, 600) for _ in range(3)]
+        self.wh_lifetime = {meter: [self.random.uniform(1e6, 5e6) for _ in range(3)] for meter in METERS}
+        self.vah_lifetime = {meter: [value * 1.05 for value in self.wh_lifetime[meter]] for meter in METERS}
+        self.wh_today = {meter: [0.0, 0.0, 0.0] for meter in METERS}
+        self.vah_today = {meter: [0.0, 0.0, 0.0] for meter in METERS}
+        self.power = {meter: [0.0, 0.0, 0.0] for meter in METERS}
+        self.event_log = []
+
+    def _pv_power(self, timestamp):
+        # slow sine wave with some clouds
+        fleet = self.inverter_count * self.inverter_watts / self.phases
+        return max(0.0, fleet * (0.55 + 0.4 * math.sin(timestamp / 600)) + self.random.gauss(0, fleet * 0.02))
+
+    def _phase(self, power, react):
+        voltage = self.random.gauss(230, 1.5)
+        apparent = math.hypot(power, react)
+        return {
+            "p": round(power, 3),
+            "q": round(react, 3),
+            "s": round(apparent, 3),
+            "v": round(voltage, 3),
+            "i": round(apparent / voltage, 3),
+            "pf": round(power / apparent, 2) if apparent > 0 else 0.0,
+            "f": round(self.random.gauss(50, 0.01), 2),
+        }
+
+    @staticmethod
+    def _empty_phase():
+        return {"p": 0.0, "q": 0.0, "s": 0.0, "v": 0.0, "i": 0.0, "pf": 0.0, "f": 0.0}
+
+    def meter_frame(self):
+        """Advance the model and return one "/stream/meter" row."""
+        with self.lock:
+            timestamp = time()
+            elapsed = max(0.0, timestamp - self.time_last)
+            self.time_last = timestamp
+
+            if int(timestamp // 86400) != self.day:
+                self.day = int(timestamp // 86400)
+                for meter in METERS:
+                    self.wh_today[meter] = [0.0, 0.0, 0.0]
+                    self.vah_today[meter] = [0.0, 0.0, 0.0]
+
+            frame = {meter: {} for meter in METERS}
+
+            for index, phase in enumerate(PHASES):
+                if index >= self.phases:
+                    for meter in METERS:
+                        frame[meter][phase] = self._empty_phase()
+                    continue
+
+                self.consumption[index] = min(3000.0, max(50.0, self.consumption[index] + self.random.gauss(0, 15)))
+                production = self._pv_power(timestamp + index * 7)
+                powers = {
+                    "production": production,
+                    "total-consumption": self.consumption[index],
+                    "net-consumption": self.consumption[index] - production,
+                }
+
+                for meter, power in powers.items():
+                    frame[meter][phase] = self._phase(power, power * 0.05)
+                    self.power[meter][index] = power
+                    energy = max(0.0, power) * elapsed / 3600
+                    self.wh_lifetime[meter][index] += energy
+                    self.vah_lifetime[meter][index] += energy * 1.05
+                    self.wh_today[meter][index] += energy
+                    self.vah_today[meter][index] += energy * 1.05
+
+            return frame
+
+    def _eim(self, meter):
+        lines = []
+        for index in range(3):
+            lines.append(
+                {
+                    "wNow": round(self.power[meter][index], 3),
+                    "whLifetime": round(self.wh_lifetime[meter][index], 3),
+                    "vahLifetime": round(self.vah_lifetime[meter][index], 3),
+                    "whToday": round(self.wh_today[meter][index], 3),
+                    "vahToday": round(self.vah_today[meter][index], 3),
+                }
+            )
+        lines = lines[: self.phases]
+        return {
+            "type": "eim",
+            "activeCount": 1,
+            "measurementType": meter,
+            "readingTime": int(self.time_last),
+            "wNow": round(sum(line["wNow"] for line in lines), 3),
+            "whLifetime": round(sum(line["whLifetime"] for line in lines), 3),
+            "vahLifetime": round(sum(line["vahLifetime"] for line in lines), 3),
+            "whToday": round(sum(line["whToday"] for line in lines), 3),
+            "vahToday": round(sum(line["vahToday"] for line in lines), 3),
+            "lines": lines,
+        }
+
+    def production(self):
+        with self.lock:
+            return {
+                "production": [
+                    {
+                        "type": "inverters",
+                        "activeCount": self.inverter_count,
+                        "readingTime": int(self.time_last),
+                        "wNow": round(sum(self.power["production"]), 3),
+                        "whLifetime": round(sum(self.wh_lifetime["production"]), 3),
+                    },
+                    self._eim("production"),
+                ],
+                "consumption": [self._eim("total-consumption"), self._eim("net-consumption")],
+                "storage": [{"type": "acb", "activeCount": 0, "readingTime": 0, "wNow": 0, "whNow": 0, "state": "idle"}],
+            }
+
+    def inventory(self):
+        devices = []
+        for serial in self.serials:
+            devices.append(
+                {
+                    "part_num": "800-01391-r02",
+                    "serial_num": serial,
+                    "device_status": ["envoy.global.ok"],
+                    "producing": sum(self.power["production"]) > 5,
+                    "communicating": True,
+                    "provisioned": True,
+                    "operating": True,
+                }
+            )
+        relais = [
+            {
+                "part_num": "800-00597-r02",
+                "serial_num": "122200000001",
+                "device_status": ["envoy.global.ok"],
+                "producing": False,
+                "communicating": True,
+                "provisioned": True,
+                "operating": True,
+                "relay": "closed",
+                "reason": "ok",
+            }
+        ]
+        return [
+            {"type": "PCU", "devices": devices},
+            {"type": "ACB", "devices": []},
+            {"type": "NSRB", "devices": relais},
+        ]
+
+    def inverters(self):
+        timestamp = time()
+        with self.lock:
+            watts = sum(self.power["production"]) / max(1, self.inverter_count)
+        # last report of the fleet: the most recent period start after the fleet phase
+        last_period = self.report_phase + math.floor((timestamp - self.report_phase) / self.report_period) * self.report_period
+        result = []
+        for index, serial in enumerate(self.serials):
+            report = int(last_period + self.report_spread[index])
+            if report > timestamp:
+                report -= self.report_period
+            # the watts of a report change only with the next report, like on the Envoy
+            with self.lock:
+                if self.reports.get(serial, (None,))[0] != report:
+                    self.reports[serial] = (report, int(watts))
+                report_watts = self.reports[serial][1]
+            result.append(
+                {
+                    "serialNumber": serial,
+                    "lastReportDate": report,
+                    "devType": 1,
+                    "lastReportWatts": report_watts,
+                    "maxReportWatts": self.inverter_watts,
+                }
+            )
+        return result
+
+    def events(self, length=10):
+        with self.lock:
+            if not self.event_log or self.random.random() < 0.05:
+                self.event_log.insert(
+                    0,
+                    [
+                        len(self.event_log) + 1,
+                        "Microinverter failed to report",
+                        self.random.choice(self.serials) if self.serials else "",
+                        "Set",
+                        "Sat Oct 18 10:00:00 2025",
+                    ],
+                )
+            return {"aaData": self.event_log[:length]}
+
+
+class EnvoyRequestHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # header and body are written separately, without TCP_NODELAY kept-alive connections wait for the delayed ACK
+    disable_nagle_algorithm = True
+    server_version = "openresty/1.17.8.1"
+    sys_version = ""
+
+    def setup(self):
+        super().setup()
+        self.server.emulator.count_connection()
+
+    def log_message(self, format, *args):
+        logging.debug("%s - %s" % (self.address_string(), format % args))
+
+    def _send_json(self, data, status=200, conditional=False):
+        body = json.dumps(data).encode()
+        etag = None
+        if conditional and self.server.emulator.etag:
+            etag = '"%s"' % hashlib.md5(body).hexdigest()
+            if self.headers.get("If-None-Match") == etag:
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                self.server.emulator.count(self.path, 304)
+                return
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.emulator.count(self.path, status)
+
+    def _send_unauthorized(self, headers=None):
+        body = b"Unauthorized"
+        self.send_response(401)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.emulator.count(self.path, 401)
+
+    def _authenticate(self):
+        emulator = self.server.emulator
+        header = self.headers.get("Authorization", "")
+
+        if emulator.firmware == "D7":
+            # the session cookie of /auth/check_jwt replaces the token
+            cookies = SimpleCookie(self.headers.get("Cookie", ""))
+            if "sessionId" in cookies:
+                if emulator.check_session(cookies["sessionId"].value):
+                    return True
+            elif header.startswith("Bearer ") and emulator.check_token(header[7:]):
+                return True
+            self._send_unauthorized()
+            return False
+
+        result = emulator.check_digest(self.command, header[7:]) if header.startswith("Digest ") else False
+        if result is True:
+            return True
+        # an expired nonce is answered with stale=true, the client may retry with the new nonce
+        self._send_unauthorized({"WWW-Authenticate": emulator.digest_challenge(stale=result == "stale")})
+        return False
+
+    def do_GET(self):
+        url = urlparse(self.path)
+
+        if url.path == "/emulator/stats":
+            self._send_json(self.server.emulator.stats())
+            return
+
+        if url.path == "/auth/check_jwt" and self.server.emulator.firmware == "D7":
+            self._check_jwt()
+            return
+
+        if url.path not in ("/stream/meter", "/production.json", "/inventory.json", "/api/v1/production/inverters", "/datatab/event_dt.rb"):
+            self._send_json({"error": "not found"}, 404)
+            return
+
+        if not self._authenticate():
+            return
+
+        # simulate a slow endpoint
+        if url.path in self.server.emulator.latency:
+            sleep(self.server.emulator.latency[url.path])
+
+        model = self.server.emulator.model
+
+        if url.path == "/stream/meter":
+            self._stream_meter()
+        elif url.path == "/production.json":
+            self._send_json(model.production())
+        elif url.path == "/inventory.json":
+            self._send_json(model.inventory(), conditional=True)
+        elif url.path == "/api/v1/production/inverters":
+            self._send_json(model.inverters(), conditional=True)
+        elif url.path == "/datatab/event_dt.rb":
+            self._send_json(model.events(), conditional=True)
+
+    def _check_jwt(self):
+        emulator = self.server.emulator
+        header = self.headers.get("Authorization", "")
+        if not header.startswith("Bearer ") or not emulator.check_token(header[7:]):
+            self._send_unauthorized()
+            return
+
+        body = b"<!DOCTYPE html><h2>Valid token.</h2>\n"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Set-Cookie", "sessionId=%s; Path=/; HttpOnly; Secure" % emulator.create_session())
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        emulator.count(self.path, 200)
+
+    def _stream_meter(self):
+        emulator = self.server.emulator
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        emulator.count(self.path, 200)
+
+        interval = 1 / emulator.rate
+        deadline = monotonic()
+        stall = deadline + emulator.stall_after if emulator.stall_after > 0 else None
+        try:
+            while not emulator.stopped.is_set():
+                # keep the connection open without sending rows, like a hanging Envoy
+                if stall is not None and monotonic() >= stall:
+                    logging.info("Stream stalled")
+                    emulator.stopped.wait(emulator.stall_for)
+                    break
+
+                row = b"data: " + json.dumps(emulator.model.meter_frame()).encode() + b"\r\n\r\n"
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(row), row))
+                self.wfile.flush()
+                emulator.count_row()
+
+                # keep the rate stable, even if writing took some time
+                deadline += interval
+                delay = deadline - monotonic()
+                if delay > 0:
+                    sleep(delay)
+                else:
+                    deadline = monotonic()
+        except (BrokenPipeError, ConnectionResetError, ssl.SSLError):
+            logging.info("Stream client disconnected")
+        self.close_connection = True
+
+
+class EnvoyEmulator:
+    """HTTP(S) server that behaves like an Enphase Envoy-S for the endpoints used by the driver."""
+
+    def __init__(
+        self,
+        host="127.0.0.1",
+        port=0,
+        firmware="D5",
+        password="12aB3C4d",
+        token=None,
+        rate=1.0,
+        phases=1,
+        inverters=10,
+        certfile=None,
+        keyfile=None,
+        seed=None,
+        nonce_lifetime=0,
+        etag=False,
+        latency=None,
+        stall_after=0,
+        stall_for=300,
+        session_lifetime=0,
+        jwt_verify_time=0,
+    ):
+        self.firmware = firmware
+        self.password = password
+        self.token = token
+        self.rate = rate
+        # seconds until a digest nonce expires, 0 = never
+        self.nonce_lifetime = nonce_lifetime
+        # send an ETag for the inventory, inverters and events and answer If-None-Match with 304
+        self.etag = etag
+        # seconds to wait before answering a path
+        self.latency = latency or {}
+        # every stream connection stalls after stall_after seconds for stall_for seconds, 0 = never
+        self.stall_after = stall_after
+        self.stall_for = stall_for
+        # seconds until a session cookie of /auth/check_jwt expires, 0 = never
+        self.session_lifetime = session_lifetime
+        # seconds the verification of a bearer token takes, the session cookie is checked without it
+        self.jwt_verify_time = jwt_verify_time
+        self.model = EnvoyModel(phases=phases, inverter_count=inverters, seed=seed)
+        self.stopped = threading.Event()
+
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._rows = 0
+        self._connections = 0
+        self._nonces = {}
+        self._sessions = {}
+        self._jwt_verifications = 0
+
+        self.server = ThreadingHTTPServer((host, port), EnvoyRequestHandler)
+        self.server.daemon_threads = True
+        self.server.emulator = self
+
+        self.schema = "http"
+        if certfile:
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.server.socket = context.wrap_socket(self.server.socket, server_side=True)
+            self.schema = "https"
+
+        self._thread = None
+
+    @property
+    def address(self):
+        host, port = self.server.server_address[:2]
+        return "%s:%d" % (host, port)
+
+    @property
+    def url(self):
+        return "%s://%s" % (self.schema, self.address)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name="Thread-EnvoyEmulator", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.stopped.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def count(self, path, status):
+        key = "%s %d" % (urlparse(path).path, status)
+        with self._lock:
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+    def count_row(self):
+        with self._lock:
+            self._rows += 1
+
+    def count_connection(self):
+        with self._lock:
+            self._connections += 1
+
+    def stats(self):
+        with self._lock:
+            return {"requests": dict(self._requests), "stream_rows": self._rows, "connections": self._connections, "jwt_verifications": self._jwt_verifications}
+
+    def check_token(self, token):
+        """Verify a bearer token like the Envoy, which takes jwt_verify_time seconds for the signature."""
+        with self._lock:
+            self._jwt_verifications += 1
+        if self.jwt_verify_time > 0:
+            sleep(self.jwt_verify_time)
+        return token != "" and (self.token is None or token == self.token) and not token_expired(token)
+
+    def create_session(self):
+        session_id = os.urandom(16).hex()
+        with self._lock:
+            self._sessions[session_id] = monotonic()
+        return session_id
+
+    def check_session(self, session_id):
+        with self._lock:
+            created = self._sessions.get(session_id)
+            if created is not None and self.session_lifetime > 0 and monotonic() - created > self.session_lifetime:
+                del self._sessions[session_id]
+                created = None
+        return created is not None
+
+    def digest_challenge(self, stale=False):
+        nonce = os.urandom(16).hex()
+        with self._lock:
+            self._nonces[nonce] = monotonic()
+        challenge = 'Digest realm="%s", qop="auth", nonce="%s", opaque="%s", algorithm="MD5"' % (DIGEST_REALM, nonce, hashlib.md5(DIGEST_REALM.encode()).hexdigest())
+        return challenge + (", stale=true" if stale else "")
+
+    def check_digest(self, method, header):
+        values = {key: quoted or plain for key, quoted, plain in re.findall(r'(\w+)=(?:"([^"]*)"|([^\s,]*))', header)}
+        if values.get("username") != DIGEST_USER or values.get("realm") != DIGEST_REALM:
+            return False
+
+        with self._lock:
+            created = self._nonces.get(values.get("nonce"))
+        if created is None:
+            return False
+
+        ha1 = hashlib.md5(("%s:%s:%s" % (DIGEST_USER, DIGEST_REALM, self.password)).encode()).hexdigest()
+        ha2 = hashlib.md5(("%s:%s" % (method, values.get("uri", ""))).encode()).hexdigest()
+        if values.get("qop") == "auth":
+            expected = hashlib.md5(("%s:%s:%s:%s:%s:%s" % (ha1, values["nonce"], values.get("nc", ""), values.get("cnonce", ""), "auth", ha2)).encode()).hexdigest()
+        else:
+            expected = hashlib.md5(("%s:%s:%s" % (ha1, values["nonce"], ha2)).encode()).hexdigest()
+
+        if values.get("response") != expected:
+            return False
+        if self.nonce_lifetime > 0 and monotonic() - created > self.nonce_lifetime:
+            with self._lock:
+                self._nonces.pop(values["nonce"], None)
+            return "stale"
+        return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local Enphase Envoy-S emulator for dbus-enphase-envoy")
+    parser.add_argument("--host", default="127.0.0.1", help="address to listen on (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on (default: 8080)")
+    parser.add_argument("--firmware", choices=("D5", "D7"), default="D5", help="D5 = digest authentication, D7 = bearer token (default: D5)")
+    parser.add_argument("--password", default="12aB3C4d", help="installer password for D5 firmware (default: 12aB3C4d)")
+    parser.add_argument("--token", default=None, help="accepted bearer token for D7 firmware (default: any token)")
+    parser.add_argument("--certfile", default=None, help="TLS certificate, enables HTTPS (needed for D7 firmware)")
+    parser.add_argument("--keyfile", default=None, help="TLS private key")
+    parser.add_argument("--rate", type=float, default=1.0, help="/stream/meter rows per second (default: 1)")
+    parser.add_argument("--phases", type=int, choices=(1, 2, 3), default=1, help="number of phases (default: 1)")
+    parser.add_argument("--inverters", type=int, default=10, help="number of microinverters (default: 10)")
+    parser.add_argument("--seed", type=int, default=None, help="seed for reproducible data")
+    parser.add_argument("--nonce-lifetime", type=float, default=0, help="seconds until a digest nonce of D5 firmware expires, 0 = never (default: 0)")
+    parser.add_argument("--etag", action="store_true", help="send ETag headers and answer If-None-Match with 304 Not Modified")
+    parser.add_argument("--latency", action="append", default=[], metavar="PATH=SECONDS", help="answer a path delayed, e.g. /datatab/event_dt.rb=30 (repeatable)")
+    parser.add_argument("--stall-after", type=float, default=0, help="every /stream/meter connection stops sending rows after this many seconds, 0 = never (default: 0)")
+    parser.add_argument("--stall-for", type=float, default=300, help="seconds a stalled stream stays open before it is closed (default: 300)")
+    parser.add_argument("--session-lifetime", type=float, default=0, help="seconds until a session cookie of D7 firmware expires, 0 = never (default: 0)")
+    parser.add_argument("--jwt-verify-time", type=float, default=0, help="seconds D7 firmware needs to verify a bearer token (default: 0)")
+    parser.add_argument("--logging", default="INFO", help="logging level (default: INFO)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, args.logging.upper(), logging.INFO))
+
+    if args.firmware == "D7" and not args.certfile:
+        logging.warning("D7 firmware selected without --certfile. The driver connects to D7 firmware with HTTPS only.")
+
+    emulator = EnvoyEmulator(
+        host=args.host,
+        port=args.port,
+        firmware=args.firmware,
+        password=args.password,
+        token=args.token,
+        rate=args.rate,
+        phases=args.phases,
+        inverters=args.inverters,
+        certfile=args.certfile,
+        keyfile=args.keyfile,
+        seed=args.seed,
+        nonce_lifetime=args.nonce_lifetime,
+        etag=args.etag,
+        latency={path: float(seconds) for path, seconds in (item.rsplit("=", 1) for item in args.latency)},
+        stall_after=args.stall_after,
+        stall_for=args.stall_for,
+        session_lifetime=args.session_lifetime,
+        jwt_verify_time=args.jwt_verify_time,
+    )
+    logging.info(f"Emulating Envoy-S with {args.firmware} firmware on {emulator.url} ({args.phases} phase(s), {args.inverters} microinverters, {args.rate} rows/s)")
+
+    try:
+        emulator.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        emulator.stopped.set()
+        emulator.server.server_close()
+        logging.info("Statistics: " + json.dumps(emulator.stats()))
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())